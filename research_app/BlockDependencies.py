@@ -0,0 +1,1121 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Dataflow between the blocks of a research script, for selective re-execution.
+
+Each block is analyzed for the module-level names it reads and writes. When a script
+changes, we keep the namespace of its previous run and re-run only the blocks that changed,
+the blocks that consume what they write, and whatever else is needed for the namespace to
+end up exactly as a full run would leave it. Every other block keeps its previous displays.
+The same analysis tells us which blocks can run concurrently.
+
+Some effects aren't visible as names, so we model them conservatively:
+    * calls that do I/O, or read the clock, read and write a pseudo-variable IO_STATE,
+      except for calls that only load data, which just read it. Calls that draw random
+      numbers read and write RANDOM_STATE. So such blocks stay ordered relative to each other.
+    * assigning to an attribute or subscript of a name, deleting one, calling a method on it,
+      or passing it to a call counts as reading and writing the name, unless the name holds a
+      module, or the call is to one of a few builtins and methods known not to mutate.
+    * assigning to an attribute of a module, or calling one of its functions that isn't known
+      to leave its state alone, writes a pseudo-variable MODULE_STATE that every block reads,
+      since modules can change how any object behaves or displays.
+    * names may refer to the same objects once one is assigned from an expression reading
+      the other, or both take part in the same call. Modifying one of them modifies them all.
+    * calling a function defined in the script, or using a class defined in it, reads and
+      writes whatever its body does. So does using anything that may refer to it.
+Scripts using 'global', star imports, introspection like 'globals()' and 'exec', or defining
+their own versions of the builtins we trust not to mutate aren't analyzed, and fall back to a
+full run.
+"""
+
+import ast
+import bisect
+import collections
+import threading
+import types
+
+# pseudo-variables standing for state that is hidden from the analysis
+IO_STATE = "<io>"
+RANDOM_STATE = "<random>"
+MODULE_STATE = "<modules>"
+
+# methods that we know don't modify the object they're called on
+PURE_METHODS = frozenset([
+    'all', 'any', 'argmax', 'argmin', 'argsort', 'astype', 'copy', 'count', 'cumsum', 'decode',
+    'describe', 'dot', 'encode', 'endswith', 'find', 'flatten', 'format', 'get', 'head', 'index',
+    'items', 'join', 'keys', 'lower', 'max', 'mean', 'median', 'min', 'nonzero', 'prod', 'ravel',
+    'replace', 'reshape', 'round', 'split', 'startswith', 'std', 'strip', 'sum', 'tail', 'tolist',
+    'transpose', 'upper', 'values', 'var', 'view'
+    ])
+
+# builtins that we know don't modify their arguments, as long as the script doesn't redefine them
+PURE_FUNCTIONS = frozenset([
+    'abs', 'all', 'any', 'bool', 'density', 'dict', 'enumerate', 'float', 'format', 'frozenset',
+    'getattr', 'hasattr', 'hash', 'heatmap', 'hist', 'id', 'int', 'isinstance', 'issubclass', 'len',
+    'list', 'max', 'min', 'plot', 'print', 'range', 'repr', 'reversed', 'round', 'set', 'sorted',
+    'str', 'sum', 'tuple', 'type', 'zip'
+    ])
+
+# modules whose functions we know leave the module's state alone, unless they look like
+# they configure it (see CONFIGURATION_PREFIXES). The state of the I/O and random modules is
+# IO_STATE and RANDOM_STATE.
+PURE_MODULES = frozenset([
+    'bisect', 'cmath', 'collections', 'copy', 'datetime', 'decimal', 'fractions', 'functools',
+    'heapq', 'itertools', 'math', 'numpy', 'operator', 'pandas', 'pytz', 're', 'scipy',
+    'statistics', 'string', 'textwrap'
+    ])
+
+# prefixes of the names of functions that configure the module they belong to
+CONFIGURATION_PREFIXES = ('basicconfig', 'disable', 'enable', 'filterwarnings', 'register', 'reset', 'set',
+                          'simplefilter', 'use')
+
+# keyword arguments that make otherwise pure calls write to one of their arguments
+MUTATING_KEYWORDS = frozenset(['inplace', 'out'])
+
+# modules all of whose functions we treat as doing I/O
+IO_MODULES = frozenset([
+    'csv', 'glob', 'h5py', 'io', 'json', 'os', 'pathlib', 'pickle', 'requests', 'shutil',
+    'socket', 'sqlite3', 'subprocess', 'sys', 'time', 'urllib'
+    ])
+
+# function names that we treat as doing I/O, whatever they're called on
+IO_FUNCTIONS = frozenset([
+    'input', 'open', 'save', 'savemat', 'savetxt', 'savez', 'savez_compressed', 'to_csv',
+    'to_excel', 'to_feather', 'to_hdf', 'to_json', 'to_parquet', 'to_pickle', 'to_sql', 'tofile'
+    ])
+
+# function names that we treat as reading files or the clock, but not changing anything.
+# Names starting with 'read_' count too.
+IO_READ_FUNCTIONS = frozenset([
+    'fromfile', 'genfromtxt', 'load', 'loadmat', 'loadtxt', 'now', 'today', 'urlopen', 'utcnow'
+    ])
+
+# modules all of whose functions we treat as drawing random numbers
+RANDOM_MODULES = frozenset(['random', 'secrets', 'uuid'])
+
+# calls that give code access to the namespace in ways we can't follow
+INTROSPECTION_FUNCTIONS = frozenset(['__import__', 'eval', 'exec', 'globals', 'locals', 'vars'])
+
+# how many blocks we keep analyses for
+MAX_CACHED_ANALYSES = 20000
+
+# how many scripts' namespaces each interpreter keeps for selective re-execution
+DEFAULT_RETAINED_RUNS = 4
+
+
+class Unanalyzable(Exception):
+    """Raised when a block does something our analysis can't follow."""
+
+
+class BlockAnalysis:
+    def __init__(self, uses, writes, receivers, calls, functionEffects, modules, aliases,
+                 methodCalls, moduleNames):
+        # module-level names (and pseudo-variables) whose prior values the block may read
+        self.uses = uses
+
+        # module-level names (and pseudo-variables) the block may assign, delete or modify
+        self.writes = writes
+
+        # names the block modifies through attributes or subscripts. These count as reads and
+        # writes if they don't hold modules, and as writing MODULE_STATE if they do.
+        self.receivers = receivers
+
+        # (name, method) pairs for the calls to methods on names that may modify them. If the
+        # name holds a module, the call is to one of its functions.
+        self.methodCalls = methodCalls
+
+        # names of the functions the block calls directly
+        self.calls = calls
+
+        # a dict from the name of each function the block defines to its FunctionEffects
+        self.functionEffects = functionEffects
+
+        # names the block binds only with 'import' statements, which therefore hold modules
+        self.modules = modules
+
+        # groups of names that may refer to each other's objects after the block runs
+        self.aliases = aliases
+
+        # a dict from each name the block binds with 'import' to the top-level module it imports
+        self.moduleNames = moduleNames
+
+
+class FunctionEffects:
+    """The module-level names a function or class defined in a script reads and writes when used."""
+    def __init__(self, reads, writes, receivers, calls, aliases, methodCalls):
+        self.reads = reads
+        self.writes = writes
+        self.receivers = receivers
+        self.calls = calls
+        self.aliases = aliases
+        self.methodCalls = methodCalls
+
+
+def _dottedName(node):
+    """Return the parts of a dotted name like 'numpy.random.rand', or None."""
+    parts = []
+
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+
+    if not isinstance(node, ast.Name):
+        return None
+
+    parts.append(node.id)
+    return list(reversed(parts))
+
+
+def _rootName(node):
+    while isinstance(node, (ast.Attribute, ast.Subscript)):
+        node = node.value
+
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _boundNames(target):
+    """The names an assignment to 'target' binds or modifies."""
+    if isinstance(target, (ast.Tuple, ast.List)):
+        return [name for element in target.elts for name in _boundNames(element)]
+
+    if isinstance(target, ast.Starred):
+        return _boundNames(target.value)
+
+    name = _rootName(target)
+    return [name] if name is not None else []
+
+
+class _Analyzer(ast.NodeVisitor):
+    """Visits a block in evaluation order, tracking module-level reads and writes."""
+    def __init__(self):
+        self.uses = set()
+        self.writes = set()
+        self.receivers = set()
+        self.methodCalls = set()
+        self.calls = set()
+        self.functionEffects = {}
+        self.moduleNames = {}
+
+        # module-level names bound by 'import', and by anything else
+        self.imports = set()
+        self.otherWrites = set()
+
+        # names definitely assigned so far by the block itself
+        self._assigned = set()
+
+        # how many enclosing branches or loops might not execute
+        self._conditional = 0
+
+        # names written inside branches or loops, which the block reads unless they end up
+        # definitely assigned, since the value after the block may still be the one before it
+        self._maybeWritten = set()
+
+        # the names local to each enclosing function, lambda or comprehension
+        self._scopes = []
+
+        # the reads, writes, receivers, calls, aliases and method calls of the top-level
+        # function or class we're in, if any
+        self._function = None
+
+        # groups of module-level names that may refer to each other's objects
+        self.aliases = []
+
+        # every module-level name the block reads, even after assigning it
+        self._allReads = set()
+
+        # whether the function or block we're in modifies a local name, which may refer to
+        # anything it reads
+        self._modifiesLocals = False
+
+        # sets collecting the module-level names read by the expressions we're in
+        self._collecting = []
+
+    def _isLocal(self, name):
+        return any(name in scope for scope in self._scopes)
+
+    def _read(self, name):
+        if self._isLocal(name):
+            return
+
+        for names in self._collecting:
+            names.add(name)
+
+        if self._function is not None:
+            self._function[0].add(name)
+        else:
+            self._allReads.add(name)
+            if name not in self._assigned:
+                self.uses.add(name)
+
+    def _write(self, name, isImport=False):
+        if self._scopes:
+            self._scopes[-1].add(name)
+            return
+
+        if isImport:
+            self.imports.add(name)
+        else:
+            self.otherWrites.add(name)
+
+        if self._conditional:
+            self._maybeWritten.add(name)
+
+        self._assigned.add(name)
+
+        self.writes.add(name)
+
+    def _modify(self, name):
+        if name is None:
+            return
+
+        if self._isLocal(name):
+            self._modifiesLocals = True
+            return
+
+        if self._function is not None:
+            self._function[2].add(name)
+        else:
+            self.receivers.add(name)
+
+    def _callMethod(self, name, method):
+        if name is None:
+            return
+
+        if self._isLocal(name):
+            self._modifiesLocals = True
+            return
+
+        if self._function is not None:
+            self._function[5].add((name, method))
+        else:
+            self.methodCalls.add((name, method))
+
+    def _hiddenState(self, name, isWrite=True):
+        if self._function is not None:
+            self._function[0].add(name)
+            if isWrite:
+                self._function[1].add(name)
+        else:
+            self.uses.add(name)
+            if isWrite:
+                self.writes.add(name)
+
+    def _call(self, name):
+        if self._isLocal(name):
+            return
+
+        if self._function is not None:
+            self._function[3].add(name)
+        else:
+            self.calls.add(name)
+
+    def _alias(self, names):
+        """Note that module-level 'names' may refer to each other's objects."""
+        if len(names) > 1:
+            (self._function[4] if self._function is not None else self.aliases).append(frozenset(names))
+
+    def _namesReadBy(self, nodes):
+        """Visit 'nodes', returning the module-level names they read."""
+        names = set()
+        self._collecting.append(names)
+
+        for node in nodes:
+            self.visit(node)
+
+        self._collecting.pop()
+        return names
+
+    def _bind(self, targets, values):
+        """Visit assignment 'targets' of 'values', after which they may share objects."""
+        names = self._namesReadBy(values)
+
+        for target in targets:
+            if (isinstance(target, ast.Name) and not self._scopes and target.id in PURE_FUNCTIONS and
+                    any(isinstance(value, (ast.Name, ast.Attribute, ast.Lambda)) for value in values)):
+                raise Unanalyzable(f"redefines {target.id}")
+
+            self.visit(target)
+            names.update(name for name in _boundNames(target) if not self._isLocal(name))
+
+        self._alias(names)
+
+    def _checkNotRedefining(self, name):
+        if not self._scopes and name in PURE_FUNCTIONS:
+            raise Unanalyzable(f"redefines {name}")
+
+    def _startTracking(self):
+        """Start recording the effects of a top-level function or class. Pass the result to _stopTracking."""
+        self._function = (set(), set(), set(), set(), [], set())
+
+        modifiesLocals = self._modifiesLocals
+        self._modifiesLocals = False
+
+        return modifiesLocals
+
+    def _stopTracking(self, modifiesLocals):
+        reads, writes, receivers, calls, aliases, methodCalls = self._function
+
+        if self._modifiesLocals:
+            receivers.update(name for name in reads if not name.startswith("<"))
+
+        self._function = None
+        self._modifiesLocals = modifiesLocals
+
+        return FunctionEffects(
+            frozenset(reads), frozenset(writes), frozenset(receivers), frozenset(calls), tuple(aliases),
+            frozenset(methodCalls)
+            )
+
+    def _conditionally(self, nodes):
+        """Visit 'nodes', which might not execute. Return the names they definitely assign."""
+        assigned = set(self._assigned)
+        self._conditional += 1
+
+        for node in nodes:
+            self.visit(node)
+
+        self._conditional -= 1
+        newlyAssigned = self._assigned - assigned
+        self._assigned = assigned
+
+        return newlyAssigned
+
+    def _afterBranches(self, definitelyAssigned=()):
+        self._assigned.update(definitelyAssigned)
+
+        if not self._conditional:
+            for name in self._maybeWritten - self._assigned:
+                self.uses.add(name)
+            self._maybeWritten = set()
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self._read(node.id)
+        else:
+            # deleting a name fails unless it's bound, so depends on its value
+            if isinstance(node.ctx, ast.Del):
+                self._read(node.id)
+            self._write(node.id)
+
+    def _visitStoredAttributeOrSubscript(self, node):
+        self.generic_visit(node)
+
+        if not isinstance(node.ctx, ast.Load):
+            self._modify(_rootName(node))
+
+    visit_Attribute = _visitStoredAttributeOrSubscript
+    visit_Subscript = _visitStoredAttributeOrSubscript
+
+    def visit_Assign(self, node):
+        self._bind(node.targets, [node.value])
+
+    def visit_AnnAssign(self, node):
+        if node.value is not None:
+            self._bind([node.target], [node.value])
+
+    def visit_AugAssign(self, node):
+        if isinstance(node.target, ast.Name):
+            self._read(node.target.id)
+        self._bind([node.target], [node.value])
+
+    def visit_NamedExpr(self, node):
+        self._bind([node.target], [node.value])
+
+    def visit_For(self, node):
+        # we count the loop variable as assigned, although an empty loop leaves it alone,
+        # because otherwise every block that loops over 'i' would depend on every other one.
+        self._bind([node.target], [node.iter])
+        self._conditionally(node.body + node.orelse)
+        self._afterBranches()
+
+    visit_AsyncFor = visit_For
+
+    def visit_With(self, node):
+        for item in node.items:
+            self._bind([item.optional_vars] if item.optional_vars is not None else [], [item.context_expr])
+
+        for statement in node.body:
+            self.visit(statement)
+
+    visit_AsyncWith = visit_With
+
+    def visit_While(self, node):
+        self.visit(node.test)
+        self._conditionally(node.body + node.orelse)
+        self._afterBranches()
+
+    def visit_If(self, node):
+        self.visit(node.test)
+        self._afterBranches(self._conditionally(node.body) & self._conditionally(node.orelse))
+
+    def visit_Try(self, node):
+        self._conditionally(node.body + node.handlers + node.orelse)
+        self._afterBranches()
+
+        for statement in node.finalbody:
+            self.visit(statement)
+
+    def visit_ExceptHandler(self, node):
+        if node.type is not None:
+            self.visit(node.type)
+        if node.name:
+            self._write(node.name)
+        for statement in node.body:
+            self.visit(statement)
+
+    def visit_IfExp(self, node):
+        self.visit(node.test)
+        self._afterBranches(self._conditionally([node.body]) & self._conditionally([node.orelse]))
+
+    def visit_BoolOp(self, node):
+        self.visit(node.values[0])
+        self._conditionally(node.values[1:])
+        self._afterBranches()
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            name = alias.asname or alias.name.split(".")[0]
+            self._checkNotRedefining(name)
+
+            if not self._scopes:
+                self.moduleNames[name] = alias.name.split(".")[0]
+
+            self._write(name, isImport=True)
+
+    def visit_ImportFrom(self, node):
+        for alias in node.names:
+            if alias.name == "*":
+                raise Unanalyzable("star import")
+            self._checkNotRedefining(alias.asname or alias.name)
+            self._write(alias.asname or alias.name)
+
+    def visit_Global(self, node):
+        raise Unanalyzable("global statement")
+
+    def _visitFunction(self, node, name, body, arguments):
+        for decorator in getattr(node, 'decorator_list', ()):
+            self.visit(decorator)
+
+        for default in arguments.defaults + [d for d in arguments.kw_defaults if d is not None]:
+            self.visit(default)
+
+        # only track the effects of functions defined at the top level of the block, since
+        # those are what other blocks can call. The bodies of lambdas and methods count
+        # against the block itself, which is conservative.
+        isTracked = name is not None and not self._scopes
+        if isTracked:
+            self._checkNotRedefining(name)
+            modifiesLocals = self._startTracking()
+
+        self._scopes.append(set(
+            a.arg for a in
+            getattr(arguments, 'posonlyargs', []) + arguments.args + arguments.kwonlyargs +
+            [a for a in (arguments.vararg, arguments.kwarg) if a is not None]
+            ))
+
+        for statement in body:
+            self.visit(statement)
+
+        self._scopes.pop()
+
+        if isTracked:
+            self.functionEffects[name] = self._stopTracking(modifiesLocals)
+
+        if name is not None:
+            self._write(name)
+
+    def visit_FunctionDef(self, node):
+        self._visitFunction(node, node.name, node.body, node.args)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        self._visitFunction(node, None, [node.body], node.args)
+
+    def visit_ClassDef(self, node):
+        for expr in node.decorator_list + node.bases + [k.value for k in node.keywords]:
+            self.visit(expr)
+
+        # a top-level class has the effects of its body wherever it's used, which is where its
+        # methods get called, as well as here, where its body runs
+        isTracked = not self._scopes
+        if isTracked:
+            self._checkNotRedefining(node.name)
+            modifiesLocals = self._startTracking()
+
+        self._scopes.append(set())
+        for statement in node.body:
+            self.visit(statement)
+        self._scopes.pop()
+
+        if isTracked:
+            effects = self.functionEffects[node.name] = self._stopTracking(modifiesLocals)
+
+            for name in effects.reads:
+                self._read(name)
+            for name in effects.writes:
+                self._hiddenState(name)
+            for name in effects.receivers:
+                self._modify(name)
+            for name, method in effects.methodCalls:
+                self._callMethod(name, method)
+            for name in effects.calls:
+                self._call(name)
+            self.aliases.extend(effects.aliases)
+
+        self._write(node.name)
+
+    def _visitComprehension(self, node, elements):
+        self._scopes.append(set())
+
+        for generator in node.generators:
+            self.visit(generator.iter)
+            self.visit(generator.target)
+            for condition in generator.ifs:
+                self.visit(condition)
+
+        for element in elements:
+            self.visit(element)
+
+        self._scopes.pop()
+
+    def visit_ListComp(self, node):
+        self._visitComprehension(node, [node.elt])
+
+    visit_SetComp = visit_ListComp
+    visit_GeneratorExp = visit_ListComp
+
+    def visit_DictComp(self, node):
+        self._visitComprehension(node, [node.key, node.value])
+
+    def visit_Call(self, node):
+        arguments = node.args + [keyword.value for keyword in node.keywords]
+
+        functionNames = self._namesReadBy([node.func])
+        argumentNames = self._namesReadBy(arguments)
+
+        name = _dottedName(node.func)
+
+        if name is not None and len(name) == 1:
+            if name[0] in INTROSPECTION_FUNCTIONS:
+                raise Unanalyzable(f"call to {name[0]}")
+
+            self._call(name[0])
+
+        if name is not None:
+            if name[0] in RANDOM_MODULES or 'random' in name[1:-1]:
+                self._hiddenState(RANDOM_STATE)
+            elif name[0] in IO_MODULES or name[-1] in IO_FUNCTIONS:
+                self._hiddenState(IO_STATE)
+            elif name[-1] in IO_READ_FUNCTIONS or name[-1].startswith('read_'):
+                self._hiddenState(IO_STATE, isWrite=False)
+
+        if isinstance(node.func, ast.Attribute):
+            isPure = node.func.attr in PURE_METHODS
+        else:
+            isPure = name is not None and len(name) == 1 and name[0] in PURE_FUNCTIONS
+
+        # functions that only move data between files and objects don't modify the objects
+        if name is not None and (name[-1] in IO_FUNCTIONS or name[-1] in IO_READ_FUNCTIONS or
+                name[-1].startswith('read_')):
+            isPure = True
+
+        if not isPure or any(keyword.arg in MUTATING_KEYWORDS for keyword in node.keywords):
+            # the call may modify whatever we pass it, and keep references to it
+            if isinstance(node.func, ast.Attribute):
+                self._callMethod(_rootName(node.func.value), node.func.attr)
+
+            for argument in arguments:
+                root = _rootName(argument.value if isinstance(argument, ast.Starred) else argument)
+                if root is not None and self._isLocal(root):
+                    self._modify(root)
+
+            for argumentName in argumentNames:
+                self._modify(argumentName)
+
+            self._alias(functionNames | argumentNames)
+
+
+def analyzeBlock(block):
+    """Return the BlockAnalysis of CodeBlock 'block'. Raises Unanalyzable if we can't follow it."""
+    analyzer = _Analyzer()
+
+    for statement in ast.parse(block.code).body:
+        analyzer.visit(statement)
+
+    if analyzer._modifiesLocals:
+        # a comprehension or lambda modified a local name, which may refer to anything we read
+        analyzer.receivers.update(name for name in analyzer._allReads if not name.startswith("<"))
+
+    return BlockAnalysis(
+        frozenset(analyzer.uses),
+        frozenset(analyzer.writes),
+        frozenset(analyzer.receivers),
+        frozenset(analyzer.calls),
+        analyzer.functionEffects,
+        frozenset(analyzer.imports - analyzer.otherWrites),
+        tuple(analyzer.aliases),
+        frozenset(analyzer.methodCalls),
+        analyzer.moduleNames
+        )
+
+
+_analysesLock = threading.Lock()
+_analyses = collections.OrderedDict()
+
+
+def analyzeBlocks(blocks):
+    """Return a list of BlockAnalyses for 'blocks', or None if any of them is Unanalyzable."""
+    res = []
+
+    for block in blocks:
+        with _analysesLock:
+            analysis = _analyses.get(block.code)
+            if analysis is not None:
+                _analyses.move_to_end(block.code)
+
+        if analysis is None:
+            try:
+                analysis = analyzeBlock(block)
+            except (Unanalyzable, SyntaxError):
+                return None
+
+            with _analysesLock:
+                _analyses[block.code] = analysis
+                while len(_analyses) > MAX_CACHED_ANALYSES:
+                    _analyses.popitem(last=False)
+
+        res.append(analysis)
+
+    return res
+
+
+class RetainedRun:
+    """The state a script was left in by its last run, which we can update selectively."""
+    def __init__(self, source, blocks, analyses, namespace, displaysPerBlock, initialNamespace):
+        self.source = source
+        self.blocks = blocks
+        self.analyses = analyses
+        self.namespace = namespace
+
+        # the displays produced by each block, in order
+        self.displaysPerBlock = displaysPerBlock
+
+        # the variables every run starts with
+        self.initialNamespace = initialNamespace
+
+        # an _EffectResolver that has seen all of our blocks, once somebody needs it
+        self._resolver = None
+
+    def displays(self):
+        return [display for displays in self.displaysPerBlock for display in displays]
+
+    def resolverAfterScript(self):
+        """An _EffectResolver for code that runs after the script, which the caller may modify."""
+        if self._resolver is None:
+            self._resolver = _EffectResolver(self.analyses, self.namespace)
+            for analysis in self.analyses:
+                self._resolver.resolve(analysis)
+
+        return self._resolver.copy()
+
+
+class RetainedRunCache:
+    """The RetainedRuns of the last few scripts, keyed by whatever identifies a script across edits."""
+    def __init__(self, maxRuns):
+        self.maxRuns = maxRuns
+        self._runs = collections.OrderedDict()
+
+    def pop(self, key):
+        """Remove and return the RetainedRun for 'key', or None. It's up to the caller to put it back."""
+        return self._runs.pop(key, None)
+
+    def put(self, key, run):
+        self._runs[key] = run
+        self._runs.move_to_end(key)
+
+        while len(self._runs) > self.maxRuns:
+            self._runs.popitem(last=False)
+
+
+_ABSENT = object()
+
+
+def isReadOnly(retainedRun, otherAnalyses):
+    """Can blocks with 'otherAnalyses' run after RetainedRun 'retainedRun' without modifying its objects?
+
+    The other blocks may rebind names, which is safe if they run against a copy of the
+    namespace, but mustn't modify the values the namespace refers to, or the state of the
+    modules it uses.
+    """
+    resolver = retainedRun.resolverAfterScript()
+
+    for analysis in otherAnalyses:
+        _, writes = resolver.resolve(analysis)
+
+        if any(name == MODULE_STATE or not name.startswith("<") for name in writes - analysis.writes):
+            return False
+
+    return True
+
+
+class ReexecutionPlan:
+    def __init__(self, rerun, keptDisplays, resets):
+        # for each new block, whether it needs to run
+        self.rerun = rerun
+
+        # for each new block that doesn't need to run, the displays it produced last time
+        self.keptDisplays = keptDisplays
+
+        # a dict from names to the values they need before we run anything. Names that
+        # need to be removed from the namespace map to _ABSENT.
+        self.resets = resets
+
+    def rerunCount(self):
+        return sum(self.rerun)
+
+    def applyResets(self, namespace):
+        for name, value in self.resets.items():
+            if value is _ABSENT:
+                namespace.pop(name, None)
+            else:
+                namespace[name] = value
+
+
+class _EffectResolver:
+    """Resolves receivers, aliases and uses of script-defined functions into plain reads and writes.
+
+    Feed it the analyses of a script's blocks in order. A function or class counts as used
+    wherever its name, or anything that may refer to it, is read, since it may be passed along
+    and called from there. Anything a function reads may be what it returns, so may be
+    referred to by whatever refers to the function. Every block reads MODULE_STATE.
+    """
+    def __init__(self, analyses, namespace):
+        # names that only ever get bound by 'import', so hold modules even before they run
+        self._imported = set()
+        boundOtherwise = set()
+
+        # the top-level module each name bound by 'import' refers to
+        self._moduleNames = {}
+
+        for analysis in analyses:
+            self._imported.update(analysis.modules)
+            boundOtherwise.update(analysis.writes - analysis.modules)
+            self._moduleNames.update(analysis.moduleNames)
+
+        self._imported -= boundOtherwise
+        self._namespace = namespace
+
+        # the FunctionEffects of each function or class defined so far
+        self._functions = {}
+
+        # for each name that may share objects with others, the frozenset of all of them.
+        # Groups only ever grow, which is conservative.
+        self._aliases = {}
+
+    def copy(self):
+        res = _EffectResolver((), self._namespace)
+        res._imported = self._imported
+        res._moduleNames = self._moduleNames
+        res._functions = dict(self._functions)
+        res._aliases = dict(self._aliases)
+        return res
+
+    def _isModule(self, name):
+        return name in self._imported or isinstance(self._namespace.get(name), types.ModuleType)
+
+    def _changesModuleState(self, name, function):
+        """Might calling 'function' of the module held by 'name' change the module's state?"""
+        module = self._namespace.get(name)
+        if isinstance(module, types.ModuleType):
+            moduleName = module.__name__.split(".")[0]
+        else:
+            moduleName = self._moduleNames.get(name, name)
+
+        if moduleName not in PURE_MODULES | IO_MODULES | RANDOM_MODULES:
+            return True
+
+        return function.lower().startswith(CONFIGURATION_PREFIXES)
+
+    def _mergeAliases(self, names):
+        group = set()
+        for name in names:
+            if not self._isModule(name):
+                group.update(self._aliases.get(name, (name,)))
+
+        if len(group) > 1:
+            group = frozenset(group)
+            for name in group:
+                self._aliases[name] = group
+
+    def _closure(self, names):
+        """'names', the names that may refer to their objects, and the reads of any functions among them."""
+        res = set()
+        pending = list(names)
+
+        while pending:
+            name = pending.pop()
+            if name in res or name.startswith("<") or self._isModule(name):
+                continue
+
+            res.add(name)
+            pending.extend(self._aliases.get(name, ()))
+
+            if name in self._functions:
+                pending.extend(self._functions[name].reads)
+                pending.extend(self._functions[name].receivers)
+                pending.extend(receiver for receiver, _ in self._functions[name].methodCalls)
+
+        return res
+
+    def resolve(self, analysis):
+        """Return the (reads, writes) sets of the next block, given its BlockAnalysis."""
+        reads = set(analysis.uses) | {MODULE_STATE}
+        writes = set(analysis.writes)
+        modified = set(analysis.receivers)
+        methodCalls = set(analysis.methodCalls)
+
+        for name in analysis.writes:
+            self._functions.pop(name, None)
+
+        self._functions.update(analysis.functionEffects)
+
+        for group in analysis.aliases:
+            self._mergeAliases(group)
+
+        # the effects of every function the block may end up calling
+        used = analysis.calls | analysis.uses | analysis.receivers | {name for name, _ in methodCalls}
+        for name in self._closure(used):
+            if name in self._functions:
+                effects = self._functions[name]
+                reads.update(effects.reads)
+                writes.update(effects.writes)
+                modified.update(effects.receivers)
+                methodCalls.update(effects.methodCalls)
+                for group in effects.aliases:
+                    self._mergeAliases(group)
+
+        for name, method in methodCalls:
+            if not self._isModule(name):
+                modified.add(name)
+            elif self._changesModuleState(name, method):
+                writes.add(MODULE_STATE)
+
+        if any(self._isModule(name) for name in modified):
+            writes.add(MODULE_STATE)
+
+        for name in self._closure(modified):
+            reads.add(name)
+            writes.add(name)
+
+        return reads, writes
+
+
+def _effectiveReadsAndWrites(analyses, namespace):
+    """Return a list of the (reads, writes) sets of each of 'analyses'. See _EffectResolver."""
+    resolver = _EffectResolver(analyses, namespace)
+    return [resolver.resolve(analysis) for analysis in analyses]
+
+
+def isDeterministic(analyses):
+    """Do blocks with 'analyses' compute the same thing every time, without effects outside their namespace?
+
+    That's the case unless they draw random numbers, or do any I/O, including reading files
+    or the clock, which may give something different next time.
+    """
+    for reads, writes in _effectiveReadsAndWrites(analyses, {}):
+        if RANDOM_STATE in reads or RANDOM_STATE in writes or IO_STATE in reads or IO_STATE in writes:
+            return False
+
+    return True
+
+
+def reproduciblePrefixLength(blocks):
+    """How many of 'blocks', from the start, leave a namespace that depends only on their code?
+
+    Those are the blocks before the first one we can't analyze, or that reads files, the clock
+    or random numbers.
+    """
+    analyses = []
+
+    for block in blocks:
+        analysis = analyzeBlocks([block])
+        if analysis is None:
+            break
+        analyses.extend(analysis)
+
+    for ix, (reads, _) in enumerate(_effectiveReadsAndWrites(analyses, {})):
+        if IO_STATE in reads or RANDOM_STATE in reads:
+            return ix
+
+    return len(analyses)
+
+
+def planReexecution(previous, blocks, analyses, refreshed=()):
+    """Work out which of 'blocks' need to run to bring the namespace of RetainedRun 'previous' up to date.
+
+    'analyses' are the BlockAnalyses of 'blocks'. Blocks reading any of the pseudo-variables
+    in 'refreshed', like IO_STATE, rerun even if nothing else changed. Returns a ReexecutionPlan.
+    """
+    oldBlocks = previous.blocks
+
+    # blocks that are unchanged at either end of the script correspond to their old selves
+    prefix = 0
+    while (prefix < min(len(blocks), len(oldBlocks)) and
+            blocks[prefix].code == oldBlocks[prefix].code):
+        prefix += 1
+
+    suffix = 0
+    while (suffix < min(len(blocks), len(oldBlocks)) - prefix and
+            blocks[-1 - suffix].code == oldBlocks[-1 - suffix].code):
+        suffix += 1
+
+    def oldIndexOf(ix):
+        if ix < prefix:
+            return ix
+        if ix >= len(blocks) - suffix:
+            return ix - len(blocks) + len(oldBlocks)
+        return None
+
+    effects = _effectiveReadsAndWrites(analyses, previous.namespace)
+    oldEffects = _effectiveReadsAndWrites(previous.analyses, previous.namespace)
+
+    # the blocks writing each name, in order, in the old and new versions of the script
+    oldWriters = collections.defaultdict(list)
+    for oldIx, (_, writes) in enumerate(oldEffects):
+        for name in writes:
+            oldWriters[name].append(oldIx)
+
+    writers = collections.defaultdict(list)
+    for ix, (_, writes) in enumerate(effects):
+        for name in writes:
+            writers[name].append(ix)
+
+    # the last old block to write each name, which is the one whose value the namespace holds
+    oldLastWriter = {name: ixes[-1] for name, ixes in oldWriters.items()}
+
+    def lastWriterBefore(writersOfName, ix):
+        position = bisect.bisect_left(writersOfName, ix)
+        return writersOfName[position - 1] if position else None
+
+    rerun = [
+        oldIndexOf(ix) is None or any(name in reads for name in refreshed)
+        for ix, (reads, _) in enumerate(effects)
+        ]
+    resets = {}
+
+    # names whose writers all rerun. Hidden state like "<random>" can't be reset, but a
+    # fresh process wouldn't hold any particular state for it either.
+    restarted = set()
+
+    def reset(name):
+        if name not in resets and not name.startswith("<"):
+            resets[name] = previous.initialNamespace.get(name, _ABSENT)
+
+    def holdsValueOf(name, ix):
+        """Would the namespace hold the value block 'ix' wrote to 'name' if nothing before it reran?"""
+        return (
+            not any(rerun[w] for w in writers[name] if w < ix) and
+            oldLastWriter.get(name) == oldIndexOf(ix)
+            )
+
+    changed = True
+    while changed:
+        changed = False
+
+        def mark(ix):
+            nonlocal changed
+            if not rerun[ix]:
+                rerun[ix] = True
+                changed = True
+
+        for ix, (reads, _) in enumerate(effects):
+            for name in reads:
+                writer = lastWriterBefore(writers[name], ix)
+
+                # a block that doesn't rerun has to see the same inputs it saw last time
+                if not rerun[ix]:
+                    oldWriter = lastWriterBefore(oldWriters[name], oldIndexOf(ix))
+                    if (oldIndexOf(writer) if writer is not None else None) != oldWriter:
+                        mark(ix)
+
+                if writer is not None:
+                    # consumers of a block that reruns have to rerun too
+                    if rerun[writer] and not rerun[ix]:
+                        mark(ix)
+
+                    # a block that reruns needs the value its inputs had the first time around
+                    if rerun[ix] and not rerun[writer] and not holdsValueOf(name, writer):
+                        mark(writer)
+
+                elif rerun[ix] and name in oldLastWriter and name not in restarted:
+                    # the namespace holds a value this block shouldn't see. Start the name
+                    # over, which means every block that writes it has to rerun.
+                    restarted.add(name)
+                    reset(name)
+                    changed = True
+                    for writer in writers[name]:
+                        mark(writer)
+
+        # the namespace has to end up with each name's value from its last writer
+        for name in set(oldLastWriter) | set(writers):
+            if writers[name]:
+                last = writers[name][-1]
+                if not rerun[last] and not holdsValueOf(name, last):
+                    mark(last)
+            else:
+                reset(name)
+
+    keptDisplays = [
+        None if rerun[ix] else previous.displaysPerBlock[oldIndexOf(ix)]
+        for ix in range(len(blocks))
+        ]
+
+    return ReexecutionPlan(rerun, keptDisplays, resets)
+
+
+def blockDependencies(analyses, namespace, included):
+    """For each block, the earlier blocks it has to wait for if they run concurrently.
+
+    'analyses' are the BlockAnalyses of a script's blocks, 'namespace' is what they will run
+    in, and 'included' flags the blocks that will actually run. A block waits for the last
+    included block before it to write anything it reads or writes, and for the included
+    blocks since then that read what it writes. Returns a list of lists of block indices.
+    """
+    lastWriter = {}
+    readersSinceWrite = collections.defaultdict(list)
+    res = []
+
+    for ix, (reads, writes) in enumerate(_effectiveReadsAndWrites(analyses, namespace)):
+        if not included[ix]:
+            res.append([])
+            continue
+
+        waitsFor = set()
+
+        for name in reads | writes:
+            if name in lastWriter:
+                waitsFor.add(lastWriter[name])
+
+        for name in writes:
+            waitsFor.update(readersSinceWrite.pop(name, ()))
+            lastWriter[name] = ix
+
+        for name in reads - writes:
+            readersSinceWrite[name].append(ix)
+
+        res.append(sorted(waitsFor))
+
+    return res
@@ -0,0 +1,267 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import numpy
+import random
+import tempfile
+import textwrap
+import types
+import unittest
+
+from research_app.BlockDependencies import (
+    RetainedRunCache, analyzeBlock, analyzeBlocks, blockDependencies, planReexecution
+    )
+from research_app.ResearchBackend import ResearchBackend
+
+
+class BlockDependenciesTest(unittest.TestCase):
+    def setUp(self):
+        self._tempDir = tempfile.TemporaryDirectory()
+        self.runtimeConfig = types.SimpleNamespace(serviceTemporaryStorageRoot=self._tempDir.name)
+        self.retainedRuns = RetainedRunCache(1)
+
+    def tearDown(self):
+        self._tempDir.cleanup()
+
+    def evaluate(self, script, retainedRuns=None):
+        return ResearchBackend.evaluateResearchScript(
+            self.runtimeConfig, script, None, retainedRuns=retainedRuns, scriptKey="script"
+            )
+
+    def plan(self, script):
+        """Return the indices of the blocks of 'script' that would rerun after the retained run."""
+        blocks = ResearchBackend.breakCodeIntoSegments(script)
+        plan = planReexecution(
+            self.retainedRuns.pop("script"), blocks, [analyzeBlock(b) for b in blocks]
+            )
+        return [ix for ix, rerun in enumerate(plan.rerun) if rerun]
+
+    def test_analysis(self):
+        analysis = analyzeBlock(ResearchBackend.breakCodeIntoSegments(textwrap.dedent("""
+            for i in range(n):
+                if i:
+                    total = total + scale
+                xs.append(i)
+            """))[0])
+
+        self.assertEqual(analysis.uses, {'range', 'n', 'total', 'scale', 'xs'})
+        self.assertEqual(analysis.writes, {'i', 'total'})
+        self.assertEqual(analysis.receivers, {'i'})
+        self.assertEqual(analysis.methodCalls, {('xs', 'append')})
+
+    def test_only_consumers_rerun(self):
+        script = textwrap.dedent("""
+            a = 1
+            b = 2
+            print(a)
+            print(b)
+            """)
+
+        self.evaluate(script, self.retainedRuns)
+        self.assertEqual(self.plan(script.replace("a = 1", "a = 3")), [0, 2])
+
+    def test_mutation_reruns_definition(self):
+        script = "xs = [1]\nys = 2\nxs.append(1)\nprint(xs)\n"
+
+        self.evaluate(script, self.retainedRuns)
+        self.assertEqual(self.plan(script.replace("append(1)", "append(3)")), [0, 2, 3])
+
+        # 'ys' may have been modified by the call it was passed to
+        script = "xs = [1]\nys = [2]\nxs.append(ys)\nprint(xs)\n"
+
+        self.evaluate(script, self.retainedRuns)
+        self.assertEqual(self.plan(script.replace("append(ys)", "append(3)")), [0, 1, 2, 3])
+
+    def assertSelectiveMatchesFull(self, script, editedScript):
+        self.evaluate(script, self.retainedRuns)
+
+        error, displays = self.evaluate(editedScript, self.retainedRuns)
+        expectedError, expectedDisplays = self.evaluate(editedScript)
+
+        self.assertIsNone(expectedError)
+        self.assertIsNone(error)
+        self.assertEqual([d.str for d in displays], [d.str for d in expectedDisplays])
+
+    def test_modifying_an_alias_modifies_the_original(self):
+        script = "a = [1, 2]\nb = a\nb.append(3)\nprint(a)\n"
+        self.assertSelectiveMatchesFull(script, script.replace("append(3)", "append(4)"))
+
+        script = "a = [[1]]\nb = []\nb.append(a[0])\nb[0].append(2)\nprint(a)\n"
+        self.assertSelectiveMatchesFull(script, script.replace("append(2)", "append(3)"))
+
+    def test_functions_modifying_their_arguments(self):
+        script = textwrap.dedent("""
+            data = [0]
+            def addOne(lst):
+                lst.append(1)
+
+            addOne(data)
+            print(data)
+            """)
+
+        self.assertSelectiveMatchesFull(script, script.replace("addOne(data)", "addOne(data)\naddOne(data)"))
+
+    def test_classes_count_as_used_where_their_methods_are_called(self):
+        script = textwrap.dedent("""
+            class A:
+                def f(self):
+                    return scale
+
+            scale = 2
+            obj = A()
+            print(A().f())
+            print(obj.f())
+            """)
+
+        self.assertSelectiveMatchesFull(script, script.replace("scale = 2", "scale = 3"))
+
+    def test_calls_writing_to_out_arguments(self):
+        script = "x = numpy.ones(1)\nnumpy.add(x, 2, out=x)\nprint(x[0])\n"
+        self.assertSelectiveMatchesFull(script, script.replace("add(x, 2", "add(x, 5"))
+
+    def test_configuring_modules_reruns_blocks_using_them(self):
+        printOptions = numpy.get_printoptions()
+
+        try:
+            script = "x = numpy.array([1.23456])\nnumpy.set_printoptions(precision=2)\nprint(x)\n"
+            self.assertSelectiveMatchesFull(script, script.replace("precision=2", "precision=4"))
+        finally:
+            numpy.set_printoptions(**printOptions)
+
+    def test_assigning_module_attributes_reruns_blocks_using_them(self):
+        script = textwrap.dedent("""
+            import types
+            settings = types.ModuleType('settings')
+            xs = [1]
+            settings.scale = 2
+            print(settings.scale * len(xs))
+            """)
+
+        self.assertSelectiveMatchesFull(script, script.replace("scale = 2", "scale = 3"))
+
+    def test_redefining_trusted_builtins_isnt_analyzed(self):
+        blocks = ResearchBackend.breakCodeIntoSegments("def len(x):\n    x.append(1)\n\nlen(xs)\n")
+        self.assertIsNone(analyzeBlocks(blocks))
+
+    def test_random_state_orders_blocks(self):
+        script = "x = numpy.random.rand()\ny = 1\nz = numpy.random.rand()\n"
+
+        self.evaluate(script, self.retainedRuns)
+        self.assertEqual(self.plan(script.replace("x = ", "w = ")), [0, 2])
+
+    def test_snippets_use_the_retained_namespace(self):
+        script = "xs = [1]\nxs.append(2)\n"
+        self.evaluate(script, self.retainedRuns)
+        retained = self.retainedRuns.pop("script")
+        self.retainedRuns.put("script", retained)
+
+        error, displays = ResearchBackend.evaluateResearchScript(
+            self.runtimeConfig, script, "len(xs)", retainedRuns=self.retainedRuns, scriptKey="script"
+            )
+
+        self.assertIsNone(error)
+        self.assertEqual([d.str for d in displays], ['2'])
+        self.assertIs(self.retainedRuns.pop("script"), retained)
+
+        # a snippet that modifies the namespace invalidates it
+        self.retainedRuns.put("script", retained)
+        ResearchBackend.evaluateResearchScript(
+            self.runtimeConfig, script, "xs.append(3)", retainedRuns=self.retainedRuns, scriptKey="script"
+            )
+        self.assertIsNone(self.retainedRuns.pop("script"))
+
+    def test_snippets_modifying_objects_through_functions_arent_read_only(self):
+        script = "data = [0]\ndef addOne(lst):\n    lst.append(1)\n"
+        self.evaluate(script, self.retainedRuns)
+
+        ResearchBackend.evaluateResearchScript(
+            self.runtimeConfig, script, "addOne(data)", retainedRuns=self.retainedRuns, scriptKey="script"
+            )
+        self.assertIsNone(self.retainedRuns.pop("script"))
+
+    def test_evaluating_an_unchanged_script_rereads_files(self):
+        path = self._tempDir.name + "/values.npy"
+        numpy.save(path, numpy.arange(3))
+        script = f"xs = [1]\nvalues = numpy.load({path!r})\nprint(values.sum())\n"
+
+        self.assertEqual([d.str for d in self.evaluate(script, self.retainedRuns)[1]], ['3'])
+        retained = self.retainedRuns.pop("script")
+        xs = retained.namespace['xs']
+        self.retainedRuns.put("script", retained)
+
+        numpy.save(path, numpy.arange(4))
+        self.assertEqual([d.str for d in self.evaluate(script, self.retainedRuns)[1]], ['6'])
+
+        # blocks that don't read anything from outside didn't rerun
+        self.assertIs(self.retainedRuns.pop("script").namespace['xs'], xs)
+
+    def test_nocache_forces_a_full_run(self):
+        script = "xs = [1]\nnocache()\nprint(len(xs))\n"
+
+        self.evaluate(script, self.retainedRuns)
+        retained = self.retainedRuns.pop("script")
+        self.retainedRuns.put("script", retained)
+
+        self.evaluate(script, self.retainedRuns)
+        self.assertIsNot(self.retainedRuns.pop("script").namespace['xs'], retained.namespace['xs'])
+
+    def test_selective_matches_full_runs(self):
+        lines = [
+            "a = 1", "a = 2", "b = a + 1", "print(a)", "print(b)", "xs = [a]", "xs.append(b)",
+            "print(xs)", "def f():\n    return a * 2", "print(f())", "if a > 1:\n    c = a",
+            "print(c)", "for i in range(a):\n    b = b + i", "del a", "ys = [x for x in xs]",
+            "print(len(ys))", "d = {}", "d['k'] = b", "print(d)", "def g():\n    xs.append(1)",
+            "g()", "zs = xs", "zs.append(a)", "def h(lst):\n    lst.append(2)", "h(xs)",
+            "class C:\n    def m(self):\n        return a", "print(C().m())", "arr = numpy.zeros(2)",
+            "numpy.add(arr, a, out=arr)", "print(arr)",
+            ]
+
+        rng = random.Random(1)
+        script = []
+
+        for _ in range(300):
+            ix = rng.randrange(len(script) + 1)
+            edit = rng.randrange(3)
+
+            if edit == 0 or not script:
+                script.insert(ix, rng.choice(lines))
+            elif edit == 1:
+                del script[min(ix, len(script) - 1)]
+            else:
+                script[min(ix, len(script) - 1)] = rng.choice(lines)
+
+            source = "\n".join(script) + "\n"
+
+            error, displays = self.evaluate(source, self.retainedRuns)
+            expectedError, expectedDisplays = self.evaluate(source)
+
+            self.assertEqual(error is None, expectedError is None, source)
+            self.assertEqual([d.str for d in displays], [d.str for d in expectedDisplays], source)
+
+    def test_block_dependencies(self):
+        blocks = ResearchBackend.breakCodeIntoSegments(textwrap.dedent("""
+            import os
+            a = numpy.load('a.npy')
+            b = numpy.load('b.npy')
+            c = a + b
+            a = 0
+            numpy.save('c.npy', c)
+            d = numpy.load('c.npy')
+            os.getcwd()
+            """))
+
+        self.assertEqual(
+            blockDependencies(analyzeBlocks(blocks), {'numpy': numpy}, [True] * len(blocks)),
+            [[], [], [], [1, 2], [1, 3], [1, 2, 3], [5], [0, 5, 6]]
+            )
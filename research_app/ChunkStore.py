@@ -0,0 +1,263 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+A content-addressed store for the large arrays that plots carry.
+
+Rather than serializing every array a Display.Plot holds into object_database, where every
+subscribed frontend gets a copy, the backend writes arrays above CHUNK_THRESHOLD_BYTES to
+disk once, as .npy files named after a hash of their contents, and the display holds a
+ChunkRef in their place. Frontends memory-map the files, so displaying a plot doesn't copy
+its data at all. Backends and frontends need to see the same directory, which means the
+same host unless it lives on shared storage.
+
+Chunks nobody references are deleted by 'collectGarbage', which the backend calls with the
+chunks that evaluations and the result cache still refer to. Chunks younger than a grace
+period survive regardless, since an evaluation may be about to publish them.
+"""
+
+from typed_python import NamedTuple, TupleOf
+from research_app.Displayable import Display
+import research_app.PlotPyramid as PlotPyramid
+import research_app.HeatmapPyramid as HeatmapPyramid
+import research_app.Histograms as Histograms
+
+import hashlib
+import logging
+import numpy
+import os
+import tempfile
+import time
+import uuid
+
+# arrays smaller than this stay inline in their displays
+CHUNK_THRESHOLD_BYTES = 64 * 1024
+
+# how many bytes of an array we hash and write at a time
+WRITE_CHUNK_BYTES = 64 * 1024 ** 2
+
+# how long a chunk survives after it was last written, whether or not anything refers to it
+CHUNK_GRACE_SECONDS = 3600.0
+
+# how often backends look for unreferenced chunks
+CHUNK_GC_INTERVAL = 600.0
+
+
+ChunkRef = NamedTuple(root=str, hash=str, dtype=str, shape=TupleOf(int))
+
+
+def defaultRoot():
+    """Where chunks go unless the service is configured otherwise."""
+    return os.path.join(tempfile.gettempdir(), "research_app_chunks")
+
+
+def chunkPath(root, hash):
+    return os.path.join(root, hash[:2], hash + ".npy")
+
+
+def mapArrays(value, f):
+    """Return plot argument 'value' with 'f' applied to every array (or ChunkRef) it's made of."""
+    if isinstance(value, HeatmapPyramid.HeatmapPyramid):
+        return HeatmapPyramid.HeatmapPyramid(
+            z=f(value.z),
+            reduction=value.reduction,
+            levels=[f(level) for level in value.levels],
+            zmin=value.zmin,
+            zmax=value.zmax
+            )
+
+    if isinstance(value, Histograms.Histogram):
+        return Histograms.Histogram(values=f(value.values), edges=f(value.edges), counts=f(value.counts))
+
+    if isinstance(value, Histograms.Density):
+        return Histograms.Density(
+            x=f(value.x),
+            y=f(value.y),
+            xEdges=f(value.xEdges),
+            yEdges=f(value.yEdges),
+            counts=f(value.counts)
+            )
+
+    if isinstance(value, PlotPyramid.PlotSeries):
+        return PlotPyramid.PlotSeries(
+            x=None if value.x is None else f(value.x),
+            y=f(value.y),
+            levels=[f(level) for level in value.levels]
+            )
+
+    return f(value)
+
+
+def _resolveRef(value):
+    if not isinstance(value, ChunkRef):
+        return value
+
+    return numpy.load(chunkPath(value.root, value.hash), mmap_mode='r', allow_pickle=False)
+
+
+def resolve(value):
+    """Return plot argument 'value' with the chunks it refers to memory-mapped read-only.
+
+    Raises OSError if a chunk is gone.
+    """
+    return mapArrays(value, _resolveRef)
+
+
+def referencedHashes(display, into=None):
+    """Add the hash of every chunk Display 'display' refers to into set 'into', and return it."""
+    if into is None:
+        into = set()
+
+    if display.matches.Displays:
+        for child in display.displays:
+            referencedHashes(child, into)
+
+    def collect(value):
+        if isinstance(value, ChunkRef):
+            into.add(value.hash)
+        return value
+
+    if display.matches.Plot:
+        for value in list(display.args) + list(display.kwargs.values()):
+            mapArrays(value, collect)
+
+    if display.matches.Heatmap:
+        mapArrays(display.heatmap, collect)
+
+    if display.matches.Histogram:
+        mapArrays(display.histogram, collect)
+
+    if display.matches.Density:
+        mapArrays(display.density, collect)
+
+    return into
+
+
+class ChunkStore:
+    def __init__(self, root):
+        """A store keeping its chunks in directory 'root', which we create if need be."""
+        self.root = root
+        self._logger = logging.getLogger(__name__)
+
+        os.makedirs(root, exist_ok=True)
+
+    def put(self, array):
+        """Write numpy array 'array' to the store, unless it's already there, and return its ChunkRef.
+
+        We read 'array' WRITE_CHUNK_BYTES at a time, so it may be a memmap bigger than memory.
+        """
+        flat = array.reshape(-1) if array.ndim != 1 else array
+        step = max(1, WRITE_CHUNK_BYTES // max(1, array.dtype.itemsize))
+
+        def pieces():
+            for start in range(0, len(flat), step):
+                yield numpy.ascontiguousarray(flat[start:start + step]).view(numpy.uint8)
+
+        hasher = hashlib.blake2b(digest_size=20)
+        hasher.update(f"{array.dtype.str}:{array.shape}:".encode())
+        for piece in pieces():
+            hasher.update(piece)
+        hash = hasher.hexdigest()
+
+        path = chunkPath(self.root, hash)
+
+        if os.path.exists(path):
+            # mark it as recently written, so it can't get collected before we publish it
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # write under a temporary name, so that nobody ever maps a partial file
+            tempPath = f"{path}.{uuid.uuid4().hex}.tmp"
+
+            with open(tempPath, "wb") as f:
+                numpy.lib.format.write_array_header_1_0(
+                    f,
+                    {'descr': numpy.lib.format.dtype_to_descr(array.dtype), 'fortran_order': False, 'shape': array.shape}
+                    )
+                for piece in pieces():
+                    f.write(piece)
+
+            os.replace(tempPath, path)
+
+        return ChunkRef(root=self.root, hash=hash, dtype=array.dtype.str, shape=array.shape)
+
+    def externalize(self, display):
+        """Return Display 'display' with the large arrays its plots hold moved into the store."""
+        if display.matches.Displays:
+            return Display.Displays(
+                displays=[self.externalize(child) for child in display.displays],
+                title=display.title
+                )
+
+        if display.matches.Plot:
+            return Display.Plot(
+                args=[self._externalizeValue(value) for value in display.args],
+                kwargs={name: self._externalizeValue(value) for name, value in display.kwargs.items()},
+                title=display.title
+                )
+
+        if display.matches.Heatmap:
+            return Display.Heatmap(heatmap=self._externalizeValue(display.heatmap), title=display.title)
+
+        if display.matches.Histogram:
+            return Display.Histogram(histogram=self._externalizeValue(display.histogram), title=display.title)
+
+        if display.matches.Density:
+            return Display.Density(density=self._externalizeValue(display.density), title=display.title)
+
+        return display
+
+    def _externalizeValue(self, value):
+        return mapArrays(value, self._externalizeArray)
+
+    def _externalizeArray(self, value):
+        if (
+                isinstance(value, numpy.ndarray)
+                and not value.dtype.hasobject
+                and value.nbytes >= CHUNK_THRESHOLD_BYTES
+                ):
+            return self.put(value)
+
+        return value
+
+    def collectGarbage(self, liveHashes, graceSeconds=CHUNK_GRACE_SECONDS):
+        """Delete the chunks not in 'liveHashes' that nobody wrote in the last 'graceSeconds'.
+
+        Returns the number of chunks deleted.
+        """
+        cutoff = time.time() - graceSeconds
+        deleted = 0
+
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+
+                # leftover temporary files are garbage too, once they're old enough
+                hash = filename[:-len(".npy")] if filename.endswith(".npy") else None
+
+                if hash in liveHashes:
+                    continue
+
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                        deleted += 1
+                except FileNotFoundError:
+                    pass
+
+        if deleted:
+            self._logger.info("Deleted %s unreferenced chunks.", deleted)
+
+        return deleted
@@ -0,0 +1,120 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import numpy
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import research_app.ChunkStore as ChunkStoreModule
+from research_app.ChunkStore import ChunkStore, ChunkRef, resolve, referencedHashes, chunkPath
+from research_app.Displayable import Display
+import research_app.HeatmapPyramid as HeatmapPyramid
+import research_app.Histograms as Histograms
+
+
+class ChunkStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.store = ChunkStore(self.tempDir.name)
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+    def test_chunks_map_back_without_copying(self):
+        array = numpy.arange(100000, dtype='float64')
+        ref = self.store.put(array)
+
+        mapped = resolve(ref)
+
+        self.assertIsInstance(mapped, numpy.memmap)
+        self.assertTrue((mapped == array).all())
+        self.assertEqual(tuple(ref.shape), (100000,))
+
+    def test_big_arrays_are_written_in_pieces(self):
+        table = numpy.zeros(100000, dtype=[('t', 'datetime64[ns]'), ('price', 'f8')])
+        table['t'] = numpy.arange(100000).astype('datetime64[ns]')
+        table['price'] = numpy.random.rand(100000)
+
+        wholeRef = self.store.put(numpy.ascontiguousarray(table['price']))
+
+        with unittest.mock.patch.object(ChunkStoreModule, 'WRITE_CHUNK_BYTES', 1000):
+            os.remove(chunkPath(wholeRef.root, wholeRef.hash))
+
+            # columns of tables aren't contiguous
+            ref = self.store.put(table['price'])
+            timestampsRef = self.store.put(table['t'])
+
+        self.assertEqual(ref.hash, wholeRef.hash)
+        self.assertTrue((resolve(ref) == table['price']).all())
+        self.assertTrue((resolve(timestampsRef) == table['t']).all())
+
+    def test_identical_arrays_share_a_chunk(self):
+        first = self.store.put(numpy.ones(20000))
+        second = self.store.put(numpy.ones(20000))
+
+        self.assertEqual(first.hash, second.hash)
+        self.assertNotEqual(first.hash, self.store.put(numpy.ones(20000, dtype='float32')).hash)
+
+    def test_only_large_arrays_move_out_of_plots(self):
+        large = numpy.arange(100000)
+        small = numpy.arange(10)
+
+        plot = Display.Plot(args=(large, small), kwargs={'named': large}, title="")
+        externalized = self.store.externalize(Display.Displays(displays=(plot,), title="t"))
+
+        inner = externalized.displays[0]
+        self.assertIsInstance(inner.args[0], ChunkRef)
+        self.assertIs(inner.args[1], small)
+        self.assertIsInstance(inner.kwargs['named'], ChunkRef)
+        self.assertEqual(referencedHashes(externalized), {inner.args[0].hash})
+
+    def test_heatmaps_move_out_too(self):
+        heatmap = HeatmapPyramid.heatmapFor(numpy.random.rand(600, 300))
+        externalized = self.store.externalize(Display.Heatmap(heatmap=heatmap, title=""))
+
+        self.assertIsInstance(externalized.heatmap.z, ChunkRef)
+        self.assertIsInstance(externalized.heatmap.levels[0], ChunkRef)
+        # the matrix and both its levels
+        self.assertEqual(len(referencedHashes(externalized)), 3)
+
+        resolved = resolve(externalized.heatmap)
+        self.assertTrue((resolved.z == heatmap.z).all())
+        self.assertEqual(resolved.zmax, heatmap.zmax)
+
+    def test_histograms_keep_only_their_bins_inline(self):
+        histogram = Histograms.histogramFor(numpy.random.randn(100000))
+        externalized = self.store.externalize(Display.Histogram(histogram=histogram, title=""))
+
+        # the sorted values move out, and the bins stay in the display
+        self.assertIsInstance(externalized.histogram.values, ChunkRef)
+        self.assertNotIsInstance(externalized.histogram.counts, ChunkRef)
+
+        resolved = resolve(externalized.histogram)
+        self.assertTrue((resolved.values == histogram.values).all())
+
+    def test_garbage_collection_keeps_live_and_recent_chunks(self):
+        live = self.store.put(numpy.zeros(20000))
+        dead = self.store.put(numpy.ones(20000))
+        recent = self.store.put(numpy.arange(20000))
+
+        for ref in (live, dead):
+            os.utime(chunkPath(self.store.root, ref.hash), (0, 0))
+
+        self.assertEqual(self.store.collectGarbage({live.hash}), 1)
+
+        self.assertTrue(os.path.exists(chunkPath(self.store.root, live.hash)))
+        self.assertFalse(os.path.exists(chunkPath(self.store.root, dead.hash)))
+        self.assertTrue(os.path.exists(chunkPath(self.store.root, recent.hash)))
@@ -0,0 +1,276 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Incremental segmentation of research scripts into module-level CodeBlocks.
+
+Each top-level statement starts a block, which runs until the next one starts. We remember
+the segmentation of recent buffers. When asked about a buffer that differs from the last
+one by an edit, we re-parse only the top-level statements the edit touched: the statement
+just before the first changed line, through to the first statement that starts after the
+last changed line. If that stretch doesn't parse on its own, we parse the whole buffer.
+"""
+
+from typed_python import NamedTuple, Tuple
+
+import ast
+import collections
+import numpy
+import threading
+import traceback
+
+Error = NamedTuple(error=str, line=int, trace = str)
+
+CodeBlock = NamedTuple(code=str, line_range=Tuple(int,int))
+
+# how many buffers we remember segmentations for
+MAX_CACHED_SEGMENTATIONS = 32
+
+# how many characters we compare at a time when looking for the extent of an edit
+_COMPARISON_CHUNK = 4096
+
+
+class _Segmentation:
+    def __init__(self, source, lineCount, starts, offsets, blocks):
+        self.source = source
+        self.lineCount = lineCount
+
+        # arrays of the first line of each top-level statement, and the character offset of that line
+        self.starts = starts
+        self.offsets = offsets
+
+        self.blocks = blocks
+
+
+def _blocksFor(source, starts, offsets, endLine, endOffset):
+    """Build CodeBlocks for statements starting at 'starts' and 'offsets' of 'source'.
+
+    The last of them runs until line 'endLine', which starts at character 'endOffset'.
+    """
+    blocks = []
+
+    for i in range(len(starts)):
+        if i + 1 < len(starts):
+            nextLine, nextOffset = starts[i+1], offsets[i+1]
+        else:
+            nextLine, nextOffset = endLine, endOffset
+
+        blocks.append(
+            CodeBlock(code=source[offsets[i]:nextOffset - 1], line_range=(int(starts[i]), int(nextLine)))
+            )
+
+    return blocks
+
+
+def _statementStarts(source, firstLine=1, firstOffset=0):
+    """Parse 'source', and return the lines and offsets at which its top-level statements start.
+
+    'source' is assumed to start at line 'firstLine' and character 'firstOffset' of the buffer.
+    Raises SyntaxError if it doesn't parse.
+    """
+    statements = ast.parse(source).body
+
+    if not statements:
+        return numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)
+
+    # the character offset at which each line of 'source' starts
+    lineOffsets = [0]
+    for line in source.split("\n"):
+        lineOffsets.append(lineOffsets[-1] + len(line) + 1)
+
+    starts = []
+    offsets = []
+
+    for statement in statements:
+        # decorators belong to the statement they decorate
+        line = min([statement.lineno] + [d.lineno for d in getattr(statement, 'decorator_list', ())])
+
+        starts.append(line + firstLine - 1)
+        offsets.append(lineOffsets[line - 1] + firstOffset)
+
+    return numpy.array(starts, dtype=int), numpy.array(offsets, dtype=int)
+
+
+def _commonPrefixLength(a, b):
+    limit = min(len(a), len(b))
+    lo = 0
+
+    while lo < limit and a[lo:lo + _COMPARISON_CHUNK] == b[lo:lo + _COMPARISON_CHUNK]:
+        lo += _COMPARISON_CHUNK
+
+    hi = min(lo + _COMPARISON_CHUNK, limit)
+
+    # binary search for the first difference within [lo, hi)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+
+    return lo
+
+
+def _commonSuffixLength(a, b, limit):
+    length = 0
+
+    while length < limit:
+        step = min(_COMPARISON_CHUNK, limit - length)
+        if a[len(a) - length - step:len(a) - length] != b[len(b) - length - step:len(b) - length]:
+            break
+        length += step
+    else:
+        return length
+
+    lo, hi = length, length + step - 1
+
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:len(a) - length] == b[len(b) - mid:len(b) - length]:
+            lo = mid
+        else:
+            hi = mid - 1
+
+    return lo
+
+
+class SegmentationCache:
+    def __init__(self, maxSize=MAX_CACHED_SEGMENTATIONS):
+        self.maxSize = maxSize
+        self._lock = threading.Lock()
+        self._segmentations = collections.OrderedDict()
+
+    def segment(self, source):
+        """Break 'source' into a list of CodeBlocks, or return an Error if it doesn't parse."""
+        with self._lock:
+            segmentation = self._segmentations.get(source)
+
+            if segmentation is not None:
+                self._segmentations.move_to_end(source)
+                return list(segmentation.blocks)
+
+            previous = next(reversed(self._segmentations.values()), None)
+
+        segmentation = None
+
+        if previous is not None:
+            try:
+                segmentation = self._segmentIncrementally(previous, source)
+            except SyntaxError:
+                segmentation = None
+
+        if segmentation is None:
+            try:
+                starts, offsets = _statementStarts(source)
+            except SyntaxError as e:
+                return Error(error=e.args[0], line=e.args[1][1], trace=traceback.format_exc())
+
+            lineCount = source.count("\n") + 1
+
+            segmentation = _Segmentation(
+                source, lineCount, starts, offsets,
+                _blocksFor(source, starts, offsets, lineCount + 1, len(source) + 1)
+                )
+
+        with self._lock:
+            self._segmentations[source] = segmentation
+
+            while len(self._segmentations) > self.maxSize:
+                self._segmentations.popitem(last=False)
+
+        return list(segmentation.blocks)
+
+    def _segmentIncrementally(self, previous, source):
+        """Segment 'source' by re-parsing only the part that differs from 'previous'.
+
+        Raises SyntaxError if the re-parsed part doesn't parse on its own.
+        """
+        old = previous.source
+
+        prefixChars = _commonPrefixLength(old, source)
+        suffixChars = _commonSuffixLength(old, source, min(len(old), len(source)) - prefixChars)
+
+        # the number of lines that are identical at the start of both versions, and the number
+        # of lines that are identical at the end of both versions.
+        prefixLines = source.count("\n", 0, prefixChars)
+        suffixLines = source.count("\n", len(source) - suffixChars)
+
+        lineDelta = (
+            source.count("\n", prefixChars, len(source) - suffixChars) -
+            old.count("\n", prefixChars, len(old) - suffixChars)
+            )
+        charDelta = len(source) - len(old)
+
+        # re-parse from the last statement starting within the unchanged prefix, since the
+        # edit may extend it, up to the first statement starting within the unchanged suffix.
+        keptPrefix = max(int(numpy.searchsorted(previous.starts, prefixLines, side='right')) - 1, 0)
+
+        if len(previous.starts) and previous.starts[keptPrefix] <= prefixLines:
+            reparseLine, reparseOffset = int(previous.starts[keptPrefix]), int(previous.offsets[keptPrefix])
+            resyncStatement = keptPrefix + 1
+        else:
+            reparseLine, reparseOffset = 1, 0
+            resyncStatement = 0
+
+        resyncStatement = max(
+            resyncStatement,
+            int(numpy.searchsorted(previous.starts, previous.lineCount - suffixLines, side='right'))
+            )
+
+        if resyncStatement < len(previous.starts):
+            resyncLine = int(previous.starts[resyncStatement]) + lineDelta
+            resyncOffset = int(previous.offsets[resyncStatement]) + charDelta
+        else:
+            resyncLine = previous.lineCount + lineDelta + 1
+            resyncOffset = len(source) + 1
+
+        starts, offsets = _statementStarts(source[reparseOffset:resyncOffset], reparseLine, reparseOffset)
+
+        if reparseLine > 1 and (not len(starts) or starts[0] != reparseLine):
+            # the block before the stretch we re-parsed would have changed too
+            raise SyntaxError("Edit changed the start of the first re-parsed statement.")
+
+        # blocks entirely before or after the re-parsed stretch keep their code
+        suffixBlocks = previous.blocks[resyncStatement:]
+
+        if lineDelta:
+            suffixBlocks = [
+                CodeBlock(
+                    code=block.code,
+                    line_range=(block.line_range[0] + lineDelta, block.line_range[1] + lineDelta)
+                    )
+                for block in suffixBlocks
+                ]
+
+        return _Segmentation(
+            source,
+            previous.lineCount + lineDelta,
+            numpy.concatenate([
+                previous.starts[:keptPrefix], starts, previous.starts[resyncStatement:] + lineDelta
+                ]),
+            numpy.concatenate([
+                previous.offsets[:keptPrefix], offsets, previous.offsets[resyncStatement:] + charDelta
+                ]),
+            previous.blocks[:keptPrefix] +
+                _blocksFor(source, starts, offsets, resyncLine, resyncOffset) +
+                suffixBlocks
+            )
+
+
+_cache = SegmentationCache()
+
+
+def breakCodeIntoSegments(code):
+    """Break 'code' into module-level CodeBlocks using the process-wide cache. See SegmentationCache.segment."""
+    return _cache.segment(code)
@@ -0,0 +1,85 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import random
+import textwrap
+import time
+import unittest
+
+from research_app.CodeSegmentation import SegmentationCache, Error
+
+
+def fullSegmentation(source):
+    return SegmentationCache().segment(source)
+
+
+class CodeSegmentationTest(unittest.TestCase):
+    def test_decorators_belong_to_their_function(self):
+        blocks = fullSegmentation(textwrap.dedent("""
+            x = 1
+            @staticmethod
+            def f():
+                pass
+            """))
+
+        self.assertEqual(len(blocks), 2)
+        self.assertEqual(blocks[0].code, "x = 1")
+        self.assertEqual(blocks[1].line_range, (3, 7))
+        self.assertTrue(blocks[1].code.startswith("@staticmethod"))
+
+    def test_incremental_matches_full_parse(self):
+        lines = [
+            "x = 1", "", "# comment", "if x:", "    y = 2", "else:", "    y = 3",
+            "def f(a):", "    return a", "z = [", "  1, 2]", "print(z)", "    w = 4", "(", ")",
+            '"""', 'text', '"""', "@dec", "for i in range(3):", "    pass", "try:", "finally:",
+            ]
+
+        rng = random.Random(42)
+        cache = SegmentationCache()
+        source = "x = 1\ny = 2\n"
+
+        for _ in range(2000):
+            current = source.split("\n")
+            ix = rng.randrange(len(current) + 1)
+
+            edit = rng.randrange(3)
+            if edit == 0:
+                current.insert(ix, rng.choice(lines))
+            elif edit == 1 and ix < len(current):
+                del current[ix]
+            elif ix < len(current):
+                current[ix] = rng.choice(lines)
+
+            candidate = "\n".join(current)
+            expected = fullSegmentation(candidate)
+
+            if isinstance(expected, Error):
+                self.assertTrue(isinstance(cache.segment(candidate), Error))
+                continue
+
+            self.assertEqual(cache.segment(candidate), expected, candidate)
+            source = candidate
+
+    def test_small_edits_to_large_modules_are_fast(self):
+        cache = SegmentationCache()
+        source = "\n".join(f"x_{i} = {i}\nif x_{i}:\n    y = x_{i}" for i in range(3500))
+        cache.segment(source)
+
+        t0 = time.time()
+        for i in range(100):
+            midpoint = len(source) // 2
+            source = source[:midpoint] + str(i % 10) + source[midpoint:]
+            cache.segment(source)
+
+        self.assertLess((time.time() - t0) / 100, 0.01)
@@ -0,0 +1,119 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Compiled code for the blocks of research scripts, cached in memory.
+
+Script sources are registered with 'linecache' under a made-up filename rather than
+written to disk, so tracebacks still show the offending lines. Each block is parsed and
+compiled once, as an expression if it is one and as a statement otherwise, and the code
+object is kept in an LRU cache keyed by the block's first line and source.
+"""
+
+from typed_python import sha_hash
+
+import ast
+import collections
+import linecache
+import threading
+
+# how many scripts we keep registered with linecache
+MAX_SOURCES = 256
+
+# how many compiled blocks we keep
+MAX_BLOCKS = 20000
+
+
+class CompiledBlock:
+    def __init__(self, code, isExpression):
+        # a code object for 'eval' if 'isExpression', otherwise for 'exec'
+        self.code = code
+        self.isExpression = isExpression
+
+
+class CompiledBlockCache:
+    def __init__(self, maxSources=MAX_SOURCES, maxBlocks=MAX_BLOCKS):
+        self.maxSources = maxSources
+        self.maxBlocks = maxBlocks
+
+        self._lock = threading.Lock()
+        self._sources = collections.OrderedDict()
+        self._blocks = collections.OrderedDict()
+
+    def registerSource(self, source):
+        """Make 'source' available to linecache, and return the filename to compile it under."""
+        filename = "<research_script_%s>" % sha_hash(source).hexdigest
+
+        with self._lock:
+            if filename in self._sources:
+                self._sources.move_to_end(filename)
+            else:
+                self._sources[filename] = True
+
+                while len(self._sources) > self.maxSources:
+                    evicted, _ = self._sources.popitem(last=False)
+                    linecache.cache.pop(evicted, None)
+
+            # an mtime of None tells linecache.checkcache to leave the entry alone
+            linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+
+        return filename
+
+    def isRegistered(self, filename):
+        return filename in self._sources
+
+    def compileBlock(self, block, filename):
+        """Return a CompiledBlock for CodeBlock 'block', which is part of the source registered as 'filename'.
+
+        Raises SyntaxError if the block doesn't parse.
+        """
+        key = (block.line_range[0], block.code)
+
+        with self._lock:
+            compiled = self._blocks.get(key)
+
+            # code objects refer to the source they were compiled from by name, so only reuse
+            # one whose source tracebacks can still find.
+            if compiled is not None and compiled.code.co_filename in self._sources:
+                self._blocks.move_to_end(key)
+                return compiled
+
+        tree = ast.parse(block.code, filename)
+        ast.increment_lineno(tree, block.line_range[0] - 1)
+
+        if len(tree.body) == 1 and isinstance(tree.body[0], ast.Expr):
+            compiled = CompiledBlock(compile(ast.Expression(tree.body[0].value), filename, "eval"), True)
+        else:
+            compiled = CompiledBlock(compile(tree, filename, "exec"), False)
+
+        with self._lock:
+            self._blocks[key] = compiled
+
+            while len(self._blocks) > self.maxBlocks:
+                self._blocks.popitem(last=False)
+
+        return compiled
+
+
+_cache = CompiledBlockCache()
+
+
+def registerSource(source):
+    """Register 'source' with the process-wide cache. See CompiledBlockCache.registerSource."""
+    return _cache.registerSource(source)
+
+
+def compileBlock(block, filename):
+    """Compile 'block' using the process-wide cache. See CompiledBlockCache.compileBlock."""
+    return _cache.compileBlock(block, filename)
@@ -0,0 +1,69 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import linecache
+import tempfile
+import textwrap
+import types
+import unittest
+
+from research_app.CompiledBlocks import CompiledBlockCache
+from research_app.ResearchBackend import ResearchBackend
+
+
+class CompiledBlocksTest(unittest.TestCase):
+    def test_blocks_are_compiled_once(self):
+        cache = CompiledBlockCache()
+        script = "x = 1\nx + 1\n"
+        blocks = ResearchBackend.breakCodeIntoSegments(script)
+        filename = cache.registerSource(script)
+
+        statement, expression = [cache.compileBlock(b, filename) for b in blocks]
+
+        self.assertFalse(statement.isExpression)
+        self.assertTrue(expression.isExpression)
+        self.assertIs(cache.compileBlock(blocks[1], filename), expression)
+
+    def test_evicted_sources_leave_linecache(self):
+        cache = CompiledBlockCache(maxSources=2)
+        filenames = [cache.registerSource(f"x = {i}\n") for i in range(3)]
+
+        self.assertNotIn(filenames[0], linecache.cache)
+        self.assertEqual(linecache.getline(filenames[2], 1), "x = 2\n")
+
+    def test_tracebacks_show_source_lines(self):
+        with tempfile.TemporaryDirectory() as tempDir:
+            error, _ = ResearchBackend.evaluateResearchScript(
+                types.SimpleNamespace(serviceTemporaryStorageRoot=tempDir),
+                textwrap.dedent("""
+                    x = 1
+
+                    y = x / 0
+                    """),
+                None
+                )
+
+            self.assertIn("line 4", error)
+            self.assertIn("y = x / 0", error)
+
+    def test_expression_blocks_run_once(self):
+        with tempfile.TemporaryDirectory() as tempDir:
+            error, displays = ResearchBackend.evaluateResearchScript(
+                types.SimpleNamespace(serviceTemporaryStorageRoot=tempDir),
+                "xs = []\nxs.append(1)\nprint(len(xs))\n",
+                None
+                )
+
+        self.assertIsNone(error)
+        self.assertEqual(displays[0].str, "1")
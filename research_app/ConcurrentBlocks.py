@@ -0,0 +1,130 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Concurrent execution of the independent blocks of a research script.
+
+Blocks run on a pool of threads as soon as the blocks they depend on (according to
+BlockDependencies.blockDependencies) have finished. They all share the script's namespace,
+which is safe because blocks that touch the same names never overlap, and it means functions
+defined by one block see the globals every other block sees. The caller collects results in
+source order, so displays and errors come out exactly as they would from a sequential run.
+
+Threads pay off because the slow parts of loading and crunching data (reading files, numpy,
+scipy) release the GIL.
+"""
+
+import concurrent.futures
+import heapq
+
+# how many threads an interpreter runs blocks on, unless configured otherwise. Blocks only
+# run concurrently when configured to, since the dependency analysis can't see every way
+# blocks share objects, and a missed dependency there is a race rather than a stale result.
+DEFAULT_THREAD_COUNT = 1
+
+# how often we check for cancellation while waiting on blocks
+CANCEL_POLL_INTERVAL = 0.05
+
+
+class ConcurrentBlocks:
+    def __init__(self, threadCount, dependencies, included, runBlock, checkCancelled=None):
+        """Run the blocks flagged in 'included' on up to 'threadCount' threads.
+
+        'dependencies[ix]' lists the blocks that block 'ix' has to wait for, and 'runBlock(ix)'
+        runs block 'ix' and returns a dict like ResearchBackend.displayForBlock does. A block
+        fails if it raises or returns an 'error', and nothing after a failed block starts.
+        'checkCancelled()', if given, gets called while we wait, and may raise to stop us.
+        """
+        self._threadCount = threadCount
+        self._runBlock = runBlock
+        self._checkCancelled = checkCancelled
+        self._executor = concurrent.futures.ThreadPoolExecutor(threadCount, thread_name_prefix="ResearchBlock")
+
+        # for each block, how many of its dependencies haven't succeeded yet, and which blocks
+        # depend on it
+        self._waitingOn = [len(deps) for deps in dependencies]
+        self._dependents = [[] for _ in dependencies]
+        for ix, deps in enumerate(dependencies):
+            for dep in deps:
+                self._dependents[dep].append(ix)
+
+        # a heap of the blocks that are ready to start
+        self._ready = [ix for ix in range(len(included)) if included[ix] and not dependencies[ix]]
+        heapq.heapify(self._ready)
+
+        # futures of the blocks that are running, and of the ones that finished, by block
+        self._running = {}
+        self._finished = {}
+
+        self._firstFailure = None
+        self._lastStarted = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def result(self, ix):
+        """Wait for block 'ix' to finish, and return its result, or raise its exception."""
+        while ix not in self._finished:
+            if self._checkCancelled is not None:
+                self._checkCancelled()
+
+            self._startReadyBlocks()
+
+            if not self._running:
+                raise Exception(f"Block {ix} can't run, because a block it depends on failed.")
+
+            done, _ = concurrent.futures.wait(
+                self._running,
+                timeout=CANCEL_POLL_INTERVAL,
+                return_when=concurrent.futures.FIRST_COMPLETED
+                )
+
+            for future in done:
+                self._onFinished(self._running.pop(future), future)
+
+        return self._finished[ix].result()
+
+    def hasStartedAnythingAfter(self, ix):
+        return self._lastStarted > ix
+
+    def close(self):
+        """Start nothing new, and wait for whatever is running to finish."""
+        self._ready = []
+        self._executor.shutdown(wait=True)
+
+    def _startReadyBlocks(self):
+        while self._ready and len(self._running) < self._threadCount:
+            ix = heapq.heappop(self._ready)
+
+            if self._firstFailure is not None and ix > self._firstFailure:
+                continue
+
+            self._running[self._executor.submit(self._runBlock, ix)] = ix
+            self._lastStarted = max(self._lastStarted, ix)
+
+    def _onFinished(self, ix, future):
+        self._finished[ix] = future
+
+        if future.exception() is not None or future.result().get('error'):
+            if self._firstFailure is None or ix < self._firstFailure:
+                self._firstFailure = ix
+            return
+
+        for dependent in self._dependents[ix]:
+            self._waitingOn[dependent] -= 1
+            if not self._waitingOn[dependent]:
+                heapq.heappush(self._ready, dependent)
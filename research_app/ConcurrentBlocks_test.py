@@ -0,0 +1,114 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+from research_app.ConcurrentBlocks import ConcurrentBlocks
+from research_app.ResearchBackend import ResearchBackend
+
+
+class ConcurrentBlocksTest(unittest.TestCase):
+    def test_independent_blocks_overlap(self):
+        barrier = threading.Barrier(3, timeout=5.0)
+
+        def runBlock(ix):
+            barrier.wait()
+            return {'displays': [ix]}
+
+        with ConcurrentBlocks(3, [[], [], []], [True] * 3, runBlock) as blocks:
+            self.assertEqual([blocks.result(ix)['displays'] for ix in range(3)], [[0], [1], [2]])
+
+    def test_dependencies_finish_first(self):
+        finished = []
+
+        def runBlock(ix):
+            time.sleep(0.01 * (3 - ix))
+            finished.append(ix)
+            return {}
+
+        with ConcurrentBlocks(4, [[], [0], [], [1, 2]], [True] * 4, runBlock) as blocks:
+            for ix in range(4):
+                blocks.result(ix)
+
+        self.assertLess(finished.index(0), finished.index(1))
+        self.assertEqual(finished[-1], 3)
+
+    def test_nothing_starts_after_a_failure(self):
+        started = []
+
+        def runBlock(ix):
+            started.append(ix)
+            return {'error': 'failed'} if ix == 1 else {}
+
+        with ConcurrentBlocks(1, [[], [], [1], []], [True] * 4, runBlock) as blocks:
+            blocks.result(0)
+            self.assertEqual(blocks.result(1)['error'], 'failed')
+
+        self.assertEqual(sorted(started), [0, 1])
+
+    def test_concurrent_evaluation_matches_sequential(self):
+        script = "\n".join([
+            "import math",
+            "xs = [1, 2, 3]",
+            "ys = numpy.arange(10)",
+            "xs.append(4)",
+            "def total():\n    return sum(xs)",
+            "zs = ys * 2",
+            "print(total())",
+            "print(zs.sum())",
+            "print(math.sqrt(len(xs)))",
+            ])
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            runtimeConfig = types.SimpleNamespace(serviceTemporaryStorageRoot=tempDir)
+
+            results = [
+                ResearchBackend.evaluateResearchScript(runtimeConfig, script, None, threadCount=threadCount)
+                for threadCount in (1, 4)
+                ]
+
+        for error, _ in results:
+            self.assertIsNone(error)
+
+        self.assertEqual([d.str for d in results[0][1]], ['10', '90', '2.0'])
+        self.assertEqual([d.str for d in results[1][1]], ['10', '90', '2.0'])
+
+    def test_blocks_sharing_objects_stay_ordered(self):
+        script = "\n".join([
+            "import time",
+            "data = []",
+            "def fill(lst):\n    time.sleep(0.2)\n    lst.append(1)",
+            "fill(data)",
+            "print(len(data))",
+            "a = [1]",
+            "b = a",
+            "time.sleep(0.2) or b.append(2)",
+            "print(len(a))",
+            ])
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            runtimeConfig = types.SimpleNamespace(serviceTemporaryStorageRoot=tempDir)
+
+            results = [
+                ResearchBackend.evaluateResearchScript(runtimeConfig, script, None, threadCount=threadCount)
+                for threadCount in (1, 8)
+                ]
+
+        for error, displays in results:
+            self.assertIsNone(error)
+            self.assertEqual([d.str for d in displays], ['1', '2'])
@@ -0,0 +1,126 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import object_database.web.cells as cells
+
+from research_app.Displayable import Display
+from research_app.util.Timer import Timer
+import research_app.ChunkStore as ChunkStore
+import research_app.HeatmapPyramid as HeatmapPyramid
+import research_app.PlotPayloadCache as PlotPayloadCache
+import research_app.PlotEncoding as PlotEncoding
+import research_app.DisplayForPlot as DisplayForPlot
+
+import numpy
+
+# we show about this many cells across the viewport, whatever its size
+CELLS_PER_SIDE = 512
+
+# the side of the square tiles, in cells of their level, that we cut levels into
+TILE_CELLS = 128
+
+
+def viewportTiles(heatmap, xyRanges):
+    """Return (levelIx, factor, tile rows, tile columns) to show viewport 'xyRanges' of HeatmapPyramid 'heatmap'.
+
+    'xyRanges' is ((minX, maxX), (minY, maxY)) in columns and rows of the matrix, or None for all of it.
+    """
+    rowCount, colCount = heatmap.z.shape
+
+    if xyRanges is None:
+        (minCol, maxCol), (minRow, maxRow) = (0, colCount), (0, rowCount)
+    else:
+        (minCol, maxCol), (minRow, maxRow) = xyRanges
+
+    minRow, maxRow = max(0, minRow), min(rowCount, maxRow + 1)
+    minCol, maxCol = max(0, minCol), min(colCount, maxCol + 1)
+
+    levelIx, factor = HeatmapPyramid.levelFor(heatmap, maxRow - minRow, maxCol - minCol, CELLS_PER_SIDE)
+    levelShape = HeatmapPyramid.levelArray(heatmap, levelIx).shape
+
+    return (
+        levelIx,
+        factor,
+        HeatmapPyramid.tileRange(minRow, maxRow, factor, TILE_CELLS, levelShape[0]),
+        HeatmapPyramid.tileRange(minCol, maxCol, factor, TILE_CELLS, levelShape[1])
+        )
+
+
+def heatmapTrace(heatmap, heatmapKey, xyRanges):
+    """Return the Plotly trace showing viewport 'xyRanges' of 'heatmap', built from cached tiles.
+
+    'heatmapKey' identifies the data of the heatmap, for the PlotPayloadCache.
+    """
+    levelIx, factor, tileRows, tileCols = viewportTiles(heatmap, xyRanges)
+    level = HeatmapPyramid.levelArray(heatmap, levelIx)
+
+    keys = [(heatmapKey, levelIx, tileRow, tileCol) for tileRow in tileRows for tileCol in tileCols]
+
+    def computeTiles(missingKeys):
+        return [
+            {'z': numpy.array(level[
+                tileRow * TILE_CELLS:(tileRow + 1) * TILE_CELLS,
+                tileCol * TILE_CELLS:(tileCol + 1) * TILE_CELLS
+                ], dtype=numpy.float64)}
+            for _, _, tileRow, tileCol in missingKeys
+            ]
+
+    tiles = [payload['z'] for payload in PlotPayloadCache.cachedPayloads(keys, computeTiles)]
+
+    if tiles:
+        z = numpy.block([tiles[ix:ix + len(tileCols)] for ix in range(0, len(tiles), len(tileCols))])
+    else:
+        z = numpy.zeros((0, 0))
+
+    trace = {
+        'type': 'heatmap',
+        'z': z,
+        # cells of a level sit at the middle of the block of the matrix they cover
+        'x0': (tileCols.start if tileCols else 0) * TILE_CELLS * factor + (factor - 1) / 2,
+        'dx': factor,
+        'y0': (tileRows.start if tileRows else 0) * TILE_CELLS * factor + (factor - 1) / 2,
+        'dy': factor
+        }
+
+    if numpy.isfinite(heatmap.zmin) and numpy.isfinite(heatmap.zmax):
+        trace['zmin'], trace['zmax'] = heatmap.zmin, heatmap.zmax
+
+    return trace
+
+
+@cells.registerDisplay(Display.Heatmap)
+def displayForHeatmap(display):
+    try:
+        heatmap = ChunkStore.resolve(display.heatmap)
+    except OSError:
+        return cells.Card(
+            cells.Text("The data of this heatmap is no longer available. Re-run the script to see it."),
+            header=display.title or None
+            )
+
+    heatmapKey = PlotPayloadCache.seriesKey(display.heatmap)
+
+    def heatmapData(heatmapPlot):
+        with Timer("Building heatmap tiles of a %s matrix", heatmap.z.shape):
+            trace = heatmapTrace(heatmap, heatmapKey, heatmapPlot.curXYRanges.get())
+
+            if DisplayForPlot.BINARY_PLOT_TRANSPORT:
+                trace = PlotEncoding.encodeTrace(trace)
+
+            return {'heatmap': trace}
+
+    return cells.Card(
+        cells.Plot(heatmapData, xySlot=cells.Slot()).width("100%"),
+        header=display.title or None
+        )
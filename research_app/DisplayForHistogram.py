@@ -0,0 +1,141 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import object_database.web.cells as cells
+
+from research_app.Displayable import Display
+from research_app.util.Timer import Timer
+import research_app.ChunkStore as ChunkStore
+import research_app.Histograms as Histograms
+import research_app.PlotPayloadCache as PlotPayloadCache
+import research_app.PlotEncoding as PlotEncoding
+import research_app.DisplayForPlot as DisplayForPlot
+
+import numpy
+
+
+def histogramTrace(histogram, xRange):
+    """Return the Plotly bar trace of the bins of Histogram 'histogram' within 'xRange', or of all of it if that's None."""
+    if xRange is None:
+        edges, counts = histogram.edges, histogram.counts
+    else:
+        edges, counts = Histograms.histogramOf(histogram.values, xRange[0], xRange[1])
+
+    return {
+        'type': 'bar',
+        'x': (edges[:-1] + edges[1:]) / 2,
+        'y': counts,
+        'width': float(edges[1] - edges[0])
+        }
+
+
+def densityTrace(density, xyRanges):
+    """Return the Plotly heatmap trace of the bins of Density 'density' within 'xyRanges', or of all of it if that's None."""
+    if xyRanges is None:
+        xEdges, yEdges, counts = density.xEdges, density.yEdges, density.counts
+    else:
+        xEdges, yEdges, counts = Histograms.densityOf(density.x, density.y, xyRanges[0], xyRanges[1])
+
+    return {
+        'type': 'heatmap',
+        # heatmaps have a row per y
+        'z': numpy.ascontiguousarray(counts.T),
+        'x0': float(xEdges[0] + xEdges[1]) / 2,
+        'dx': float(xEdges[1] - xEdges[0]),
+        'y0': float(yEdges[0] + yEdges[1]) / 2,
+        'dy': float(yEdges[1] - yEdges[0])
+        }
+
+
+def _viewport(plot, axisCount):
+    """Return the viewport of cells.Plot 'plot', snapped like the viewports of plots, or None if it hasn't got one."""
+    xyRanges = plot.curXYRanges.get()
+
+    if xyRanges is None:
+        return None
+
+    return tuple(PlotPayloadCache.snapRange(tuple(axisRange)) for axisRange in xyRanges[:axisCount])
+
+
+def _cachedTrace(kind, dataKey, viewport, computeTrace):
+    def compute(keys):
+        trace = computeTrace()
+
+        if DisplayForPlot.BINARY_PLOT_TRANSPORT:
+            trace = PlotEncoding.encodeTrace(trace)
+
+        return [trace]
+
+    return PlotPayloadCache.cachedPayloads(
+        [(kind, dataKey, viewport, DisplayForPlot.BINARY_PLOT_TRANSPORT)],
+        compute
+        )[0]
+
+
+def _unavailable(display):
+    return cells.Card(
+        cells.Text("The data of this chart is no longer available. Re-run the script to see it."),
+        header=display.title or None
+        )
+
+
+@cells.registerDisplay(Display.Histogram)
+def displayForHistogram(display):
+    try:
+        histogram = ChunkStore.resolve(display.histogram)
+    except OSError:
+        return _unavailable(display)
+
+    histogramKey = PlotPayloadCache.seriesKey(display.histogram)
+
+    def histogramData(histogramPlot):
+        viewport = _viewport(histogramPlot, 1)
+
+        with Timer("Binning a histogram of %s values", len(histogram.values)):
+            trace = _cachedTrace(
+                'histogram',
+                histogramKey,
+                viewport,
+                lambda: histogramTrace(histogram, viewport[0] if viewport else None)
+                )
+
+        return {'histogram': dict(trace, marker={'color': DisplayForPlot.nthColor(0)})}
+
+    return cells.Card(
+        cells.Plot(histogramData, xySlot=cells.Slot()).width("100%"),
+        header=display.title or None
+        )
+
+
+@cells.registerDisplay(Display.Density)
+def displayForDensity(display):
+    try:
+        density = ChunkStore.resolve(display.density)
+    except OSError:
+        return _unavailable(display)
+
+    densityKey = PlotPayloadCache.seriesKey(display.density)
+
+    def densityData(densityPlot):
+        viewport = _viewport(densityPlot, 2)
+
+        with Timer("Binning a density of %s points", len(density.x)):
+            trace = _cachedTrace('density', densityKey, viewport, lambda: densityTrace(density, viewport))
+
+        return {'density': trace}
+
+    return cells.Card(
+        cells.Plot(densityData, xySlot=cells.Slot()).width("100%"),
+        header=display.title or None
+        )
@@ -16,11 +16,32 @@ import object_database.web.cells as cells
 
 from research_app.Displayable import Display
 from research_app.util.Timer import Timer
+import research_app.ChunkStore as ChunkStore
+import research_app.PlotPyramid as PlotPyramid
+import research_app.PlotCandles as PlotCandles
+import research_app.PlotPayloadCache as PlotPayloadCache
+import research_app.PlotEncoding as PlotEncoding
+import research_app.PlotTime as PlotTime
+import research_app.DisplayForTable as DisplayForTable
 
-import research_app
 import logging
 import numpy
 
+# past this many points in view, we draw about POINTS_PER_SERIES points of each series
+MAX_POINTS_PER_CHART = 10000
+POINTS_PER_SERIES = 2000
+
+# how we draw lines with more points than we send: through the min and max of each bucket
+# of points, which keeps spikes, or through every Nth point.
+LINE_MODES = ("minmax", "stride")
+
+# how many candles we draw of each series
+CANDLES_PER_SERIES = 500
+
+# whether we send series as binary typed arrays (see PlotEncoding), which needs Plotly.js
+# 2.28 or later in the browser, or as lists of numbers.
+BINARY_PLOT_TRANSPORT = True
+
 colors = [
     "#FF0000",
     "#00FF00",
@@ -41,94 +62,144 @@ def nthColor(i):
 def displayForPlot(display):
     # grab a context object, which tells us how we should filter our cube data for display purposes.
     # this must be pushed on the stack above us for us to display properly.
-    datasetStatesUnnamed = display.args
-    datasetStatesNamed = display.kwargs
 
-    def downsamplePlotData(linePlot):
-        data = {}
+    # large arrays live in the chunk store, and we map them rather than copying them.
+    try:
+        datasetStatesUnnamed = [ChunkStore.resolve(ds) for ds in display.args]
+        datasetStatesNamed = {name: ChunkStore.resolve(ds) for name, ds in display.kwargs.items()}
+    except OSError:
+        return cells.Card(
+            cells.Text("The data of this plot is no longer available. Re-run the script to see it."),
+            header=display.title or None
+            )
+
+    # identifies the data of each series, for the PlotPayloadCache
+    seriesKeys = (
+        [PlotPayloadCache.seriesKey(ds) for ds in display.args] +
+        [PlotPayloadCache.seriesKey(ds) for ds in display.kwargs.values()]
+        )
 
+    def seriesToPlot():
         if len(datasetStatesUnnamed) <= 1:
-            for ds in datasetStatesUnnamed:
-                data.update(makePlotData(ds,"","series"))
+            names = ["series"]
         else:
-            for i, ds in enumerate(datasetStatesUnnamed):
-                data.update(makePlotData(ds,"","series_" + str(i+1)))
+            names = ["series_" + str(i+1) for i in range(len(datasetStatesUnnamed))]
 
-        for name, ds in datasetStatesNamed.items():
-            data.update(makePlotData(ds, name + ":", name))
+        return (
+            list(zip(names, datasetStatesUnnamed)) +
+            [(name, ds) for name, ds in datasetStatesNamed.items()]
+            )
+
+    def downsamplePlotData(linePlot):
+        data = {}
 
         with Timer("Downsampling plot data"):
             #because of slow connection speeds, lets not send more than MAX_POINTS_PER_CHART points total
-            seriesCount = len(data)
-            if seriesCount == 0:
+            allSeries = [(name, PlotPyramid.asSeries(ds)) for name, ds in seriesToPlot()]
+            if not allSeries:
                 return data
 
-            #first, restrict the dataset to what the xy can hold
+            #first, restrict the dataset to what the xy can hold, plus half a screen on either side
+            xRange = None
             if linePlot.curXYRanges.get() is not None:
                 minX, maxX = linePlot.curXYRanges.get()[0]
 
-                for series in data:
-                    dim = 'timestamp' if 'timestamp' in data[series] else 'x'
-                    indexLeft = (
-                        max(0,data[series][dim].searchsorted(minX - (maxX-minX)/2)) if minX is not None else 0
-                        )
-                    indexRight = (
-                        min(data[series][dim].searchsorted(maxX + (maxX-minX)/2, 'right'), len(data[series][dim]))
-                            if maxX is not None else 0
-                        )
+                # date axes send wall-clock strings
+                if isinstance(minX, str):
+                    minX = PlotTime.parseWallTime(minX)
+                if isinstance(maxX, str):
+                    maxX = PlotTime.parseWallTime(maxX)
 
-                    data[series][dim] = data[series][dim][indexLeft:indexRight]
-                    data[series]['y'] = data[series]['y'][indexLeft:indexRight]
+                if minX is not None and maxX is not None:
+                    xRange = (minX - (maxX-minX)/2, maxX + (maxX-minX)/2)
+                else:
+                    xRange = (minX, maxX)
+
+            # snap to a grid, so that viewers of nearby viewports share payloads
+            xRange = PlotPayloadCache.snapRange(xRange)
+
+            ranges = [PlotPyramid.indexRange(series, xRange) for _, series in allSeries]
 
             #now check our output point count
-            totalPoints = sum(len(data[series]['y']) for series in data)
+            totalPoints = sum(right - left for left, right in ranges)
 
-            colorIx = 0
+            mode = "candlestick" if candlestick.get() else lineMode.get()
 
-            if totalPoints > 10000 or candlestick.get():
-                with Timer("Downsampling %s total points", totalPoints):
-                    if candlestick.get():
-                        downsampleRatio = int(numpy.ceil(totalPoints / (500*len(data))))
+            if mode == "candlestick":
+                maxBuckets = CANDLES_PER_SERIES
+            elif totalPoints <= MAX_POINTS_PER_CHART:
+                maxBuckets = MAX_POINTS_PER_CHART
+            elif mode == "minmax":
+                # each bucket gives us two points
+                maxBuckets = POINTS_PER_SERIES // 2
+            else:
+                maxBuckets = POINTS_PER_SERIES
+
+            keys = [(seriesKey, xRange, mode, maxBuckets, BINARY_PLOT_TRANSPORT) for seriesKey in seriesKeys]
+            seriesIxByKey = {key: ix for ix, key in enumerate(keys)}
+
+            def computePayloads(missingKeys):
+                seriesIxs = [seriesIxByKey[key] for key in missingKeys]
+
+                if mode == "candlestick":
+                    payloads = []
+                    for ix in seriesIxs:
+                        candles = PlotCandles.candles(allSeries[ix][1], seriesKeys[ix], ranges[ix][0], ranges[ix][1], maxBuckets)
+                        payloads.append({
+                            'x': candles.x,
+                            'open': candles.open,
+                            'close': candles.close,
+                            'high': candles.high,
+                            'low': candles.low,
+                            'text': PlotCandles.hoverText(candles),
+                            'type': 'candlestick'
+                            })
+                else:
+                    allBuckets = [
+                        PlotPyramid.summarize(allSeries[ix][1], ranges[ix][0], ranges[ix][1], maxBuckets)
+                        for ix in seriesIxs
+                        ]
+
+                    if mode == "minmax":
+                        lines = PlotPyramid.peakPreservingLines(allBuckets)
                     else:
-                        downsampleRatio = int(numpy.ceil(totalPoints / (2000*len(data))))
-
-                    for series in data:
-                        dim = 'timestamp' if 'timestamp' in data[series] else 'x'
-
-                        samplePoints = numpy.arange(len(data[series][dim]) // downsampleRatio) * downsampleRatio
-
-                        if candlestick.get():
-                            # take the average of the points in the middle
-                            data[series][dim] = (
-                                numpy.add.reduceat(data[series][dim], samplePoints) /
-                                numpy.add.reduceat(data[series][dim] * 0 + 1, samplePoints)
-                                )
-                            data[series]['open'] = data[series]['y'][samplePoints[:-1]]
-                            data[series]['close'] = data[series]['y'][samplePoints[1:]-1]
-                            data[series]['high'] = numpy.maximum.reduceat(data[series]['y'], samplePoints)
-                            data[series]['low'] = numpy.minimum.reduceat(data[series]['y'], samplePoints)
-                            data[series]['decreasing'] = data[series]['increasing'] = {'line': {'color': nthColor(colorIx)}}
-                            colorIx += 1
-                            del data[series]['y']
-                            data[series]['type'] = 'candlestick'
-                        else:
-                            data[series]['line'] = {'color': nthColor(colorIx)}
-                            data[series][dim] = data[series][dim][samplePoints[1:]-1]
-                            data[series]['y'] = data[series]['y'][samplePoints[1:]-1]
-                            colorIx += 1
+                        lines = [(buckets.xLast, buckets.last) for buckets in allBuckets]
 
-            else:
-                for series in data:
-                    data[series]['line'] = {'color': nthColor(colorIx)}
-                    colorIx += 1
+                    payloads = [{'x': x, 'y': y} for x, y in lines]
 
-        return data
+                for payload in payloads:
+                    if PlotTime.isTimestamps(payload['x']):
+                        payload['x'] = PlotTime.wallTimeStrings(payload['x'])
+
+                if BINARY_PLOT_TRANSPORT:
+                    payloads = [PlotEncoding.encodeTrace(payload) for payload in payloads]
+
+                return payloads
+
+            payloads = []
+
+            with Timer(
+                    "Downsampling %s total points into %s bytes (plot cache: %s)",
+                    totalPoints,
+                    lambda: sum(PlotPayloadCache.payloadBytes(payload) for payload in payloads),
+                    PlotPayloadCache.cacheStatsText
+                    ):
+                payloads = PlotPayloadCache.cachedPayloads(keys, computePayloads)
+
+            for colorIx, ((name, _), payload) in enumerate(zip(allSeries, payloads)):
+                # payloads are shared, so we add our styling to a copy
+                data[name] = dict(payload)
 
-    def makePlotData(toShow, prefix, emptySeriesName):
-        return {emptySeriesName: {'x': numpy.arange(len(toShow)), 'y': toShow}}
+                if mode == "candlestick":
+                    data[name]['decreasing'] = data[name]['increasing'] = {'line': {'color': nthColor(colorIx)}}
+                else:
+                    data[name]['line'] = {'color': nthColor(colorIx)}
+
+        return data
 
     showChart = cells.Slot(True)
     candlestick = cells.Slot(False)
+    lineMode = cells.Slot(LINE_MODES[0])
 
     def cardContents():
         if showChart.get():
@@ -136,13 +207,15 @@ def displayForPlot(display):
 
             return cells.Plot(downsamplePlotData, xySlot=xySlot).width("100%")
         else:
-            seq = []
-            for plottedSet in list(display.unnamed) + list(display.named.values()):
-                seq.append(research_app.DisplayForDataset.displayForDataset(
-                    DatasetDisplay.Dataset(dataset=plottedSet)
+            # a table of each series, which only reads the rows in view
+            return cells.Sequence([
+                DisplayForTable.displayForTable(
+                    name,
+                    DisplayForTable.seriesColumns(name, PlotPyramid.asSeries(ds)),
+                    seriesKey
                     )
-                )
-            return cells.Sequence(seq)
+                for (name, ds), seriesKey in zip(seriesToPlot(), seriesKeys)
+                ])
 
 
     res = cells.Card(cells.Subscribed(cardContents),
@@ -154,6 +227,14 @@ def displayForPlot(display):
                 cells.Button("Show Candlestick", lambda: candlestick.set(not candlestick.get()), active=candlestick.get())
                     if showChart.get() else None
                 ),
+            cells.Subscribed(lambda:
+                cells.Button(
+                    "Show Every Nth Point",
+                    lambda: lineMode.set("stride" if lineMode.get() == "minmax" else "minmax"),
+                    active=lineMode.get() == "stride"
+                    )
+                    if showChart.get() and not candlestick.get() else None
+                ),
             cells.Subscribed(lambda:
                 cells.ButtonGroup([
                     cells.Button(cells.Octicon("graph"), lambda: showChart.set(True), active=showChart.get()),
@@ -0,0 +1,239 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Paged tables of the columns of plotted series.
+
+Tables only ever render the PAGE_ROWS rows in view. Columns are the arrays of the plot, which
+frontends map from the ChunkStore, so a page reads those rows and nothing else. Filtering
+(clauses like "price > 100 and time < 2019-01-02 10:00") and sorting happen on the server,
+with masks computed CHUNK_ROWS at a time and a stable argsort, and the rows they select
+are kept in the PlotPayloadCache, so paging through them and other viewers of the same
+table don't redo them.
+"""
+
+import object_database.web.cells as cells
+
+import research_app.PlotPayloadCache as PlotPayloadCache
+import research_app.PlotTime as PlotTime
+
+import numpy
+import re
+
+PAGE_ROWS = 50
+
+# how many rows we filter at a time
+CHUNK_ROWS = 1 << 22
+
+# we don't sort more rows than this, since the order takes 8 bytes a row
+MAX_SORTED_ROWS = 1 << 26
+
+FILTER_OPERATORS = {
+    '<': numpy.less,
+    '<=': numpy.less_equal,
+    '>': numpy.greater,
+    '>=': numpy.greater_equal,
+    '==': numpy.equal,
+    '!=': numpy.not_equal
+    }
+
+_clauseRegex = re.compile(r"^\s*(.+?)\s*(<=|>=|==|!=|<|>)\s*(.+?)\s*$")
+
+
+def seriesColumns(name, series):
+    """Return the columns of the table of PlotSeries 'series', called 'name': its x, unless that's the index, and its y."""
+    if series.x is None:
+        return {name: series.y}
+
+    return {"time" if PlotTime.isTimestamps(series.x) else "x": series.x, name: series.y}
+
+
+def parseFilter(text, columns):
+    """Return the (columnName, operator, value) clauses of filter 'text', a conjunction of comparisons.
+
+    Raises ValueError, with a message for the user, if 'text' doesn't make sense.
+    """
+    clauses = []
+
+    for clauseText in re.split(r"\s+and\s+", text.strip(), flags=re.IGNORECASE):
+        if not clauseText:
+            continue
+
+        match = _clauseRegex.match(clauseText)
+        if not match:
+            raise ValueError(f"Can't understand '{clauseText}'. Filter with clauses like 'price > 100'.")
+
+        columnName, operator, valueText = match.groups()
+
+        if columnName not in columns:
+            raise ValueError(f"There's no column '{columnName}'. Columns are {', '.join(columns)}.")
+
+        try:
+            if PlotTime.isTimestamps(columns[columnName]):
+                value = PlotTime.parseWallTime(valueText)
+            else:
+                value = float(valueText)
+        except ValueError:
+            raise ValueError(f"Can't compare '{columnName}' with '{valueText}'.")
+
+        clauses.append((columnName, operator, value))
+
+    return tuple(clauses)
+
+
+def selectedRows(columns, clauses, sortColumn=None, ascending=True):
+    """Return the rows of 'columns' passing filter 'clauses', in the order we show them, or None for all of them in order.
+
+    Raises ValueError if there are too many rows to sort.
+    """
+    rowCount = len(next(iter(columns.values())))
+    rows = None
+
+    if clauses:
+        selected = []
+
+        for start in range(0, rowCount, CHUNK_ROWS):
+            passes = numpy.ones(min(CHUNK_ROWS, rowCount - start), dtype=bool)
+
+            for columnName, operator, value in clauses:
+                passes &= FILTER_OPERATORS[operator](numpy.asarray(columns[columnName][start:start + CHUNK_ROWS]), value)
+
+            selected.append(numpy.flatnonzero(passes) + start)
+
+        rows = numpy.concatenate(selected) if selected else numpy.zeros(0, dtype=numpy.int64)
+
+    if sortColumn is not None:
+        if (rowCount if rows is None else len(rows)) > MAX_SORTED_ROWS:
+            raise ValueError(f"Too many rows to sort. Filter them down to {MAX_SORTED_ROWS} first.")
+
+        values = numpy.asarray(columns[sortColumn] if rows is None else columns[sortColumn][rows])
+        order = numpy.argsort(values, kind='stable')
+
+        if not ascending:
+            order = order[::-1]
+
+        rows = order if rows is None else rows[order]
+
+    return rows
+
+
+def pageRows(rows, rowCount, start, count=PAGE_ROWS):
+    """Return the indices of rows [start, start + count) of selection 'rows' (see selectedRows) of 'rowCount' rows."""
+    if rows is None:
+        return numpy.arange(start, min(start + count, rowCount))
+
+    return rows[start:start + count]
+
+
+def formatValues(values):
+    """Return the strings we show for the values of a column."""
+    if PlotTime.isTimestamps(values):
+        return list(PlotTime.wallTimeStrings(values))
+
+    if values.dtype.kind == 'f':
+        return ["%.6g" % value for value in values.tolist()]
+
+    return [str(value) for value in values.tolist()]
+
+
+def displayForTable(title, columns, tableKey):
+    """Return a cell showing a page at a time of 'columns', a dict of equally long 1-d arrays.
+
+    'tableKey' identifies the data of the columns, for the PlotPayloadCache.
+    """
+    rowCount = len(next(iter(columns.values())))
+
+    filterText = cells.Slot("")
+    sortBy = cells.Slot(None)
+    pageStart = cells.Slot(0)
+
+    def rowsShown():
+        """Return (rows, how many there are), or raise ValueError."""
+        clauses = parseFilter(filterText.get(), columns)
+        sortColumn, ascending = sortBy.get() or (None, True)
+
+        def compute(keys):
+            return [{'rows': selectedRows(columns, clauses, sortColumn, ascending)}]
+
+        rows = PlotPayloadCache.cachedPayloads(
+            [('tableRows', tableKey, clauses, sortColumn, ascending)],
+            compute
+            )[0]['rows']
+
+        return rows, (rowCount if rows is None else len(rows))
+
+    def shownPage():
+        """Return (first row shown, rows shown, how many there are), or raise ValueError."""
+        rows, shownCount = rowsShown()
+
+        # the filter may have changed under us
+        start = max(0, min(pageStart.get(), (shownCount - 1) // PAGE_ROWS * PAGE_ROWS))
+
+        return start, pageRows(rows, rowCount, start), shownCount
+
+    def toggleSort(columnName):
+        sortColumn, ascending = sortBy.get() or (None, True)
+        sortBy.set((columnName, not ascending if sortColumn == columnName else True))
+        pageStart.set(0)
+
+    def headerFor(columnName):
+        sortColumn, ascending = sortBy.get() or (None, True)
+        arrow = "" if sortColumn != columnName else " ▲" if ascending else " ▼"
+
+        return cells.Clickable(cells.Text(columnName + arrow), lambda: toggleSort(columnName))
+
+    def tableContents():
+        try:
+            _, pageIxs, _ = shownPage()
+        except ValueError as e:
+            return cells.Text(str(e))
+
+        texts = {name: formatValues(numpy.asarray(column[pageIxs])) for name, column in columns.items()}
+
+        return cells.Grid(
+            colFun=lambda: list(columns),
+            rowFun=lambda: list(range(len(pageIxs))),
+            headerFun=headerFor,
+            rowLabelFun=lambda rowIx: cells.Text(str(pageIxs[rowIx])),
+            rendererFun=lambda rowIx, columnName: cells.Text(texts[columnName][rowIx])
+            )
+
+    def pager():
+        try:
+            start, pageIxs, shownCount = shownPage()
+        except ValueError:
+            return None
+
+        return cells.Sequence([
+            cells.Button(
+                cells.Octicon("chevron-left"),
+                lambda: pageStart.set(max(0, start - PAGE_ROWS)),
+                small=True
+                ),
+            cells.Text("%s-%s of %s" % (start + 1 if shownCount else 0, start + len(pageIxs), shownCount)).nowrap(),
+            cells.Button(
+                cells.Octicon("chevron-right"),
+                lambda: pageStart.set(start + PAGE_ROWS if start + PAGE_ROWS < shownCount else start),
+                small=True
+                )
+            ]).nowrap()
+
+    return cells.Card(
+        cells.Subscribed(tableContents),
+        header=cells.HeaderBar(
+            [cells.Text(title)] if title else [],
+            [cells.SingleLineTextBox(filterText)],
+            [cells.Subscribed(pager)]
+            )
+        )
@@ -0,0 +1,69 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import numpy
+import unittest
+import unittest.mock
+
+import research_app.DisplayForTable as DisplayForTable
+import research_app.PlotPyramid as PlotPyramid
+
+
+class DisplayForTableTest(unittest.TestCase):
+    def setUp(self):
+        self.time = numpy.datetime64('2019-01-02T14:30', 'ns') + numpy.arange(1000000) * numpy.timedelta64(1, 's')
+        self.price = numpy.random.rand(1000000) * 200
+        self.columns = DisplayForTable.seriesColumns("price", PlotPyramid.seriesFor((self.time, self.price)))
+
+    def test_columns_of_series(self):
+        self.assertEqual(list(self.columns), ["time", "price"])
+        self.assertEqual(list(DisplayForTable.seriesColumns("y", PlotPyramid.seriesFor(numpy.ones(10)))), ["y"])
+
+    def test_filters_select_rows_in_chunks(self):
+        clauses = DisplayForTable.parseFilter("price > 100 AND time < 2019-01-02 10:00", self.columns)
+
+        with unittest.mock.patch.object(DisplayForTable, 'CHUNK_ROWS', 1000):
+            rows = DisplayForTable.selectedRows(self.columns, clauses)
+
+        # 09:30 to 10:00 in New York is the first half hour
+        expected = numpy.flatnonzero((self.price > 100) & (numpy.arange(1000000) < 1800))
+        self.assertTrue(numpy.array_equal(rows, expected))
+
+        self.assertIsNone(DisplayForTable.selectedRows(self.columns, ()))
+
+    def test_sorting_pages_through_rows_in_order(self):
+        clauses = DisplayForTable.parseFilter("price <= 50", self.columns)
+        rows = DisplayForTable.selectedRows(self.columns, clauses, "price", ascending=False)
+
+        page = DisplayForTable.pageRows(rows, 1000000, 50)
+        self.assertEqual(len(page), DisplayForTable.PAGE_ROWS)
+
+        prices = self.price[rows]
+        self.assertTrue((numpy.diff(prices) <= 0).all())
+        self.assertTrue((prices <= 50).all())
+        self.assertEqual(list(self.price[page]), list(prices[50:100]))
+
+        self.assertEqual(list(DisplayForTable.pageRows(None, 120, 100)), list(range(100, 120)))
+
+    def test_bad_filters_say_why(self):
+        for text in ["price >", "volume > 3", "price > cheap"]:
+            with self.assertRaises(ValueError):
+                DisplayForTable.parseFilter(text, self.columns)
+
+        self.assertEqual(DisplayForTable.parseFilter("  ", self.columns), ())
+
+    def test_formatting(self):
+        self.assertEqual(DisplayForTable.formatValues(self.time[:1]), ["2019-01-02 09:30:00.000"])
+        self.assertEqual(DisplayForTable.formatValues(numpy.array([1.5, 1e10])), ["1.5", "1e+10"])
+        self.assertEqual(DisplayForTable.formatValues(numpy.array([3, 4])), ["3", "4"])
@@ -24,6 +24,9 @@ Display = lambda: Display
 Display = Alternative("Display",
     Displays={'displays': TupleOf(Display), 'title': str},
     Plot={'args': TupleOf(object), 'kwargs': ConstDict(str, object), 'title': str},
+    Heatmap={'heatmap': object, 'title': str}, # a HeatmapPyramid.HeatmapPyramid
+    Histogram={'histogram': object, 'title': str}, # a Histograms.Histogram
+    Density={'density': object, 'title': str}, # a Histograms.Density
     Object={'object': object, 'title': str}, # show an arbitrary python object (should be small - a class or module)
     Print={'str': str, 'title': str}, # show a message from the code.
 
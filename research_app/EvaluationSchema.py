@@ -17,7 +17,7 @@ schema for the evaluation state of the research frontend.
 """
 import time
 from typed_python import OneOf, TupleOf
-from object_database import Schema, Indexed, current_transaction
+from object_database import Schema, Index, Indexed, current_transaction
 from research_app.ContentSchema import Module
 from research_app.Displayable import Display
 
@@ -25,36 +25,97 @@ schema = Schema("research_app.EvaluationSchema")
 
 @schema.define
 class EvaluationContext:
-    """A place to store evaluation outputs"""
+    """A place to store evaluation outputs of one module, as requested by one user session."""
+    session = str
     module = OneOf(None, Module)
+    sessionAndModule = Index('session', 'module')
+
     displaySnippet = OneOf(None, str)  # the snippet to display, or None for the whole thing
 
-    state = OneOf(
+    state = Indexed(OneOf(
         "Empty",        # the module hasn't been set yet via 'request'
         "Dirty",        # client wants us to compute
         "Calculating",  # the engine is calculating
         "Complete"      # the calculation is complete
-        )
+        ))
 
     error = OneOf(None, str)
 
     displays = TupleOf(Display)
 
-    def request(self, module, snippetOrNone):
-        self.module = module
+    # incremented by every request, so that workers can tell when their result is stale.
+    generation = int
+
+    # the backend worker computing us while we're 'Calculating', and when its claim lapses
+    # unless it renews it. A worker that dies simply stops renewing, and another picks us up.
+    leaseOwner = OneOf(None, str)
+    leaseExpiration = float
+
+    # when the session last asked us for anything. Sessions don't say when they end, so the
+    # frontend deletes contexts that have been idle for long enough.
+    lastRequestTimestamp = float
+
+    def request(self, snippetOrNone):
+        self.lastRequestTimestamp = time.time()
+        self.generation = self.generation + 1
         self.displaySnippet = snippetOrNone
         self.displays = ()
         self.error = None
         self.state = 'Dirty'
 
+    def isExpired(self, curTime, maxIdleSeconds):
+        """Has nobody asked us for anything in 'maxIdleSeconds'? Contexts with work pending never expire."""
+        if self.state in ("Dirty", "Calculating"):
+            return False
+
+        return self.lastRequestTimestamp + maxIdleSeconds < curTime
+
+    def isClaimable(self, curTime=None):
+        """Can a backend worker start computing us?"""
+        if self.state == "Dirty":
+            return True
+
+        return self.state == "Calculating" and self.leaseExpiration < (curTime or time.time())
+
+    def claim(self, owner, leaseDuration):
+        self.state = "Calculating"
+        self.leaseOwner = owner
+        self.leaseExpiration = time.time() + leaseDuration
+
+    def renewLease(self, owner, leaseDuration):
+        """Extend 'owner's lease, returning False if somebody else holds it now."""
+        if self.state != "Calculating" or self.leaseOwner != owner:
+            return False
+
+        self.leaseExpiration = time.time() + leaseDuration
+        return True
+
+    def isSupersededFor(self, owner, generation):
+        """Has the calculation 'owner' is running for request 'generation' become pointless?"""
+        if generation is not None and self.generation != generation:
+            return True
+
+        return owner is not None and (self.state != "Calculating" or self.leaseOwner != owner)
+
+    def complete(self, owner, generation, error, displays):
+        """Publish the result of a calculation, unless it has been superseded in the meantime.
+
+        Returns whether the result was published.
+        """
+        if self.isSupersededFor(owner, generation):
+            return False
+
+        self.error = error
+        self.displays = displays
+        self.state = "Complete"
+        self.leaseOwner = None
+        return True
+
     @staticmethod
-    def lookupOrCreate():
-        res = EvaluationContext.lookupAny()
+    def lookupOrCreate(session, module):
+        res = EvaluationContext.lookupAny(sessionAndModule=(session, module))
         if not res:
-            return EvaluationContext()
+            return EvaluationContext(
+                session=session, module=module, state="Empty", lastRequestTimestamp=time.time()
+                )
         return res
-
-    @staticmethod
-    def lookupAll():
-        raise NotImplementedError(
-            "Singleton object type does not implement lookupAll, use lookupOrCreate")
@@ -0,0 +1,170 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import contextlib
+import logging
+import types
+import unittest
+import unittest.mock
+
+import research_app.EvaluationSchema as EvaluationSchema
+import research_app.ResearchFrontend as ResearchFrontendModule
+from research_app.EvaluationSchema import EvaluationContext
+from research_app.ResearchFrontend import ResearchFrontend
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class Evaluation:
+    """The fields and methods of an EvaluationContext, outside of any database."""
+    request = EvaluationContext.request
+    isExpired = EvaluationContext.isExpired
+    isClaimable = EvaluationContext.isClaimable
+    claim = EvaluationContext.claim
+    renewLease = EvaluationContext.renewLease
+    isSupersededFor = EvaluationContext.isSupersededFor
+    complete = EvaluationContext.complete
+
+    def __init__(self):
+        self.displaySnippet = None
+        self.state = "Empty"
+        self.error = None
+        self.displays = ()
+        self.generation = 0
+        self.leaseOwner = None
+        self.leaseExpiration = 0.0
+        self.lastRequestTimestamp = 0.0
+        self.isDeleted = False
+
+    def delete(self):
+        self.isDeleted = True
+
+
+class FakeDatabase:
+    @contextlib.contextmanager
+    def transaction(self):
+        yield
+
+
+class EvaluationSchemaTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = unittest.mock.patch.object(EvaluationSchema, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_idle_contexts_expire(self):
+        evaluation = Evaluation()
+        evaluation.request(None)
+
+        self.clock.now += 100
+        self.assertFalse(evaluation.isExpired(self.clock.now, 200))
+
+        # not while a backend still has to compute it
+        self.clock.now += 150
+        self.assertFalse(evaluation.isExpired(self.clock.now, 200))
+
+        evaluation.complete(None, None, None, ())
+        self.assertTrue(evaluation.isExpired(self.clock.now, 200))
+
+        # another request keeps it alive
+        evaluation.request(None)
+        evaluation.complete(None, None, None, ())
+        self.assertFalse(evaluation.isExpired(self.clock.now + 100, 200))
+
+    def test_leases_expire_unless_renewed(self):
+        evaluation = Evaluation()
+        evaluation.request(None)
+        self.assertTrue(evaluation.isClaimable())
+
+        evaluation.claim("a", 10.0)
+        self.clock.now += 6
+        self.assertFalse(evaluation.isClaimable())
+
+        self.assertTrue(evaluation.renewLease("a", 10.0))
+        self.clock.now += 6
+        self.assertFalse(evaluation.isClaimable())
+
+        self.clock.now += 5
+        self.assertTrue(evaluation.isClaimable())
+
+    def test_results_of_a_lost_lease_are_dropped(self):
+        evaluation = Evaluation()
+        evaluation.request(None)
+        generation = evaluation.generation
+
+        evaluation.claim("a", 10.0)
+
+        # 'a' dies, or stalls, and 'b' takes over once the lease lapses
+        self.clock.now += 11
+        self.assertTrue(evaluation.isClaimable())
+        evaluation.claim("b", 10.0)
+
+        self.assertTrue(evaluation.isSupersededFor("a", generation))
+        self.assertFalse(evaluation.renewLease("a", 10.0))
+        self.assertFalse(evaluation.complete("a", generation, None, ("from a",)))
+        self.assertEqual(evaluation.state, "Calculating")
+
+        self.assertTrue(evaluation.complete("b", generation, None, ("from b",)))
+        self.assertEqual((evaluation.state, evaluation.displays), ("Complete", ("from b",)))
+
+        # and 'a' can't overwrite them afterwards either
+        self.assertFalse(evaluation.complete("a", generation, None, ("from a",)))
+        self.assertEqual(evaluation.displays, ("from b",))
+
+    def test_superseded_generations_are_ignored(self):
+        evaluation = Evaluation()
+        evaluation.request(None)
+        evaluation.claim("a", 10.0)
+        oldGeneration = evaluation.generation
+
+        evaluation.request("x")
+        self.assertTrue(evaluation.isSupersededFor("a", oldGeneration))
+        self.assertTrue(evaluation.isClaimable())
+
+        evaluation.claim("a", 10.0)
+        self.assertFalse(evaluation.complete("a", oldGeneration, None, ("stale",)))
+        self.assertTrue(evaluation.complete("a", evaluation.generation, None, ("fresh",)))
+        self.assertEqual(evaluation.displays, ("fresh",))
+
+    def test_frontend_deletes_expired_contexts(self):
+        frontend = ResearchFrontend.__new__(ResearchFrontend)
+        frontend.db = FakeDatabase()
+        frontend._logger = logging.getLogger(__name__)
+
+        idle, active, legacy = Evaluation(), Evaluation(), Evaluation()
+
+        for evaluation in (idle, active):
+            evaluation.request(None)
+            evaluation.complete(None, None, None, ())
+
+        self.clock.now += ResearchFrontendModule.EVALUATION_CONTEXT_TTL
+        active.request(None)
+        self.clock.now += 1
+
+        with unittest.mock.patch.object(
+                EvaluationContext, 'lookupAll', lambda: [idle, active, legacy], create=True
+                ):
+            self.assertEqual(frontend.deleteExpiredEvaluations(self.clock.now), 1)
+
+        self.assertEqual([e.isDeleted for e in (idle, active, legacy)], [True, False, False])
+
+        # contexts from before we tracked requests start their clock now
+        self.assertEqual(legacy.lastRequestTimestamp, self.clock.now)
@@ -0,0 +1,228 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Wall-clock, CPU-time and memory limits on the evaluation of user scripts.
+
+Limits are enforced by the kernel rather than by polling: interval timers deliver a
+signal when a time limit runs out, and an RLIMIT_DATA ceiling makes allocations beyond the
+memory limit fail with MemoryError. The ceiling sits 'memoryBytes' above what the process
+already uses, so libraries, caches and namespaces left by earlier evaluations don't count
+against the evaluation. This only works in the main thread of a process we own, which is
+why we only apply limits inside InterpreterPool workers.
+"""
+
+import contextlib
+import resource
+import signal
+import threading
+import time
+
+
+class LimitExceeded(BaseException):
+    """Raised inside user code when it exceeds a limit.
+
+    This derives from BaseException so that a bare 'except Exception' in user code
+    can't swallow it.
+    """
+    def __init__(self, description):
+        super().__init__(description)
+        self.description = description
+
+
+class ExecutionLimits:
+    """Limits on a single block, and on a whole evaluation. Zero means 'unlimited'.
+
+    'memoryBytes' is how much more memory an evaluation may allocate than the process held
+    when it started.
+    """
+    def __init__(self, blockWallSeconds=0.0, blockCpuSeconds=0.0,
+                 evaluationWallSeconds=0.0, evaluationCpuSeconds=0.0, memoryBytes=0):
+        self.blockWallSeconds = blockWallSeconds
+        self.blockCpuSeconds = blockCpuSeconds
+        self.evaluationWallSeconds = evaluationWallSeconds
+        self.evaluationCpuSeconds = evaluationCpuSeconds
+        self.memoryBytes = memoryBytes
+
+    def __repr__(self):
+        return "ExecutionLimits(%s)" % ", ".join("%s=%s" % kv for kv in sorted(self.__dict__.items()))
+
+    def isUnlimited(self):
+        return not any(self.__dict__.values())
+
+    def hasTimeLimits(self):
+        return bool(
+            self.blockWallSeconds or self.blockCpuSeconds or
+            self.evaluationWallSeconds or self.evaluationCpuSeconds
+            )
+
+    def enforcing(self, onBlockBoundary=None):
+        """A context manager that applies these limits to the evaluation that runs inside it.
+
+        It produces a limiter, whose 'block(codeBlock)' method gives a context manager to wrap
+        around the execution of each block. If given, we call 'onBlockBoundary(codeBlock, isStart)'
+        as each block starts and finishes under limits, so that a supervising process can kill
+        us if a block overruns in code that can't be interrupted.
+        """
+        if self.isUnlimited():
+            return _Unlimited()
+
+        return _EvaluationLimiter(self, onBlockBoundary)
+
+
+def describeViolation(block, exceeded):
+    """Explain that 'block' (a CodeBlock) was stopped because of LimitExceeded 'exceeded'."""
+    return (
+        f"Evaluation stopped: the block at line_range {tuple(block.line_range)} "
+        f"exceeded {exceeded.description}.\n\n{block.code}"
+        )
+
+
+class _Unlimited:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def block(self, block):
+        return contextlib.nullcontext()
+
+
+def _dataBytes():
+    """The bytes the kernel counts against RLIMIT_DATA for this process so far, or 0 if we can't tell."""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmData:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return 0
+
+
+def _cpuSeconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class _EvaluationLimiter:
+    def __init__(self, limits, onBlockBoundary=None):
+        self.limits = limits
+        self.onBlockBoundary = onBlockBoundary
+        self._wallStart = None
+        self._cpuStart = None
+        self._priorHandlers = {}
+        self._priorMemoryLimit = None
+        self._armed = {}
+
+    def __enter__(self):
+        assert threading.current_thread() is threading.main_thread(), \
+            "Execution limits can only be enforced on the main thread."
+
+        self._wallStart = time.time()
+        self._cpuStart = _cpuSeconds()
+
+        self._priorHandlers[signal.SIGALRM] = signal.signal(signal.SIGALRM, self._onTimer)
+        self._priorHandlers[signal.SIGPROF] = signal.signal(signal.SIGPROF, self._onTimer)
+
+        if self.limits.memoryBytes:
+            self._priorMemoryLimit = resource.getrlimit(resource.RLIMIT_DATA)
+
+            ceiling = _dataBytes() + self.limits.memoryBytes
+            if self._priorMemoryLimit[1] != resource.RLIM_INFINITY:
+                ceiling = min(ceiling, self._priorMemoryLimit[1])
+
+            resource.setrlimit(resource.RLIMIT_DATA, (ceiling, self._priorMemoryLimit[1]))
+
+        return self
+
+    def __exit__(self, *args):
+        self._disarm()
+
+        for signum, handler in self._priorHandlers.items():
+            signal.signal(signum, handler)
+
+        if self._priorMemoryLimit is not None:
+            resource.setrlimit(resource.RLIMIT_DATA, self._priorMemoryLimit)
+
+    def _onTimer(self, signum, frame):
+        which = signal.ITIMER_REAL if signum == signal.SIGALRM else signal.ITIMER_PROF
+        description = self._armed.get(which)
+
+        if description is not None:
+            self._disarm()
+            raise LimitExceeded(description)
+
+    def _arm(self, which, blockLimit, evaluationLimit, used, kind):
+        """Set interval timer 'which' to whichever of the block and evaluation limits comes first."""
+        candidates = []
+
+        if blockLimit:
+            candidates.append((blockLimit, f"the per-block {kind} limit of {blockLimit} seconds"))
+        if evaluationLimit:
+            candidates.append((
+                max(evaluationLimit - used, 1e-6),
+                f"the per-evaluation {kind} limit of {evaluationLimit} seconds"
+                ))
+
+        if candidates:
+            seconds, description = min(candidates)
+            self._armed[which] = description
+            signal.setitimer(which, seconds)
+
+    def _disarm(self):
+        for which in list(self._armed):
+            signal.setitimer(which, 0)
+        self._armed.clear()
+
+    def block(self, block):
+        """A context manager that enforces our limits on 'block', a CodeBlock."""
+        return _BlockLimiter(self, block)
+
+
+class _BlockLimiter:
+    def __init__(self, evaluationLimiter, block):
+        self.evaluationLimiter = evaluationLimiter
+        self.block = block
+
+    def __enter__(self):
+        limiter = self.evaluationLimiter
+        limits = limiter.limits
+
+        if limiter.onBlockBoundary is not None:
+            limiter.onBlockBoundary(self.block, True)
+
+        limiter._arm(
+            signal.ITIMER_REAL, limits.blockWallSeconds, limits.evaluationWallSeconds,
+            time.time() - limiter._wallStart, "wall-clock"
+            )
+        limiter._arm(
+            signal.ITIMER_PROF, limits.blockCpuSeconds, limits.evaluationCpuSeconds,
+            _cpuSeconds() - limiter._cpuStart, "CPU-time"
+            )
+
+        return self
+
+    def __exit__(self, excType, exc, tb):
+        self.evaluationLimiter._disarm()
+
+        if self.evaluationLimiter.onBlockBoundary is not None:
+            self.evaluationLimiter.onBlockBoundary(self.block, False)
+
+        if excType is not None and issubclass(excType, MemoryError) and self.evaluationLimiter.limits.memoryBytes:
+            raise LimitExceeded(
+                f"the memory limit of {self.evaluationLimiter.limits.memoryBytes} bytes"
+                ) from exc
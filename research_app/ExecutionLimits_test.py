@@ -0,0 +1,79 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import tempfile
+import textwrap
+import time
+import types
+import unittest
+
+from research_app.ExecutionLimits import ExecutionLimits
+from research_app.ResearchBackend import ResearchBackend
+
+
+class ExecutionLimitsTest(unittest.TestCase):
+    def setUp(self):
+        self._tempDir = tempfile.TemporaryDirectory()
+        self.runtimeConfig = types.SimpleNamespace(serviceTemporaryStorageRoot=self._tempDir.name)
+
+    def tearDown(self):
+        self._tempDir.cleanup()
+
+    def evaluate(self, script, limits):
+        return ResearchBackend.evaluateResearchScript(
+            self.runtimeConfig, textwrap.dedent(script), None, limits=limits
+            )
+
+    def test_block_cpu_limit_keeps_earlier_displays(self):
+        t0 = time.time()
+
+        error, displays = self.evaluate("""
+            print('before')
+            while True:
+                pass
+            """, ExecutionLimits(blockCpuSeconds=0.2))
+
+        self.assertLess(time.time() - t0, 2.0)
+        self.assertIn("per-block CPU-time limit", error)
+        self.assertIn("line_range (3, 6)", error)
+        self.assertEqual(len(displays), 1)
+
+    def test_user_code_cant_swallow_limits(self):
+        error, _ = self.evaluate("""
+            import time
+            try:
+                time.sleep(10)
+            except Exception:
+                pass
+            """, ExecutionLimits(blockWallSeconds=0.2))
+
+        self.assertIn("per-block wall-clock limit", error)
+
+    def test_evaluation_limit_spans_blocks(self):
+        error, displays = self.evaluate("""
+            import time
+            _ = time.sleep(0.15)
+            print(1)
+            _ = time.sleep(0.15)
+            print(2)
+            """, ExecutionLimits(blockWallSeconds=1.0, evaluationWallSeconds=0.25))
+
+        self.assertIn("per-evaluation wall-clock limit", error)
+        self.assertEqual(len(displays), 1)
+
+    def test_within_limits(self):
+        error, displays = self.evaluate("print(1)", ExecutionLimits(blockWallSeconds=1.0, blockCpuSeconds=1.0))
+
+        self.assertIsNone(error)
+        self.assertEqual(len(displays), 1)
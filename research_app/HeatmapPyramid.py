@@ -0,0 +1,191 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Level-of-detail pyramids of the matrices scripts pass to heatmap().
+
+Like PlotPyramid does for series, we summarize a matrix when it's plotted: level 0 holds the
+mean (or the min, or the max) of each 2x2 block of cells, level 1 of each 4x4 block, and so
+on until both sides fit in TOP_LEVEL_CELLS. Frontends cut the level that gives about
+CELLS_PER_SIDE cells across the viewport into tiles of TILE_CELLS by TILE_CELLS, and only
+send the tiles in view, so a 10k by 10k correlation matrix never goes to the browser whole.
+
+We read matrices CHUNK_ROWS rows at a time, and the levels of memmapped matrices go to
+scratch files, so matrices may be bigger than memory.
+"""
+
+from typed_python import NamedTuple, TupleOf
+import research_app.PlotPyramid as PlotPyramid
+
+import numpy
+
+REDUCTIONS = ("mean", "min", "max")
+
+# we stop adding coarser levels once both sides have this many cells or fewer
+TOP_LEVEL_CELLS = 256
+
+# how many rows of a matrix (or of a level) we read at a time. Even, since each level halves
+# the one before.
+CHUNK_ROWS = 256
+
+# 'z' is the matrix. 'levels[i]' holds the 'reduction' of each block of levelFactor(i) by
+# levelFactor(i) cells. 'zmin' and 'zmax' are the range of the colorscale.
+HeatmapPyramid = NamedTuple(z=object, reduction=str, levels=TupleOf(object), zmin=float, zmax=float)
+
+
+def levelFactor(levelIx):
+    """The number of rows (and columns) of the matrix a cell of level 'levelIx' covers."""
+    return 2 ** (levelIx + 1)
+
+
+def _blockSizes(count, factor):
+    """The sizes of the runs of 'factor' that 'count' cells split into. The last may be short."""
+    sizes = numpy.full(-(-count // factor), factor)
+    if len(sizes):
+        sizes[-1] = count - factor * (len(sizes) - 1)
+    return sizes
+
+
+def _combinePairs(values, ufunc):
+    """Combine rows 0 and 1, 2 and 3, ... of 2-d array 'values' with 'ufunc'. An odd last row stays as it is."""
+    combined = numpy.array(values[0::2], dtype=numpy.float64)
+    odds = values[1::2]
+
+    ufunc(combined[:len(odds)], odds, out=combined[:len(odds)])
+
+    return combined
+
+
+def halve(values, reduction, weights=None):
+    """Reduce 2-d array 'values' over blocks of 2 by 2 cells.
+
+    Means are weighted by 2-d array 'weights', if given, so that means of means come out right.
+    Min and max ignore NaNs, unless a whole block is NaN, and NaNs make means NaN.
+    """
+    def reduceBlocks(array, ufunc):
+        return _combinePairs(_combinePairs(array, ufunc).T, ufunc).T
+
+    if reduction == "min":
+        return reduceBlocks(values, numpy.fmin)
+
+    if reduction == "max":
+        return reduceBlocks(values, numpy.fmax)
+
+    if weights is None:
+        counts = numpy.outer(_blockSizes(values.shape[0], 2), _blockSizes(values.shape[1], 2))
+        return reduceBlocks(values, numpy.add) / counts
+
+    return reduceBlocks(values * weights, numpy.add) / reduceBlocks(weights, numpy.add)
+
+
+def buildLevels(z, reduction):
+    """Return the levels of the pyramid of 2-d array 'z', reading CHUNK_ROWS rows of it at a time."""
+    outOfCore = isinstance(z, numpy.memmap)
+    levels = []
+
+    source, sourceFactor = z, 1
+
+    while max(source.shape) > TOP_LEVEL_CELLS:
+        shape = (-(-source.shape[0] // 2), -(-source.shape[1] // 2))
+
+        if outOfCore and shape[0] * shape[1] * 8 >= PlotPyramid.SCRATCH_LEVEL_BYTES:
+            level = PlotPyramid.scratchArray(shape, numpy.float64)
+        else:
+            level = numpy.empty(shape)
+
+        # the number of cells of the matrix each cell of 'source' covers, for weighting means
+        rowSizes = _blockSizes(z.shape[0], sourceFactor)
+        colSizes = _blockSizes(z.shape[1], sourceFactor)
+
+        for start in range(0, source.shape[0], CHUNK_ROWS):
+            chunk = numpy.asarray(source[start:start + CHUNK_ROWS])
+            weights = numpy.outer(rowSizes[start:start + len(chunk)], colSizes) if sourceFactor > 1 else None
+
+            level[start // 2:start // 2 + -(-len(chunk) // 2)] = halve(chunk, reduction, weights)
+
+        levels.append(level)
+        source, sourceFactor = level, sourceFactor * 2
+
+    return levels
+
+
+def _asMatrix(value):
+    """Return 'value' as a 2-d numeric array, leaving memmaps mapped, or raise TypeError."""
+    if isinstance(value, numpy.memmap):
+        matrix = value
+    else:
+        matrix = numpy.asarray(getattr(value, 'values', value))
+
+    if matrix.ndim != 2 or matrix.dtype.kind not in 'biuf':
+        raise TypeError(f"heatmap() needs a 2-d array of numbers, not {type(value).__name__}.")
+
+    return matrix
+
+
+def _valueRange(z):
+    """Return the (min, max) of 2-d array 'z', ignoring NaNs, reading CHUNK_ROWS rows at a time."""
+    low, high = numpy.nan, numpy.nan
+
+    for start in range(0, z.shape[0], CHUNK_ROWS):
+        chunk = numpy.asarray(z[start:start + CHUNK_ROWS])
+
+        if chunk.size:
+            low = numpy.fmin(low, numpy.fmin.reduce(chunk, axis=None))
+            high = numpy.fmax(high, numpy.fmax.reduce(chunk, axis=None))
+
+    return low, high
+
+
+def heatmapFor(matrix, reduction="mean", zmin=None, zmax=None):
+    """Return the HeatmapPyramid of what a script passed to heatmap().
+
+    'zmin' and 'zmax' default to the range of the matrix.
+    """
+    if reduction not in REDUCTIONS:
+        raise ValueError(f"heatmap() reduces blocks by one of {', '.join(REDUCTIONS)}, not '{reduction}'.")
+
+    z = _asMatrix(matrix)
+
+    if zmin is None or zmax is None:
+        low, high = _valueRange(z)
+        zmin = low if zmin is None else zmin
+        zmax = high if zmax is None else zmax
+
+    return HeatmapPyramid(z=z, reduction=reduction, levels=buildLevels(z, reduction), zmin=float(zmin), zmax=float(zmax))
+
+
+def levelFor(heatmap, rowCount, colCount, cellsPerSide):
+    """Return (levelIx, factor) of the finest level showing 'rowCount' by 'colCount' cells of the matrix in about 'cellsPerSide'.
+
+    A 'levelIx' of -1 means the matrix itself.
+    """
+    levelIx, factor = -1, 1
+
+    while levelIx + 1 < len(heatmap.levels) and max(rowCount, colCount) > cellsPerSide * factor:
+        levelIx += 1
+        factor = levelFactor(levelIx)
+
+    return levelIx, factor
+
+
+def levelArray(heatmap, levelIx):
+    return heatmap.z if levelIx < 0 else heatmap.levels[levelIx]
+
+
+def tileRange(start, stop, factor, tileCells, cellCount):
+    """Return the range of indices of the tiles of 'tileCells' cells of a level of 'factor' covering [start, stop) of the matrix."""
+    firstCell = max(0, int(numpy.floor(start / factor)))
+    lastCell = min(cellCount, int(numpy.ceil(stop / factor)))
+
+    return range(firstCell // tileCells, max(firstCell // tileCells, -(-lastCell // tileCells)))
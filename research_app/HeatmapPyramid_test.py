@@ -0,0 +1,91 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import numpy
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import research_app.HeatmapPyramid as HeatmapPyramid
+import research_app.DisplayForHeatmap as DisplayForHeatmap
+import research_app.PlotPyramid as PlotPyramid
+
+
+def bruteForce(z, factor, reduce):
+    return numpy.array([
+        [reduce(z[r:r + factor, c:c + factor]) for c in range(0, z.shape[1], factor)]
+        for r in range(0, z.shape[0], factor)
+        ])
+
+
+class HeatmapPyramidTest(unittest.TestCase):
+    def test_levels_reduce_blocks(self):
+        # odd sides, so blocks at the edges are partial
+        z = numpy.random.randn(1001, 613)
+
+        for reduction, reduce in [("mean", numpy.mean), ("min", numpy.min), ("max", numpy.max)]:
+            with unittest.mock.patch.object(HeatmapPyramid, 'CHUNK_ROWS', 64):
+                heatmap = HeatmapPyramid.heatmapFor(z, reduction)
+
+            self.assertLessEqual(max(heatmap.levels[-1].shape), HeatmapPyramid.TOP_LEVEL_CELLS)
+
+            for levelIx, level in enumerate(heatmap.levels):
+                expected = bruteForce(z, HeatmapPyramid.levelFactor(levelIx), reduce)
+                self.assertTrue(numpy.allclose(level, expected), (reduction, levelIx))
+
+        self.assertEqual((heatmap.zmin, heatmap.zmax), (z.min(), z.max()))
+
+    def test_small_matrices_have_no_levels(self):
+        heatmap = HeatmapPyramid.heatmapFor([[1, 2], [3, numpy.nan]], zmin=-1)
+
+        self.assertEqual(len(heatmap.levels), 0)
+        self.assertEqual((heatmap.zmin, heatmap.zmax), (-1, 3))
+
+        with self.assertRaises(TypeError):
+            HeatmapPyramid.heatmapFor(numpy.ones(5))
+        with self.assertRaises(ValueError):
+            HeatmapPyramid.heatmapFor(numpy.ones((5, 5)), "median")
+
+    def test_memmapped_levels_go_to_scratch_files(self):
+        z = numpy.random.rand(700, 700)
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            path = os.path.join(tempDir, "matrix.f8")
+            z.tofile(path)
+
+            with unittest.mock.patch.object(PlotPyramid, 'SCRATCH_LEVEL_BYTES', 0):
+                heatmap = HeatmapPyramid.heatmapFor(numpy.memmap(path, dtype='f8', mode='r', shape=z.shape))
+
+            self.assertIsInstance(heatmap.levels[0], numpy.memmap)
+            self.assertTrue(numpy.allclose(heatmap.levels[1], bruteForce(z, 4, numpy.mean)))
+
+            del heatmap
+
+    def test_viewports_get_tiles_of_the_right_level(self):
+        z = numpy.arange(3000 * 2000, dtype=float).reshape(3000, 2000)
+        heatmap = HeatmapPyramid.heatmapFor(z)
+
+        # the whole matrix needs cells of 8x8 to fit in 512 across
+        trace = DisplayForHeatmap.heatmapTrace(heatmap, "whole", None)
+        self.assertEqual(trace['dx'], 8)
+        self.assertEqual(trace['z'].shape, (375, 250))
+        self.assertEqual(trace['z'][0, 0], z[:8, :8].mean())
+
+        # zoomed in to a 100x100 corner we get cells of the matrix, from the 2x2 tiles covering it
+        trace = DisplayForHeatmap.heatmapTrace(heatmap, "zoomed", ((1950, 2050), (2900, 3000)))
+        self.assertEqual(trace['dx'], 1)
+        self.assertEqual((trace['x0'], trace['y0']), (1920, 2816))
+        self.assertEqual(trace['z'].shape, (3000 - 2816, 2000 - 1920))
+        self.assertEqual(trace['z'][0, 0], z[2816, 1920])
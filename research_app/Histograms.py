@@ -0,0 +1,154 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Histograms and 2-d densities of what scripts pass to hist() and density().
+
+Browsers only ever get bin counts. The backend bins all the values when the script runs,
+and keeps a sorted copy of them, which moves into the ChunkStore like the series of plots.
+When somebody zooms, the frontend bins the values in view afresh: with the values sorted,
+a histogram is a binary search per bin edge, and a density only bins the points whose x is
+in view. Bins are as wide as numpy's 'auto' rule says for the values in view (the
+narrower of the Freedman-Diaconis and Sturges widths), so zooming in shows more detail.
+"""
+
+from typed_python import NamedTuple
+
+import numpy
+
+# the most bins we show across a histogram, or across each side of a density
+MAX_BINS = 500
+MAX_DENSITY_BINS = 200
+
+# 'values' are the finite values passed to hist(), sorted. 'edges' and 'counts' are the bins of all of them.
+Histogram = NamedTuple(values=object, edges=object, counts=object)
+
+# 'x' are the x of the finite points passed to density(), sorted, and 'y' their y. 'counts[i, j]'
+# is the number of points in bin 'i' of 'xEdges' and bin 'j' of 'yEdges'.
+Density = NamedTuple(x=object, y=object, xEdges=object, yEdges=object, counts=object)
+
+
+def _finite(values):
+    values = numpy.asarray(getattr(values, 'values', values))
+
+    if values.dtype.kind not in 'biuf':
+        raise TypeError(f"Can only bin numbers, not {values.dtype}.")
+
+    # bins need arithmetic that bools don't support and small ints would overflow
+    return values.reshape(-1).astype(numpy.float64)
+
+
+def binCount(lo, hi, count, interquartileRange, maxBins):
+    """Return how many bins numpy's 'auto' rule splits [lo, hi] into, for 'count' values with 'interquartileRange'."""
+    if count < 2 or not hi > lo:
+        return 1
+
+    width = (hi - lo) / (numpy.log2(count) + 1.0)
+
+    if interquartileRange > 0:
+        width = min(width, 2.0 * interquartileRange * count ** (-1.0 / 3.0))
+
+    return int(numpy.clip(numpy.ceil((hi - lo) / width), 1, maxBins))
+
+
+def histogramOf(sortedValues, lo, hi, maxBins=MAX_BINS):
+    """Return (edges, counts) of the values of sorted array 'sortedValues' within [lo, hi]."""
+    left = int(numpy.searchsorted(sortedValues, lo, 'left'))
+    right = int(numpy.searchsorted(sortedValues, hi, 'right'))
+    count = right - left
+
+    # quartiles of sorted values are just lookups
+    interquartileRange = 0.0
+    if count:
+        interquartileRange = sortedValues[left + (3 * (count - 1)) // 4] - sortedValues[left + (count - 1) // 4]
+
+    edges = numpy.linspace(lo, hi, binCount(lo, hi, count, interquartileRange, maxBins) + 1)
+
+    # a bin holds the values from its left edge up to its right edge, which the last bin includes
+    positions = numpy.searchsorted(sortedValues, edges, 'left')
+    positions[-1] = right
+
+    return edges, numpy.diff(positions)
+
+
+def histogramFor(values):
+    """Return the Histogram of what a script passed to hist()."""
+    values = _finite(values)
+    values = numpy.sort(values[numpy.isfinite(values)])
+
+    if not len(values):
+        return Histogram(values=values, edges=numpy.array([0.0, 1.0]), counts=numpy.zeros(1, dtype=numpy.int64))
+
+    edges, counts = histogramOf(values, values[0], values[-1])
+
+    return Histogram(values=values, edges=edges, counts=counts)
+
+
+def _autoBins(values, lo, hi, maxBins):
+    if len(values) and hi > lo:
+        quartiles = numpy.percentile(values, [25, 75])
+        return binCount(lo, hi, len(values), quartiles[1] - quartiles[0], maxBins)
+
+    return 1
+
+
+def densityOf(x, y, xRange, yRange, maxBins=MAX_DENSITY_BINS):
+    """Return (xEdges, yEdges, counts) of the points of 'x', sorted, and 'y' within 'xRange' and 'yRange'.
+
+    Either range may be None, for all the points.
+    """
+    left, right = 0, len(x)
+
+    if xRange is not None:
+        left = int(numpy.searchsorted(x, xRange[0], 'left'))
+        right = int(numpy.searchsorted(x, xRange[1], 'right'))
+
+    xs, ys = numpy.asarray(x[left:right]), numpy.asarray(y[left:right])
+
+    if yRange is not None:
+        inRange = (ys >= yRange[0]) & (ys <= yRange[1])
+        xs, ys = xs[inRange], ys[inRange]
+
+    xLo, xHi = xRange if xRange is not None else (xs.min(), xs.max()) if len(xs) else (0.0, 1.0)
+    yLo, yHi = yRange if yRange is not None else (ys.min(), ys.max()) if len(ys) else (0.0, 1.0)
+
+    # histogram2d wants ranges of some width
+    xHi, yHi = max(xHi, xLo + 1e-9), max(yHi, yLo + 1e-9)
+
+    counts, xEdges, yEdges = numpy.histogram2d(
+        xs,
+        ys,
+        bins=[_autoBins(xs, xLo, xHi, maxBins), _autoBins(ys, yLo, yHi, maxBins)],
+        range=[[xLo, xHi], [yLo, yHi]]
+        )
+
+    return xEdges, yEdges, counts.astype(numpy.int64)
+
+
+def densityFor(x, y):
+    """Return the Density of what a script passed to density()."""
+    x, y = _finite(x), _finite(y)
+
+    if len(x) != len(y):
+        raise ValueError(f"density() needs as many x as y, not {len(x)} and {len(y)}.")
+
+    isFinite = numpy.isfinite(x) & numpy.isfinite(y)
+    x, y = x[isFinite], y[isFinite]
+
+    order = numpy.argsort(x, kind='stable')
+    x, y = x[order], y[order]
+
+    xEdges, yEdges, counts = densityOf(x, y, None, None)
+
+    return Density(x=x, y=y, xEdges=xEdges, yEdges=yEdges, counts=counts)
@@ -0,0 +1,103 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import numpy
+import unittest
+
+import research_app.Histograms as Histograms
+import research_app.DisplayForHistogram as DisplayForHistogram
+
+
+class HistogramsTest(unittest.TestCase):
+    def test_bins_match_numpy(self):
+        values = numpy.random.randn(100000)
+        values[:10] = numpy.nan
+
+        histogram = Histograms.histogramFor(values)
+        finite = values[numpy.isfinite(values)]
+
+        self.assertEqual(len(histogram.values), len(finite))
+        self.assertEqual(histogram.counts.sum(), len(finite))
+
+        # numpy interpolates its quartiles, so its bins may differ by one or two
+        self.assertLessEqual(abs(len(histogram.counts) - len(numpy.histogram_bin_edges(finite, 'auto')) + 1), 2)
+
+        expected, _ = numpy.histogram(finite, histogram.edges)
+        self.assertEqual(list(histogram.counts), list(expected))
+
+    def test_zooming_rebins_the_values_in_view(self):
+        values = numpy.random.randn(100000)
+        histogram = Histograms.histogramFor(values)
+
+        edges, counts = Histograms.histogramOf(histogram.values, 0.5, 1.0)
+
+        self.assertEqual((edges[0], edges[-1]), (0.5, 1.0))
+        self.assertEqual(list(counts), list(numpy.histogram(values, edges)[0]))
+
+        # bins get narrower as we zoom in, up to a limit
+        self.assertLess(edges[1] - edges[0], histogram.edges[1] - histogram.edges[0])
+        self.assertLessEqual(len(Histograms.histogramOf(numpy.sort(numpy.random.rand(10 ** 7)), 0, 1)[1]), Histograms.MAX_BINS)
+
+    def test_degenerate_histograms(self):
+        self.assertEqual(list(Histograms.histogramFor([3.0, 3.0, 3.0]).counts), [3])
+        self.assertEqual(list(Histograms.histogramFor([numpy.nan]).counts), [0])
+
+        with self.assertRaises(TypeError):
+            Histograms.histogramFor(["a", "b"])
+
+    def test_bools_and_small_ints(self):
+        histogram = Histograms.histogramFor(numpy.array([True, False, True, True]))
+        self.assertEqual(histogram.counts.sum(), 4)
+        self.assertEqual((histogram.edges[0], histogram.edges[-1]), (0.0, 1.0))
+
+        values = numpy.array([-128, 0, 127] * 100, dtype=numpy.int8)
+        histogram = Histograms.histogramFor(values)
+        expected, _ = numpy.histogram(values.astype(numpy.float64), histogram.edges)
+
+        self.assertEqual((histogram.edges[0], histogram.edges[-1]), (-128.0, 127.0))
+        self.assertEqual(list(histogram.counts), list(expected))
+
+        density = Histograms.densityFor(numpy.array([True, False]), numpy.array([1, 2], dtype=numpy.int8))
+        self.assertEqual(density.counts.sum(), 2)
+
+    def test_densities_bin_the_points_in_view(self):
+        x = numpy.random.randn(50000)
+        y = x + numpy.random.randn(50000)
+
+        density = Histograms.densityFor(x, y)
+
+        self.assertTrue((numpy.diff(density.x) >= 0).all())
+        self.assertEqual(density.counts.sum(), 50000)
+
+        xEdges, yEdges, counts = Histograms.densityOf(density.x, density.y, (0, 1), (-1, 2))
+        expected, _, _ = numpy.histogram2d(x, y, [xEdges, yEdges])
+
+        self.assertEqual((xEdges[0], xEdges[-1], yEdges[0], yEdges[-1]), (0, 1, -1, 2))
+        self.assertTrue((counts == expected).all())
+
+        with self.assertRaises(ValueError):
+            Histograms.densityFor(x, y[:10])
+
+    def test_traces(self):
+        histogram = Histograms.histogramFor(numpy.arange(1000))
+        trace = DisplayForHistogram.histogramTrace(histogram, (100, 200))
+
+        self.assertEqual(trace['y'].sum(), 101)
+        self.assertAlmostEqual(trace['x'][0] - trace['width'] / 2, 100)
+
+        density = Histograms.densityFor(numpy.arange(1000), numpy.arange(1000) % 10)
+        trace = DisplayForHistogram.densityTrace(density, None)
+
+        self.assertEqual(trace['z'].shape, (len(density.yEdges) - 1, len(density.xEdges) - 1))
+        self.assertEqual(trace['z'].sum(), 1000)
@@ -0,0 +1,422 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+A pool of warm worker processes that execute user scripts on behalf of the ResearchBackend.
+
+Workers are forked from a multiprocessing 'forkserver' that has already imported numpy,
+scipy and the research backend, so starting one costs a fork rather than a new interpreter,
+and the forkserver never inherits the threads of the service process. A worker that crashes
+or gets killed by the OOM killer only takes down the evaluation it was running, and the pool
+starts a replacement in the background.
+"""
+
+from typed_python import TupleOf
+from typed_python.Codebase import Codebase as TypedPythonCodebase
+from research_app.Displayable import Display
+
+import research_app
+import research_app.BlockDependencies as BlockDependencies
+import collections
+import logging
+import multiprocessing
+import multiprocessing.connection
+import threading
+import time
+import traceback
+import types
+
+# the forkserver imports these once, so every worker starts with them already loaded.
+PRELOADED_MODULES = ['numpy', 'scipy.io', 'research_app.ResearchBackend']
+
+DEFAULT_POOL_SIZE = 2
+
+# how long 'execute' waits for an idle worker before giving up
+WORKER_AVAILABLE_TIMEOUT = 60.0
+
+# how long to wait before retrying when we fail to start a worker
+WORKER_RESTART_DELAY = 1.0
+
+# how long a cancelled evaluation gets to reach the end of its current block before we kill
+# its worker outright.
+CANCEL_GRACE_PERIOD = 0.05
+
+# how long past its per-block or per-evaluation wall-clock limit we let a worker run before killing it.
+# Workers normally stop themselves at the limit, but a signal can't interrupt a long call
+# into C code, so this is the backstop.
+LIMIT_GRACE_PERIOD = 1.0
+
+
+def _serializationContext():
+    return TypedPythonCodebase.FromRootlevelModule(research_app).serializationContext
+
+
+class Cancellation:
+    """A flag, set when the result of an evaluation is no longer wanted.
+
+    Besides being checked, it can be waited on alongside worker connections, so the pool
+    reacts to it immediately.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._isCancelled = False
+        self.reader, self._writer = multiprocessing.Pipe(duplex=False)
+
+    def cancel(self):
+        with self._lock:
+            if not self._isCancelled:
+                self._isCancelled = True
+                self._writer.send_bytes(b"cancel")
+
+    def isCancelled(self):
+        return self._isCancelled
+
+    def close(self):
+        self.reader.close()
+        self._writer.close()
+
+
+def _workerMain(conn, temporaryStorageRoot, checkpointBudgetBytes, blockThreads, chunkStoreRoot):
+    """Entrypoint of a worker process: evaluate the scripts sent over 'conn' until told to stop."""
+    from research_app.ResearchBackend import ResearchBackend, EvaluationCancelled
+    import research_app.ScriptCheckpoints as ScriptCheckpoints
+    import research_app.BlockDependencies as BlockDependencies
+    import research_app.ChunkStore as ChunkStore
+    import research_app.PlotPyramid as PlotPyramid
+
+    if chunkStoreRoot is not None:
+        # the pyramids of series bigger than memory go on the same disk as the chunks they'll become
+        PlotPyramid.SCRATCH_DIRECTORY = chunkStoreRoot
+
+    serializationContext = _serializationContext()
+    runtimeConfig = types.SimpleNamespace(serviceTemporaryStorageRoot=temporaryStorageRoot)
+    checkpoints = ScriptCheckpoints.CheckpointCache(checkpointBudgetBytes)
+    retainedRuns = BlockDependencies.RetainedRunCache(BlockDependencies.DEFAULT_RETAINED_RUNS)
+    chunkStore = ChunkStore.ChunkStore(chunkStoreRoot) if chunkStoreRoot is not None else None
+
+    def serializeDisplays(displays):
+        # move large arrays out of band here, so they don't even cross the pipe
+        if chunkStore is not None:
+            displays = [chunkStore.externalize(d) for d in displays]
+
+        return serializationContext.serialize(TupleOf(Display)(displays), TupleOf(Display))
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+
+        if job is None:
+            return
+
+        if job[0] == "cancel":
+            # we finished the evaluation this was meant for before it arrived
+            continue
+
+        _, script, snippet, limits, scriptKey = job
+
+        def shouldCancel():
+            # the only thing the pool sends us while we're evaluating is a cancellation
+            return conn.poll()
+
+        def onDisplays(displays):
+            conn.send(("displays", serializeDisplays(displays)))
+
+        def onBlockBoundary(block, isStart):
+            # so the pool can enforce per-block wall-clock limits on code signals can't interrupt
+            conn.send(("block", tuple(block.line_range) if isStart else None))
+
+        try:
+            error, displays = ResearchBackend.evaluateResearchScript(
+                runtimeConfig, script, snippet, checkpoints=checkpoints, shouldCancel=shouldCancel,
+                limits=limits, onDisplays=onDisplays, retainedRuns=retainedRuns, scriptKey=scriptKey,
+                threadCount=blockThreads,
+                onBlockBoundary=onBlockBoundary if limits is not None and limits.blockWallSeconds else None
+                )
+            payload = serializeDisplays(displays)
+        except EvaluationCancelled:
+            conn.recv()
+            conn.send(("cancelled",))
+            continue
+        except Exception:
+            error, payload = traceback.format_exc(), None
+
+        conn.send(("result", error, payload))
+
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+
+        # when we last ran each of the scripts we ran most recently, by key. We are likely to
+        # hold their namespaces and checkpoints.
+        self.affinityKeys = collections.OrderedDict()
+
+    def ran(self, affinityKey):
+        self.affinityKeys.pop(affinityKey, None)
+        self.affinityKeys[affinityKey] = time.time()
+
+        while len(self.affinityKeys) > BlockDependencies.DEFAULT_RETAINED_RUNS:
+            self.affinityKeys.popitem(last=False)
+
+    def kill(self):
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+
+        if self.process.is_alive():
+            self.process.kill()
+
+        self.process.join()
+
+
+class InterpreterPool:
+    def __init__(self, size, temporaryStorageRoot, checkpointBudgetBytes, limits=None, blockThreads=1,
+                 chunkStoreRoot=None):
+        """Keep 'size' warm workers, each enforcing ExecutionLimits 'limits' on what they run.
+
+        Workers run independent blocks of a script on up to 'blockThreads' threads. If
+        'chunkStoreRoot' is given, they move the large arrays of the displays they return into
+        the ChunkStore.ChunkStore there.
+        """
+        self._logger = logging.getLogger(__name__)
+        self._size = size
+        self._limits = limits
+        self._workerArgs = (temporaryStorageRoot, checkpointBudgetBytes, blockThreads, chunkStoreRoot)
+
+        self._context = multiprocessing.get_context('forkserver')
+        self._context.set_forkserver_preload(PRELOADED_MODULES)
+
+        self._serializationContext = _serializationContext()
+
+        self._lock = threading.Condition()
+        self._idle = []
+        self._workerCount = 0
+        self._isShutDown = False
+
+        self._refiller = threading.Thread(target=self._refillLoop, daemon=True)
+        self._refiller.start()
+
+    def _startWorker(self):
+        parentConn, childConn = self._context.Pipe()
+
+        process = self._context.Process(
+            target=_workerMain,
+            args=(childConn,) + self._workerArgs,
+            daemon=True
+            )
+        process.start()
+        childConn.close()
+
+        return _Worker(process, parentConn)
+
+    def _refillLoop(self):
+        """Keep the pool topped up with warm workers until we shut down."""
+        with self._lock:
+            while not self._isShutDown:
+                if self._workerCount >= self._size:
+                    self._lock.wait()
+                    continue
+
+                # reserve the slot, and start the process without holding the lock
+                self._workerCount += 1
+                self._lock.release()
+
+                try:
+                    worker = self._startWorker()
+                except Exception:
+                    self._logger.error("Failed to start interpreter:\n%s", traceback.format_exc())
+                    worker = None
+                    time.sleep(WORKER_RESTART_DELAY)
+                finally:
+                    self._lock.acquire()
+
+                if worker is None:
+                    self._workerCount -= 1
+                elif self._isShutDown:
+                    self._workerCount -= 1
+                    worker.kill()
+                else:
+                    self._idle.append(worker)
+                    self._lock.notify_all()
+
+    def _acquire(self, affinityKey):
+        with self._lock:
+            t0 = time.time()
+
+            while not self._idle:
+                if self._isShutDown:
+                    raise Exception("InterpreterPool is shut down.")
+
+                remaining = WORKER_AVAILABLE_TIMEOUT - (time.time() - t0)
+                if remaining <= 0:
+                    raise Exception(
+                        f"No interpreter became available within {WORKER_AVAILABLE_TIMEOUT} seconds."
+                        )
+
+                self._lock.wait(remaining)
+
+            # prefer a worker that ran this script recently, since it holds its namespace and
+            # checkpoints, and the one that ran it last if there are several. Otherwise, use the
+            # one that has been idle the longest.
+            holders = [w for w in self._idle if affinityKey is not None and affinityKey in w.affinityKeys]
+
+            if holders:
+                worker = max(holders, key=lambda w: w.affinityKeys[affinityKey])
+            else:
+                worker = self._idle[0]
+
+            self._idle.remove(worker)
+            return worker
+
+    def _release(self, worker, healthy):
+        with self._lock:
+            if healthy and not self._isShutDown:
+                self._idle.append(worker)
+            else:
+                self._workerCount -= 1
+                worker.kill()
+
+            self._lock.notify_all()
+
+    def execute(self, script, snippet, affinityKey=None, cancellation=None, onDisplays=None):
+        """Evaluate 'script' (and 'snippet') in a worker process.
+
+        Workers keep the namespace each script (identified by 'affinityKey') was left in, so
+        running it again only re-runs the blocks that changed.
+
+        Returns a pair (error, displays), just like ResearchBackend.evaluateResearchScript,
+        or None if 'cancellation' was cancelled first. A cancelled worker gets until the end
+        of its current block, or CANCEL_GRACE_PERIOD, whichever comes first, before we kill it.
+
+        If 'onDisplays' is given, we call it (on this thread) with the displays the worker
+        streams back as it finishes each block.
+        """
+        worker = self._acquire(affinityKey)
+        healthy = False
+
+        try:
+            worker.ran(affinityKey)
+            worker.conn.send(("evaluate", script, snippet, self._limits, affinityKey))
+
+            waitables = [worker.conn, worker.process.sentinel]
+            if cancellation is not None:
+                waitables.append(cancellation.reader)
+
+            killDeadline = None
+            limitDeadline = None
+
+            # the deadline of the block the worker is running, and its line range
+            blockDeadline = None
+            blockLines = None
+
+            if self._limits is not None and self._limits.evaluationWallSeconds:
+                limitDeadline = time.time() + self._limits.evaluationWallSeconds + LIMIT_GRACE_PERIOD
+
+            while True:
+                deadlines = [d for d in (killDeadline, limitDeadline, blockDeadline) if d is not None]
+
+                ready = multiprocessing.connection.wait(
+                    waitables,
+                    timeout=max(min(deadlines) - time.time(), 0) if deadlines else None
+                    )
+
+                if worker.conn in ready:
+                    message = worker.conn.recv()
+
+                    if message[0] == "displays":
+                        if onDisplays is not None:
+                            onDisplays(self._serializationContext.deserialize(message[1], TupleOf(Display)))
+                        continue
+
+                    if message[0] == "block":
+                        blockLines = message[1]
+                        blockDeadline = (
+                            time.time() + self._limits.blockWallSeconds + LIMIT_GRACE_PERIOD
+                            if blockLines is not None else None
+                            )
+                        continue
+
+                    healthy = True
+
+                    if message[0] == "cancelled":
+                        return None
+
+                    _, error, payload = message
+                    break
+
+                if cancellation is not None and cancellation.reader in ready:
+                    worker.conn.send(("cancel",))
+                    waitables.remove(cancellation.reader)
+                    killDeadline = time.time() + CANCEL_GRACE_PERIOD
+                elif worker.process.sentinel in ready:
+                    raise EOFError()
+                elif not ready and killDeadline is not None and time.time() >= killDeadline:
+                    self._logger.info("Killing interpreter that didn't stop after being cancelled.")
+                    return None
+                elif not ready and blockDeadline is not None and time.time() >= blockDeadline:
+                    self._logger.info("Killing interpreter that ran past its per-block wall-clock limit.")
+                    return (
+                        f"Evaluation stopped: the block at line_range {blockLines} exceeded the per-block "
+                        f"wall-clock limit of {self._limits.blockWallSeconds} seconds inside code that "
+                        "couldn't be interrupted, so its interpreter was terminated.",
+                        []
+                        )
+                elif not ready and limitDeadline is not None and time.time() >= limitDeadline:
+                    self._logger.info("Killing interpreter that ran past its wall-clock limit.")
+                    return (
+                        "Evaluation stopped: it exceeded the per-evaluation wall-clock limit of "
+                        f"{self._limits.evaluationWallSeconds} seconds inside code that couldn't "
+                        "be interrupted, so its interpreter was terminated.",
+                        []
+                        )
+
+        except (EOFError, OSError):
+            worker.process.join(WORKER_RESTART_DELAY)
+
+            self._logger.error("Interpreter died with exit code %s", worker.process.exitcode)
+
+            return (
+                "The interpreter evaluating this script died unexpectedly "
+                f"(exit code {worker.process.exitcode}).",
+                []
+                )
+        finally:
+            self._release(worker, healthy)
+
+        if payload is None:
+            return (error, [])
+
+        return (error, self._serializationContext.deserialize(payload, TupleOf(Display)))
+
+    def shutdown(self):
+        with self._lock:
+            self._isShutDown = True
+            idle, self._idle = self._idle, []
+            self._workerCount -= len(idle)
+            self._lock.notify_all()
+
+        for worker in idle:
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+
+            worker.process.join(WORKER_RESTART_DELAY)
+            worker.kill()
+
+        self._refiller.join()
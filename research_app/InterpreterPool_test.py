@@ -0,0 +1,153 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import multiprocessing.connection
+import os
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+import research_app.InterpreterPool as InterpreterPool
+from research_app.ExecutionLimits import ExecutionLimits
+from research_app.InterpreterPool import Cancellation
+
+
+class InterpreterPoolTest(unittest.TestCase):
+    def setUp(self):
+        self._tempDir = tempfile.TemporaryDirectory()
+        self.pools = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.shutdown()
+
+        self._tempDir.cleanup()
+
+    def makePool(self, size=1, limits=None):
+        pool = InterpreterPool.InterpreterPool(size, self._tempDir.name, 10 ** 8, limits=limits)
+        self.pools.append(pool)
+        return pool
+
+    def printed(self, result):
+        error, displays = result
+        self.assertIsNone(error)
+        return [d.str for d in displays]
+
+    def cancelAfter(self, seconds):
+        cancellation = Cancellation()
+        threading.Timer(seconds, cancellation.cancel).start()
+        self.addCleanup(cancellation.close)
+        return cancellation
+
+    def test_scripts_run_in_workers_that_keep_their_namespaces(self):
+        pool = self.makePool(size=2)
+        script = "import os\npid = os.getpid()\nprint(pid)\n"
+
+        pid = self.printed(pool.execute(script, None, affinityKey="a"))
+        self.assertNotEqual(pid, [str(os.getpid())])
+
+        # the worker that ran a script before gets it again, and answers snippets from its namespace
+        self.assertEqual(self.printed(pool.execute(script, None, affinityKey="a")), pid)
+        self.assertEqual(self.printed(pool.execute(script, "print(pid)", affinityKey="a")), pid)
+
+    def test_crashed_workers_are_replaced(self):
+        pool = self.makePool()
+
+        # the OOM killer sends SIGKILL
+        crashes = [
+            ("import os\nos._exit(3)\n", 3),
+            ("import os, signal\nos.kill(os.getpid(), signal.SIGKILL)\n", -9)
+            ]
+
+        for script, exitCode in crashes:
+            error, displays = pool.execute(script, None)
+
+            self.assertIn(f"died unexpectedly (exit code {exitCode})", error)
+            self.assertEqual(displays, [])
+
+            # the pool refills in the background
+            self.assertEqual(self.printed(pool.execute("print(1)\n", None)), ['1'])
+
+    def test_cancelled_workers_stop_between_blocks(self):
+        pool = self.makePool()
+        script = "import time\n" + "time.sleep(0.05)\n" * 100 + "print('finished')\n"
+
+        t0 = time.time()
+        self.assertIsNone(pool.execute(script, None, cancellation=self.cancelAfter(0.2)))
+        self.assertLess(time.time() - t0, 2.0)
+
+        # the worker survives being cancelled
+        self.assertEqual(self.printed(pool.execute("print(1)\n", None)), ['1'])
+
+    def test_workers_that_ignore_cancellation_are_killed(self):
+        pool = self.makePool()
+
+        t0 = time.time()
+        self.assertIsNone(pool.execute("import time\ntime.sleep(30)\n", None, cancellation=self.cancelAfter(0.2)))
+        self.assertLess(time.time() - t0, 5.0)
+
+        self.assertEqual(self.printed(pool.execute("print(1)\n", None)), ['1'])
+
+    def test_block_wall_limits(self):
+        pool = self.makePool(limits=ExecutionLimits(blockWallSeconds=0.3))
+
+        # the worker interrupts code that checks for signals itself
+        error, displays = pool.execute("print(1)\nimport time\ntime.sleep(30)\n", None)
+        self.assertIn("per-block wall-clock limit", error)
+        self.assertEqual(len(displays), 1)
+
+        # and the pool kills workers stuck in code that doesn't
+        t0 = time.time()
+        error, _ = pool.execute("print(1)\nx = sum(range(10 ** 12))\n", None)
+
+        self.assertLess(time.time() - t0, 5.0)
+        self.assertIn("the block at line_range (2, 4) exceeded the per-block wall-clock limit", error)
+        self.assertIn("terminated", error)
+
+        # blocks that finish in time aren't affected, however long the evaluation takes
+        script = "import time\n" + "time.sleep(0.1)\n" * 6 + "print(1)\n"
+        self.assertEqual(self.printed(pool.execute(script, None)), ['1'])
+
+    def test_memory_limits_apply_to_each_evaluation(self):
+        pool = self.makePool(limits=ExecutionLimits(memoryBytes=64 * 1024 ** 2))
+
+        # the worker holds more than this before it runs anything, which doesn't count
+        self.assertEqual(self.printed(pool.execute("print(1)\n", None)), ['1'])
+
+        error, _ = pool.execute("xs = numpy.ones(16 * 1024 ** 2)\n", None)
+        self.assertIn("the memory limit of 67108864 bytes", error)
+
+        # what earlier evaluations left behind doesn't count against the next one
+        script = "xs = numpy.ones(6 * 1024 ** 2)\nprint(1)\n"
+        snippet = "ys = numpy.ones(6 * 1024 ** 2)\nprint(2)"
+
+        self.assertEqual(self.printed(pool.execute(script, None, affinityKey="a")), ['1'])
+        self.assertEqual(self.printed(pool.execute(script, snippet, affinityKey="a")), ['2'])
+
+    def test_early_wakeups_without_a_wall_limit(self):
+        pool = self.makePool()
+        wait = multiprocessing.connection.wait
+
+        def waitThatWakesEarly(waitables, timeout=None):
+            # 'wait' may return just before the deadline it was given
+            if timeout is not None and timeout > 0.01:
+                return wait(waitables, timeout - 0.01) or []
+            return wait(waitables, timeout)
+
+        with unittest.mock.patch.object(multiprocessing.connection, 'wait', waitThatWakesEarly):
+            self.assertIsNone(
+                pool.execute("import time\ntime.sleep(30)\n", None, cancellation=self.cancelAfter(0.2))
+                )
@@ -0,0 +1,195 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Candlesticks of plotted series.
+
+A candle summarizes a run of points by its open (first value), high, low, close (last
+value), count and mean. Series indexed by numbers get candles of equal numbers of points,
+which come straight out of the levels of their pyramid (see PlotPyramid), so the work
+depends on the number of candles rather than the number of points.
+
+Series of timestamps get candles of equal spans of time instead (a second, five minutes, a
+day) aligned on the wall clock of the display time zone, so that daily candles start at
+midnight. We aggregate short ranges directly. For longer ones, we aggregate the whole series
+at the chosen width once, CHUNK_POINTS points at a time so that memory doesn't grow with
+the series, keep the candles in the PlotPayloadCache, and slice them for each viewport.
+"""
+
+from typed_python import NamedTuple
+import research_app.PlotPyramid as PlotPyramid
+import research_app.PlotPayloadCache as PlotPayloadCache
+import research_app.PlotTime as PlotTime
+
+import numpy
+
+# the widths of the candles of series of timestamps. We use the narrowest that gives no
+# more candles than we want, or a multiple of the widest.
+TIME_BUCKET_WIDTHS = tuple(
+    numpy.timedelta64(count, unit).astype('timedelta64[ns]')
+    for count, unit in [
+        (1, 'ms'), (10, 'ms'), (100, 'ms'),
+        (1, 's'), (5, 's'), (15, 's'), (30, 's'),
+        (1, 'm'), (5, 'm'), (15, 'm'), (30, 'm'),
+        (1, 'h'), (4, 'h'),
+        (1, 'D'), (7, 'D'), (28, 'D')
+        ]
+    )
+
+# how many points we aggregate at a time
+CHUNK_POINTS = 1 << 20
+
+# ranges of timestamps with more points than this get sliced out of candles of the whole series
+DIRECT_CANDLE_POINTS = 1 << 20
+
+CANDLE_FIELDS = ('x', 'open', 'high', 'low', 'close', 'pointCount', 'mean')
+
+# 'x' is the middle of each candle. The mean of a candle holding NaNs is NaN, and its high
+# and low ignore them.
+Candles = NamedTuple(x=object, open=object, high=object, low=object, close=object, pointCount=object, mean=object)
+
+
+def fromBuckets(buckets):
+    """Return the Candles of PlotPyramid.Buckets 'buckets'."""
+    return Candles(
+        x=buckets.x + (buckets.xLast - buckets.x) / 2,
+        open=buckets.first,
+        high=buckets.max,
+        low=buckets.min,
+        close=buckets.last,
+        pointCount=buckets.pointCount,
+        mean=buckets.sum / buckets.pointCount
+        )
+
+
+def timeBucketWidth(span, maxCandles):
+    """Return the width of the candles of 'span', a timedelta64, so there are no more than about 'maxCandles'."""
+    span = numpy.timedelta64(span, 'ns')
+
+    for width in TIME_BUCKET_WIDTHS:
+        if span <= width * maxCandles:
+            return width
+
+    widest = TIME_BUCKET_WIDTHS[-1]
+
+    return widest * int(-(-span // (widest * maxCandles)))
+
+
+def _aggregate(ids, opens, highs, lows, closes, counts, sums, offsets):
+    """Merge runs of equal 'ids' of partial candles into single candles, in one pass."""
+    starts = numpy.concatenate([[0], numpy.flatnonzero(ids[1:] != ids[:-1]) + 1])
+    lasts = numpy.concatenate([starts[1:], [len(ids)]]) - 1
+
+    return (
+        ids[starts],
+        opens[starts],
+        numpy.fmax.reduceat(highs, starts),
+        numpy.fmin.reduceat(lows, starts),
+        closes[lasts],
+        numpy.add.reduceat(counts, starts),
+        numpy.add.reduceat(sums, starts),
+        offsets[starts]
+        )
+
+
+def timeCandles(series, width, left=0, right=None):
+    """Return the Candles of 'width' of points [left, right) of PlotSeries 'series', whose x are timestamps.
+
+    We read CHUNK_POINTS points at a time, so this works on series mapped from disk that are
+    bigger than memory.
+    """
+    right = len(series.y) if right is None else right
+    widthNanos = int(width / numpy.timedelta64(1, 'ns'))
+
+    partials = []
+
+    for chunkStart in range(left, right, CHUNK_POINTS):
+        chunkEnd = min(chunkStart + CHUNK_POINTS, right)
+
+        x = numpy.asarray(series.x[chunkStart:chunkEnd], dtype='datetime64[ns]')
+        y = numpy.asarray(series.y[chunkStart:chunkEnd])
+        offsets = PlotTime.utcOffsets(x)
+
+        # each point's candle, numbered from the epoch of the wall clock
+        ids = (x.view('int64') + offsets.view('int64')) // widthNanos
+
+        partials.append(_aggregate(ids, y, y, y, y, numpy.ones(len(y), dtype=numpy.int64), y.astype(numpy.float64), offsets))
+
+    if not partials:
+        return Candles(**{name: numpy.zeros(0) for name in CANDLE_FIELDS})
+
+    # a candle may straddle two chunks
+    ids, opens, highs, lows, closes, counts, sums, offsets = _aggregate(
+        *[numpy.concatenate(parts) for parts in zip(*partials)]
+        )
+
+    return Candles(
+        x=(ids * widthNanos + widthNanos // 2 - offsets.view('int64')).view('datetime64[ns]'),
+        open=opens,
+        high=highs,
+        low=lows,
+        close=closes,
+        pointCount=counts,
+        mean=sums / counts
+        )
+
+
+def _slice(candles, lo, hi):
+    return Candles(**{name: getattr(candles, name)[lo:hi] for name in CANDLE_FIELDS})
+
+
+def cachedTimeCandles(series, seriesKey, width):
+    """Return the Candles of 'width' of the whole of 'series', from the PlotPayloadCache if they're in it."""
+    def compute(keys):
+        candles = timeCandles(series, width)
+        return [{name: getattr(candles, name) for name in CANDLE_FIELDS}]
+
+    payload = PlotPayloadCache.cachedPayloads(
+        [('candles', seriesKey, int(width / numpy.timedelta64(1, 'ns')))],
+        compute
+        )[0]
+
+    return Candles(**payload)
+
+
+def candles(series, seriesKey, left, right, maxCandles):
+    """Return the Candles of points [left, right) of PlotSeries 'series', no more than about 'maxCandles' of them.
+
+    'seriesKey' identifies the data of the series (see PlotPayloadCache.seriesKey). Candles
+    may cover a little more than the range.
+    """
+    if series.x is None or not PlotTime.isTimestamps(series.x):
+        return fromBuckets(PlotPyramid.summarize(series, left, right, maxCandles))
+
+    if right <= left:
+        return timeCandles(series, TIME_BUCKET_WIDTHS[0], left, right)
+
+    first, last = series.x[left], series.x[right - 1]
+    width = timeBucketWidth(last - first, maxCandles)
+
+    if right - left <= DIRECT_CANDLE_POINTS:
+        return timeCandles(series, width, left, right)
+
+    wholeSeries = cachedTimeCandles(series, seriesKey, width)
+
+    # the candle holding a point has its middle within half a width of it
+    lo = numpy.searchsorted(wholeSeries.x, first - width // 2, 'left')
+    hi = numpy.searchsorted(wholeSeries.x, last + width // 2, 'right')
+
+    return _slice(wholeSeries, lo, hi)
+
+
+def hoverText(candles):
+    """Return the text shown when hovering over each of 'candles', which Plotly doesn't show itself."""
+    return ["count: %d<br>mean: %.6g" % (count, mean) for count, mean in zip(candles.pointCount.tolist(), candles.mean.tolist())]
@@ -0,0 +1,95 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import numpy
+import unittest
+import unittest.mock
+
+import research_app.PlotCandles as PlotCandles
+import research_app.PlotPyramid as PlotPyramid
+
+
+class PlotCandlesTest(unittest.TestCase):
+    def test_index_candles_come_from_the_pyramid(self):
+        y = numpy.random.randn(100001).cumsum()
+        series = PlotPyramid.seriesFor(y)
+
+        candles = PlotCandles.candles(series, "key", 0, len(y), 500)
+
+        self.assertLessEqual(len(candles.x), 501)
+        self.assertEqual(candles.pointCount.sum(), len(y))
+
+        # the last candle is a partial one
+        self.assertEqual(candles.close[-1], y[-1])
+        self.assertAlmostEqual((candles.mean * candles.pointCount).sum(), y.sum(), places=4)
+
+        start, size = 256 * 3, 256
+        self.assertEqual(candles.pointCount[3], size)
+        self.assertEqual(candles.open[3], y[start])
+        self.assertEqual(candles.close[3], y[start + size - 1])
+        self.assertEqual(candles.high[3], y[start:start + size].max())
+        self.assertEqual(candles.low[3], y[start:start + size].min())
+        self.assertAlmostEqual(candles.mean[3], y[start:start + size].mean())
+
+    def test_time_candles_align_on_the_wall_clock(self):
+        # two days of a point a minute, starting at noon in New York
+        x = numpy.datetime64('2019-01-02T17:00', 'ns') + numpy.arange(2 * 1440) * numpy.timedelta64(1, 'm')
+        y = numpy.arange(len(x), dtype=float)
+        series = PlotPyramid.seriesFor((x, y))
+
+        candles = PlotCandles.candles(series, "key", 0, len(x), 3)
+
+        # a day's candles start at midnight in New York, so we get half a day, a day and half a day
+        self.assertEqual(list(candles.pointCount), [720, 1440, 720])
+        self.assertEqual(list(candles.open), [0, 720, 2160])
+        self.assertEqual(list(candles.close), [719, 2159, 2879])
+        self.assertEqual(list(candles.high), list(candles.close))
+        self.assertEqual(list(candles.low), list(candles.open))
+        self.assertEqual(candles.mean[1], numpy.arange(720, 2160).mean())
+        self.assertEqual(candles.x[1], numpy.datetime64('2019-01-03T17:00', 'ns'))
+
+    def test_chunks_and_cached_candles_match_direct_ones(self):
+        x = numpy.datetime64('2019-03-01', 'ns') + numpy.cumsum(numpy.random.randint(1, 5000, 50000)) * numpy.timedelta64(1, 'ms')
+        y = numpy.random.randn(len(x)).cumsum()
+        series = PlotPyramid.seriesFor((x, y))
+
+        width = PlotCandles.timeBucketWidth(x[-1] - x[0], 200)
+        direct = PlotCandles.timeCandles(series, width)
+
+        with unittest.mock.patch.object(PlotCandles, 'CHUNK_POINTS', 777):
+            chunked = PlotCandles.timeCandles(series, width)
+
+        for name in PlotCandles.CANDLE_FIELDS:
+            if name != 'mean':
+                self.assertTrue(numpy.array_equal(getattr(direct, name), getattr(chunked, name)), name)
+
+        # sums over chunks only differ by rounding
+        self.assertTrue(numpy.allclose(direct.mean, chunked.mean, rtol=1e-9))
+
+        self.assertEqual(direct.pointCount.sum(), len(x))
+
+        with unittest.mock.patch.object(PlotCandles, 'DIRECT_CANDLE_POINTS', 1000):
+            sliced = PlotCandles.candles(series, "chunks_test", 10000, 20000, 200)
+
+        width = PlotCandles.timeBucketWidth(x[19999] - x[10000], 200)
+        wholeSeries = PlotCandles.timeCandles(series, width)
+
+        self.assertLessEqual(sliced.x[0] - width // 2, x[10000])
+        self.assertGreater(sliced.x[-1] + width // 2, x[19999])
+        self.assertTrue(numpy.array_equal(sliced.x, wholeSeries.x[(wholeSeries.x >= sliced.x[0]) & (wholeSeries.x <= sliced.x[-1])]))
+
+    def test_widths_grow_with_the_span(self):
+        self.assertEqual(PlotCandles.timeBucketWidth(numpy.timedelta64(1, 'h'), 500), numpy.timedelta64(15, 's'))
+        self.assertEqual(PlotCandles.timeBucketWidth(numpy.timedelta64(365, 'D'), 500), numpy.timedelta64(1, 'D'))
+        self.assertEqual(PlotCandles.timeBucketWidth(numpy.timedelta64(1000, 'D'), 10), numpy.timedelta64(28 * 4, 'D'))
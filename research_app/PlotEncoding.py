@@ -0,0 +1,132 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Compact encoding of the series plots send to browsers.
+
+Rather than lists of numbers, which are slow to build, big, and slow to parse, we send each
+array as a Plotly typed array: a dict of a dtype and the base64 of the raw buffer, which
+Plotly.js (2.28 or later) turns straight into a typed array. We pick the smallest dtype
+that shows the data faithfully: float32 when its rounding error is negligible next to the
+range of the series, int32 for integers that fit. Evenly spaced x, like the index of a
+plain series, isn't sent at all: the trace gets its first value and the step instead.
+"""
+
+import base64
+import numpy
+
+# the largest rounding error, relative to the range of a series, we accept to send it as
+# float32. A pixel is about 1e-3 of the range.
+FLOAT32_TOLERANCE = 1e-5
+
+# the keys of a trace that hold arrays
+ARRAY_KEYS = ('x', 'y', 'z', 'open', 'close', 'high', 'low')
+
+
+def float32IsFaithful(values, asFloat32):
+    """Is 'asFloat32' close enough to float array 'values' to draw in its place?"""
+    isFinite = numpy.isfinite(values)
+
+    if not (numpy.isfinite(asFloat32) == isFinite).all():
+        return False
+
+    if not isFinite.any():
+        return True
+
+    finiteValues = values[isFinite]
+    span = finiteValues.max() - finiteValues.min()
+    error = numpy.abs(asFloat32[isFinite].astype(values.dtype) - finiteValues).max()
+
+    return error <= span * FLOAT32_TOLERANCE
+
+
+def typedArray(values):
+    """Return numeric array 'values' as a Plotly typed array, or as a list if it isn't numeric.
+
+    Arrays of more than one dimension, like the z of heatmaps, carry their shape.
+    """
+    values = numpy.asarray(values)
+    kind = values.dtype.kind
+
+    if kind == 'b':
+        encoded = values.astype('<u1')
+    elif kind in 'iu':
+        if not len(values) or (values.min() >= -2 ** 31 and values.max() < 2 ** 31):
+            encoded = values.astype('<i4')
+        else:
+            encoded = values.astype('<f8')
+    elif kind == 'f':
+        encoded = values.astype('<f4')
+
+        if not float32IsFaithful(values, encoded):
+            encoded = values.astype('<f8')
+    else:
+        return values.tolist()
+
+    res = {'dtype': encoded.dtype.str[1:], 'bdata': base64.b64encode(encoded.tobytes()).decode('ascii')}
+
+    if values.ndim > 1:
+        res['shape'] = ", ".join(str(size) for size in values.shape)
+
+    return res
+
+
+def evenStep(x):
+    """Return the step between the values of 'x' if they're evenly spaced numbers, or None."""
+    x = numpy.asarray(x)
+
+    if len(x) < 2 or x.dtype.kind not in 'iuf':
+        return None
+
+    steps = numpy.diff(x)
+
+    if not (steps == steps[0]).all():
+        return None
+
+    return steps[0].item()
+
+
+def encodeTrace(trace):
+    """Return a copy of the Plotly trace dict 'trace' with its arrays encoded compactly."""
+    encoded = dict(trace)
+
+    # Plotly only supports 'x0' and 'dx' on traces with a 'y'
+    if 'y' in trace and 'x' in trace:
+        step = evenStep(trace['x'])
+
+        if step is not None:
+            del encoded['x']
+            encoded['x0'] = numpy.asarray(trace['x'])[0].item()
+            encoded['dx'] = step
+
+    for key in ARRAY_KEYS:
+        if key in encoded and isinstance(encoded[key], numpy.ndarray):
+            encoded[key] = typedArray(encoded[key])
+
+    return encoded
+
+
+def encodedBytes(value):
+    """Estimate the bytes of trace value 'value' once it's sent."""
+    if isinstance(value, numpy.ndarray):
+        return value.nbytes
+
+    if isinstance(value, dict) and 'bdata' in value:
+        return len(value['bdata'])
+
+    if isinstance(value, list):
+        # wall-clock strings, mostly
+        return 32 * len(value)
+
+    return 64
@@ -0,0 +1,68 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import base64
+import numpy
+import unittest
+
+from research_app.PlotEncoding import typedArray, encodeTrace
+
+
+def decode(spec):
+    return numpy.frombuffer(base64.b64decode(spec['bdata']), dtype='<' + spec['dtype'])
+
+
+class PlotEncodingTest(unittest.TestCase):
+    def test_float32_when_faithful(self):
+        values = numpy.random.randn(1000).cumsum()
+
+        spec = typedArray(values)
+
+        self.assertEqual(spec['dtype'], 'f4')
+        self.assertTrue(numpy.allclose(decode(spec), values, rtol=1e-6))
+
+    def test_float64_when_float32_would_flatten_the_series(self):
+        # prices around a big offset that move by less than float32 can resolve
+        values = 1.5e9 + numpy.random.rand(1000)
+
+        spec = typedArray(values)
+
+        self.assertEqual(spec['dtype'], 'f8')
+        self.assertTrue((decode(spec) == values).all())
+
+    def test_integers_and_nans(self):
+        self.assertEqual(typedArray(numpy.arange(10))['dtype'], 'i4')
+        self.assertEqual(typedArray(numpy.array([0, 2 ** 40]))['dtype'], 'f8')
+
+        spec = typedArray(numpy.array([1.0, numpy.nan, 3.0]))
+        self.assertEqual(spec['dtype'], 'f4')
+        self.assertTrue(numpy.isnan(decode(spec)[1]))
+
+    def test_even_x_becomes_a_start_and_step(self):
+        trace = encodeTrace({'x': numpy.arange(100, 200, 4), 'y': numpy.zeros(25), 'line': {'color': 'red'}})
+
+        self.assertEqual((trace['x0'], trace['dx']), (100, 4))
+        self.assertNotIn('x', trace)
+        self.assertEqual(trace['line'], {'color': 'red'})
+
+        trace = encodeTrace({'x': numpy.array([0, 7, 8, 15]), 'y': numpy.zeros(4)})
+        self.assertEqual(list(decode(trace['x'])), [0, 7, 8, 15])
+
+    def test_matrices_carry_their_shape(self):
+        z = numpy.random.rand(3, 5)
+        spec = encodeTrace({'type': 'heatmap', 'z': z})['z']
+
+        self.assertEqual(spec['shape'], "3, 5")
+        self.assertTrue(numpy.allclose(decode(spec).reshape(3, 5), z, rtol=1e-6))
+        self.assertNotIn('shape', typedArray(numpy.arange(10)))
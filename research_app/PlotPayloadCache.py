@@ -0,0 +1,221 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+A process-wide cache of the downsampled series that plots send to browsers.
+
+Everybody looking at the same evaluation asks for the same payloads, so we key them by
+the contents of the series (the chunk hash, for series in the chunk store), the viewport,
+how it's drawn and how many points we send, and compute each one once. Viewports are
+snapped outward to a grid a fraction of their width, so that nearby viewports share
+entries. Once the cached payloads add up to more than a byte budget, we evict the least
+recently used ones.
+"""
+
+from research_app.ChunkStore import ChunkRef
+import research_app.ChunkStore as ChunkStore
+import research_app.PlotEncoding as PlotEncoding
+
+import collections
+import hashlib
+import logging
+import math
+import numbers
+import numpy
+import threading
+
+DEFAULT_PLOT_CACHE_BUDGET_BYTES = 64 * 1024 ** 2
+
+# viewports snap to a grid of at least this many steps per viewport width
+RANGE_STEPS_PER_VIEW = 16
+
+# how many lookups between log lines reporting the hit rate
+STATS_LOG_INTERVAL = 1000
+
+
+def seriesKey(value):
+    """Return a hash identifying the data of plot argument 'value', before its chunks are resolved."""
+    hasher = hashlib.blake2b(digest_size=20)
+
+    def add(array):
+        if isinstance(array, ChunkRef):
+            hasher.update(b"chunk:" + array.hash.encode())
+        else:
+            array = numpy.ascontiguousarray(array)
+            hasher.update(f"{array.dtype.str}:{array.shape}:".encode())
+
+            if array.dtype.hasobject:
+                hasher.update(str(array.tolist()).encode())
+            else:
+                hasher.update(array.reshape(-1).view(numpy.uint8))
+
+        return array
+
+    ChunkStore.mapArrays(value, add)
+
+    return hasher.hexdigest()
+
+
+def snapRange(xRange):
+    """Widen 'xRange' to the grid that viewports of its width snap to."""
+    if xRange is None:
+        return None
+
+    minX, maxX = xRange
+
+    if isinstance(minX, numpy.datetime64) and isinstance(maxX, numpy.datetime64):
+        # snap timestamps as nanoseconds
+        asNanos = [int(bound.astype('datetime64[ns]').astype('int64')) for bound in (minX, maxX)]
+        return tuple(numpy.datetime64(int(bound), 'ns') for bound in snapRange(asNanos))
+
+    if not isinstance(minX, numbers.Real) or not isinstance(maxX, numbers.Real) or not maxX > minX:
+        return xRange
+
+    step = 2.0 ** math.floor(math.log2((maxX - minX) / RANGE_STEPS_PER_VIEW))
+
+    return (math.floor(minX / step) * step, math.ceil(maxX / step) * step)
+
+
+def payloadBytes(payload):
+    """Estimate the bytes held by 'payload', a dict of arrays, encoded arrays and small values."""
+    return sum(PlotEncoding.encodedBytes(value) for value in payload.values())
+
+
+class PlotPayloadCache:
+    def __init__(self, budgetBytes=DEFAULT_PLOT_CACHE_BUDGET_BYTES):
+        self.budgetBytes = budgetBytes
+        self.hits = 0
+        self.misses = 0
+
+        self._logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._payloads = collections.OrderedDict()
+        self._bytes = 0
+        self._nextStatsLog = STATS_LOG_INTERVAL
+
+        # events set once the payloads somebody is computing are in, by key
+        self._pending = {}
+
+    def payloads(self, keys, computeMissing):
+        """Return the payloads of 'keys', calling 'computeMissing(missingKeys)' for the ones we don't have.
+
+        'computeMissing' returns a list of payloads, one per key it's given. Callers that want
+        payloads somebody else is already computing wait for them rather than computing them
+        again. Payloads are shared, so nobody may modify them.
+        """
+        found = {}
+        mine = []
+        theirs = []
+
+        with self._lock:
+            for key in keys:
+                if key in self._payloads:
+                    self._payloads.move_to_end(key)
+                    found[key] = self._payloads[key]
+                    self.hits += 1
+                elif key in self._pending:
+                    theirs.append((key, self._pending[key]))
+                    self.hits += 1
+                elif key not in found and key not in mine:
+                    self._pending[key] = threading.Event()
+                    mine.append(key)
+                    self.misses += 1
+
+            if self.hits + self.misses >= self._nextStatsLog:
+                self._nextStatsLog += STATS_LOG_INTERVAL
+                self._logger.info("Plot payload cache: %s", self.statsText())
+
+        try:
+            if mine:
+                computed = computeMissing(mine)
+
+                with self._lock:
+                    for key, payload in zip(mine, computed):
+                        found[key] = payload
+                        self._store(key, payload)
+        finally:
+            with self._lock:
+                for key in mine:
+                    self._pending.pop(key).set()
+
+        for key, event in theirs:
+            event.wait()
+
+            with self._lock:
+                payload = self._payloads.get(key)
+
+            if payload is None:
+                # whoever was computing it failed, or it was evicted already
+                payload = computeMissing([key])[0]
+
+            found[key] = payload
+
+        return [found[key] for key in keys]
+
+    def _store(self, key, payload):
+        byteCount = payloadBytes(payload)
+
+        if byteCount > self.budgetBytes:
+            return
+
+        if key in self._payloads:
+            self._bytes -= payloadBytes(self._payloads.pop(key))
+
+        self._payloads[key] = payload
+        self._bytes += byteCount
+
+        while self._bytes > self.budgetBytes:
+            _, evicted = self._payloads.popitem(last=False)
+            self._bytes -= payloadBytes(evicted)
+
+    def stats(self):
+        """Return a dict of our hits, misses, hit rate, entries and bytes."""
+        with self._lock:
+            lookups = self.hits + self.misses
+
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                hitRate=self.hits / lookups if lookups else 0.0,
+                entries=len(self._payloads),
+                bytes=self._bytes
+                )
+
+    def statsText(self):
+        lookups = self.hits + self.misses
+
+        return "%s hits, %s misses (%.1f%% hit rate), %s entries, %s bytes" % (
+            self.hits,
+            self.misses,
+            100.0 * self.hits / lookups if lookups else 0.0,
+            len(self._payloads),
+            self._bytes
+            )
+
+
+_cache = PlotPayloadCache()
+
+
+def cachedPayloads(keys, computeMissing):
+    """Look 'keys' up in the process-wide PlotPayloadCache. See PlotPayloadCache.payloads."""
+    return _cache.payloads(keys, computeMissing)
+
+
+def cacheStats():
+    """The stats of the process-wide PlotPayloadCache."""
+    return _cache.stats()
+
+
+def cacheStatsText():
+    return _cache.statsText()
@@ -0,0 +1,79 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import numpy
+import threading
+import time
+import unittest
+
+from research_app.PlotPayloadCache import PlotPayloadCache, seriesKey, snapRange
+import research_app.PlotPyramid as PlotPyramid
+
+
+class PlotPayloadCacheTest(unittest.TestCase):
+    def test_payloads_are_computed_once(self):
+        cache = PlotPayloadCache()
+        computed = []
+
+        def compute(keys):
+            computed.extend(keys)
+            return [{'y': numpy.arange(k)} for k in keys]
+
+        cache.payloads([1, 2], compute)
+        payloads = cache.payloads([2, 3], compute)
+
+        self.assertEqual(computed, [1, 2, 3])
+        self.assertEqual(len(payloads[0]['y']), 2)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_concurrent_viewers_share_the_work(self):
+        cache = PlotPayloadCache()
+        computed = []
+
+        def compute(keys):
+            computed.extend(keys)
+            time.sleep(0.1)
+            return [{'y': numpy.zeros(10)} for _ in keys]
+
+        threads = [threading.Thread(target=cache.payloads, args=(["viewport"], compute)) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(computed, ["viewport"])
+        self.assertEqual(cache.stats()['hits'], 19)
+
+    def test_least_recently_used_payloads_get_evicted(self):
+        cache = PlotPayloadCache(budgetBytes=2500)
+
+        def compute(keys):
+            return [{'y': numpy.zeros(100)} for _ in keys]
+
+        cache.payloads([1, 2, 3], compute)
+        cache.payloads([1], compute)
+        cache.payloads([4], compute)
+
+        self.assertEqual(list(cache._payloads), [3, 1, 4])
+        self.assertLessEqual(cache.stats()['bytes'], 2500)
+
+    def test_keys_and_ranges(self):
+        self.assertEqual(
+            seriesKey(PlotPyramid.seriesFor(numpy.arange(5000))),
+            seriesKey(PlotPyramid.seriesFor(numpy.arange(5000)))
+            )
+        self.assertNotEqual(seriesKey(numpy.arange(5)), seriesKey(numpy.arange(5.0)))
+
+        self.assertEqual(snapRange((0.1, 15.9)), (0.0, 16.0))
+        self.assertEqual(snapRange((None, 3)), (None, 3))
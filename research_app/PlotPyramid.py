@@ -0,0 +1,471 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Level-of-detail pyramids, so plots of long series can be redrawn without touching every point.
+
+When a script calls plot(), the backend turns each series into a PlotSeries, which carries
+the minimum, maximum and sum of every run of BASE_FACTOR points, then of every run of twice
+as many, and so on up to a level of about TOP_LEVEL_BUCKETS buckets. Buckets are aligned on
+multiples of their size, so the first and last point of a bucket (and their x) can be read
+straight out of the series, and the levels only need to hold extremes and sums.
+
+To draw a viewport, the frontend finds the points it covers (with a binary search over x, or
+straight from the range if x is just the index), picks the finest level that yields no
+more buckets than it wants, and slices it. The work depends on the number of buckets drawn
+rather than the length of the series.
+
+Scripts can plot plain sequences of numbers, (x, y) pairs, pandas-style series (whose
+index is the x), and tables, meaning structured arrays and DataFrames, each numeric column
+of which becomes a series. X may be numbers or timestamps. We sort series by x once, when
+they're plotted, so frontends can binary search it.
+
+Series may be bigger than memory: numpy memmaps, or chunked arrays like h5py datasets, which
+we copy into a memmap. We read them CHUNK_POINTS points at a time, and the levels of their
+pyramids live in scratch files the OS can page out, until the backend moves them into the
+ChunkStore. Only series whose x needs sorting have to fit in memory.
+"""
+
+from typed_python import NamedTuple, TupleOf
+import research_app.PlotTime as PlotTime
+
+import numpy
+import tempfile
+
+# the number of points summarized by each bucket of the finest level
+BASE_FACTOR = 8
+
+# we stop adding coarser levels once one has this many buckets or fewer
+TOP_LEVEL_BUCKETS = 256
+
+# series shorter than this are cheap enough to summarize on the fly
+MIN_PYRAMID_POINTS = BASE_FACTOR * TOP_LEVEL_BUCKETS
+
+# the columns of a table we take to be its x, in order of preference
+X_COLUMN_NAMES = ('timestamp', 'time', 'x')
+
+# how many points of a series we read at a time. A multiple of every level's factor.
+CHUNK_POINTS = 1 << 22
+
+# levels of series bigger than memory go to scratch files once they're this big
+SCRATCH_LEVEL_BYTES = 64 * 1024 ** 2
+
+# where scratch files go. None means the system's temporary directory.
+SCRATCH_DIRECTORY = None
+
+
+# 'x' holds the x of every point, in ascending order, or None if it's just the index. 'levels[i]' is an array of
+# shape (3, bucketCount) holding the min, the max and the sum of each bucket of levelFactor(i) points.
+PlotSeries = NamedTuple(x=object, y=object, levels=TupleOf(object))
+
+
+# what 'summarize' returns: for each bucket, the x of its first and last point, its first,
+# last, lowest and highest values, their sum and how many points it holds.
+Buckets = NamedTuple(
+    factor=int,
+    x=object,
+    xLast=object,
+    first=object,
+    last=object,
+    min=object,
+    max=object,
+    sum=object,
+    pointCount=object
+    )
+
+
+def levelFactor(levelIx):
+    """The number of points a bucket of level 'levelIx' summarizes."""
+    return BASE_FACTOR * 2 ** levelIx
+
+
+def bucketSummaries(values, factor):
+    """Return an array of shape (3, n) of the min, max and sum of each run of 'factor' of 'values'.
+
+    NaNs are ignored by the min and max, unless a whole run is NaN, and make the sum NaN.
+    Sums are float64, whatever 'values' are, so they don't overflow.
+    """
+    starts = numpy.arange(0, len(values), factor)
+
+    if not len(starts):
+        return numpy.zeros((3, 0))
+
+    return numpy.stack([
+        numpy.fmin.reduceat(values, starts),
+        numpy.fmax.reduceat(values, starts),
+        numpy.add.reduceat(values, starts, dtype=numpy.float64)
+        ])
+
+
+def scratchArray(shape, dtype):
+    """Return an array backed by an anonymous file in SCRATCH_DIRECTORY, so the OS can page it out."""
+    return numpy.memmap(tempfile.TemporaryFile(dir=SCRATCH_DIRECTORY), dtype=dtype, mode='w+', shape=shape)
+
+
+def _newLevel(bucketCount, dtype, outOfCore):
+    shape = (3, bucketCount)
+
+    if outOfCore and 3 * bucketCount * dtype.itemsize >= SCRATCH_LEVEL_BYTES:
+        return scratchArray(shape, dtype)
+
+    return numpy.empty(shape, dtype=dtype)
+
+
+def buildLevels(y):
+    """Return the levels of the pyramid of the 1-d array 'y', reading CHUNK_POINTS of it at a time.
+
+    If 'y' is a memmap, big levels go to scratch files too.
+    """
+    if len(y) < MIN_PYRAMID_POINTS:
+        return []
+
+    outOfCore = isinstance(y, numpy.memmap)
+    dtype = numpy.result_type(y.dtype, numpy.float64)
+
+    level = _newLevel(-(-len(y) // BASE_FACTOR), dtype, outOfCore)
+
+    for start in range(0, len(y), CHUNK_POINTS):
+        summaries = bucketSummaries(numpy.asarray(y[start:start + CHUNK_POINTS]), BASE_FACTOR)
+        level[:, start // BASE_FACTOR:start // BASE_FACTOR + summaries.shape[1]] = summaries
+
+    levels = [level]
+
+    while level.shape[1] > TOP_LEVEL_BUCKETS:
+        previous = level
+        level = _newLevel(-(-previous.shape[1] // 2), dtype, outOfCore)
+
+        for start in range(0, previous.shape[1], CHUNK_POINTS):
+            chunk = numpy.asarray(previous[:, start:start + CHUNK_POINTS])
+            pairs = numpy.arange(0, chunk.shape[1], 2)
+
+            level[:, start // 2:start // 2 + len(pairs)] = [
+                numpy.fmin.reduceat(chunk[0], pairs),
+                numpy.fmax.reduceat(chunk[1], pairs),
+                numpy.add.reduceat(chunk[2], pairs)
+                ]
+
+        levels.append(level)
+
+    return levels
+
+
+def _isChunkedArray(value):
+    """Is 'value' a 1-d array that isn't in memory, like an h5py dataset or a zarr array?"""
+    return (
+        not isinstance(value, numpy.ndarray)
+        and hasattr(value, 'shape') and hasattr(value, 'dtype') and hasattr(value, '__getitem__')
+        and not hasattr(value, 'values')
+        and len(value.shape) == 1
+        )
+
+
+def _copyToScratch(value):
+    """Return chunked array 'value' as a memmap of a scratch file, copying CHUNK_POINTS at a time."""
+    copy = scratchArray(value.shape, numpy.dtype(value.dtype))
+
+    for start in range(0, value.shape[0], CHUNK_POINTS):
+        copy[start:start + CHUNK_POINTS] = numpy.asarray(value[start:start + CHUNK_POINTS])
+
+    return copy
+
+
+def _asArray(value):
+    """Return 'value' as a numpy array, leaving memmaps mapped and copying chunked arrays to scratch files."""
+    if isinstance(value, numpy.memmap):
+        return value
+
+    if _isChunkedArray(value):
+        return _copyToScratch(value)
+
+    return numpy.asarray(value)
+
+
+def _isSorted(x):
+    """Is 'x' in ascending order? Reads CHUNK_POINTS at a time."""
+    for start in range(0, len(x), CHUNK_POINTS):
+        # overlap by a point, to compare across chunks
+        chunk = numpy.asarray(x[max(start - 1, 0):start + CHUNK_POINTS])
+
+        if not (chunk[1:] >= chunk[:-1]).all():
+            return False
+
+    return True
+
+
+def _isIndex(x):
+    """Is 'x' just 0, 1, 2, ...? Reads CHUNK_POINTS at a time."""
+    for start in range(0, len(x), CHUNK_POINTS):
+        chunk = numpy.asarray(x[start:start + CHUNK_POINTS])
+
+        if not (chunk == numpy.arange(start, start + len(chunk))).all():
+            return False
+
+    return True
+
+
+def _isPair(value):
+    if not isinstance(value, tuple) or len(value) != 2:
+        return False
+
+    xShape, yShape = numpy.shape(value[0]), numpy.shape(value[1])
+
+    return len(xShape) == 1 and xShape == yShape
+
+
+def _isIndexedSeries(value):
+    """Is 'value' a pandas-style series, whose index holds its x?"""
+    return (
+        not isinstance(value, (numpy.ndarray, list, tuple, dict))
+        and hasattr(value, 'index') and hasattr(value, 'values') and not hasattr(value, 'columns')
+        )
+
+
+def _xValues(x):
+    """Return 'x' as an array of numbers or timestamps, None if it's just the index, or False if it's neither."""
+    x = _asArray(getattr(x, 'values', x))
+
+    timestamps = PlotTime.asTimestamps(x)
+    if timestamps is not None:
+        return timestamps
+
+    if x.ndim != 1 or x.dtype.kind not in 'iuf':
+        return False
+
+    if x.dtype.kind in 'iu' and _isIndex(x):
+        return None
+
+    return x
+
+
+def seriesFor(value):
+    """Return the PlotSeries of what a script passed to plot(), or 'value' itself if it's not a series.
+
+    Series are one dimensional sequences of numbers, (x, y) pairs of them, or pandas-style
+    series, whose index is their x. Memmaps stay mapped, so they may be bigger than memory,
+    unless their x needs sorting.
+    """
+    if isinstance(value, PlotSeries):
+        return value
+
+    x, y = None, value
+
+    if _isPair(value):
+        x, y = value
+    elif _isIndexedSeries(value):
+        x, y = value.index, value.values
+
+    try:
+        y = _asArray(y)
+    except Exception:
+        return value
+
+    if y.ndim != 1 or y.dtype.kind not in 'biuf':
+        return value
+
+    if x is not None:
+        x = _xValues(x)
+
+        if x is False:
+            return value
+
+    if x is not None and not _isSorted(x):
+        order = numpy.argsort(x, kind='stable')
+        x, y = x[order], y[order]
+
+    return PlotSeries(x=x, y=y, levels=buildLevels(y))
+
+
+def tableColumns(value):
+    """If 'value' is a table, return a dict of the PlotSeries of each of its numeric columns. Otherwise None.
+
+    Tables are structured arrays and DataFrames. A structured array's x is the first of its
+    fields named in X_COLUMN_NAMES, and a DataFrame's is its index.
+    """
+    if isinstance(value, numpy.ndarray) and value.dtype.names:
+        names = value.dtype.names
+        xName = next((name for name in X_COLUMN_NAMES if name in names), None)
+
+        return {
+            name: seriesFor((value[xName], value[name]) if xName is not None else value[name])
+            for name in names
+            if name != xName and value[name].ndim == 1 and value[name].dtype.kind in 'biuf'
+            }
+
+    if hasattr(value, 'columns') and hasattr(value, 'index'):
+        return {str(column): seriesFor(value[column]) for column in value.columns}
+
+    return None
+
+
+def plotArguments(args, kwargs):
+    """Turn the arguments of a script's plot() call into the args and kwargs of its Display.Plot.
+
+    The columns of tables become named series, prefixed with the name of the table, if it has one.
+    """
+    plotArgs = []
+    plotKwargs = {}
+
+    for value in args:
+        columns = tableColumns(value)
+
+        if columns is None:
+            plotArgs.append(seriesFor(value))
+        else:
+            plotKwargs.update(columns)
+
+    for name, value in kwargs.items():
+        columns = tableColumns(value)
+
+        if columns is None:
+            plotKwargs[name] = seriesFor(value)
+        else:
+            plotKwargs.update({f"{name}.{column}": series for column, series in columns.items()})
+
+    return plotArgs, plotKwargs
+
+
+def asSeries(value):
+    """Return 'value' as a PlotSeries, without building any levels, if it isn't one already."""
+    if isinstance(value, PlotSeries):
+        return value
+
+    return PlotSeries(x=None, y=numpy.asarray(value), levels=())
+
+
+def xAt(series, indices):
+    return indices if series.x is None else series.x[indices]
+
+
+def _bound(series, value):
+    """Return viewport bound 'value' in the units of the x of 'series', or None if it doesn't apply."""
+    if value is None:
+        return None
+
+    isTime = isinstance(value, (numpy.datetime64, str))
+
+    if series.x is not None and PlotTime.isTimestamps(series.x):
+        return PlotTime.parseWallTime(value) if not isinstance(value, numpy.datetime64) else value
+
+    return None if isTime else value
+
+
+def indexRange(series, xRange):
+    """Return the (left, right) slice of the points of 'series' whose x lies within 'xRange'.
+
+    'xRange' is a pair (minX, maxX), either of which may be None, or None itself. Bounds on
+    timestamps may be datetime64s in UTC, or as a date axis sends them (see PlotTime).
+    """
+    count = len(series.y)
+    minX, maxX = xRange if xRange is not None else (None, None)
+    minX, maxX = _bound(series, minX), _bound(series, maxX)
+
+    if series.x is None:
+        left = 0 if minX is None else int(numpy.clip(numpy.ceil(minX), 0, count))
+        right = count if maxX is None else int(numpy.clip(numpy.floor(maxX) + 1, 0, count))
+    else:
+        left = 0 if minX is None else int(numpy.searchsorted(series.x, minX, 'left'))
+        right = count if maxX is None else int(numpy.searchsorted(series.x, maxX, 'right'))
+
+    return left, max(left, right)
+
+
+def summarize(series, left, right, maxBuckets):
+    """Summarize points [left, right) of PlotSeries 'series' in no more than about 'maxBuckets' Buckets.
+
+    If the points fit, every point is its own bucket. Otherwise we use the finest level
+    of the pyramid whose buckets are big enough, which may cover a little more than the
+    range, and fall back on summarizing the points themselves if there's no such level.
+    """
+    y = series.y
+    count = right - left
+    factor = max(1, -(-count // maxBuckets))
+
+    if factor == 1:
+        points = numpy.arange(left, right)
+        values = y[left:right]
+        x = xAt(series, points)
+        return Buckets(
+            factor=1,
+            x=x,
+            xLast=x,
+            first=values,
+            last=values,
+            min=values,
+            max=values,
+            sum=numpy.asarray(values, dtype=numpy.float64),
+            pointCount=numpy.ones(len(points), dtype=numpy.int64)
+            )
+
+    levelIx = 0
+    while levelIx < len(series.levels) and levelFactor(levelIx) < factor:
+        levelIx += 1
+
+    if levelIx < len(series.levels):
+        factor = levelFactor(levelIx)
+        firstBucket, lastBucket = left // factor, -(-right // factor)
+
+        starts = numpy.arange(firstBucket, lastBucket) * factor
+        ends = numpy.minimum(starts + factor, len(y))
+        summaries = series.levels[levelIx][:, firstBucket:lastBucket]
+    else:
+        starts = numpy.arange(left, right, factor)
+        ends = numpy.minimum(starts + factor, right)
+        summaries = bucketSummaries(numpy.asarray(y[left:right]), factor)
+
+    return Buckets(
+        factor=factor,
+        x=xAt(series, starts),
+        xLast=xAt(series, ends - 1),
+        first=y[starts],
+        last=y[ends - 1],
+        min=summaries[0],
+        max=summaries[1],
+        sum=summaries[2],
+        pointCount=ends - starts
+        )
+
+
+def peakPreservingLines(bucketsPerSeries):
+    """Return, for each Buckets in 'bucketsPerSeries', the (x, y) of a line through its extremes.
+
+    Each bucket contributes its min and its max, in the order that keeps the line going the
+    way the bucket does, so spikes survive however far we zoom out. Buckets of single points
+    contribute the point. All the series are handled in one pass.
+    """
+    if not bucketsPerSeries:
+        return []
+
+    splits = numpy.cumsum([len(buckets.min) for buckets in bucketsPerSeries])[:-1]
+
+    lows = numpy.concatenate([buckets.min for buckets in bucketsPerSeries])
+    highs = numpy.concatenate([buckets.max for buckets in bucketsPerSeries])
+    rising = (
+        numpy.concatenate([buckets.first for buckets in bucketsPerSeries]) <=
+        numpy.concatenate([buckets.last for buckets in bucketsPerSeries])
+        )
+
+    ys = numpy.empty((len(lows), 2), dtype=numpy.result_type(lows, highs))
+    ys[:, 0] = numpy.where(rising, lows, highs)
+    ys[:, 1] = numpy.where(rising, highs, lows)
+
+    lines = []
+
+    for buckets, seriesYs in zip(bucketsPerSeries, numpy.split(ys, splits)):
+        if buckets.factor == 1:
+            lines.append((buckets.x, buckets.last))
+        else:
+            xs = numpy.stack([numpy.asarray(buckets.x), numpy.asarray(buckets.xLast)], axis=1)
+            lines.append((xs.reshape(-1), seriesYs.reshape(-1)))
+
+    return lines
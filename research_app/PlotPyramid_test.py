@@ -0,0 +1,173 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import numpy
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import research_app.PlotPyramid as PlotPyramid
+
+
+class PlotPyramidTest(unittest.TestCase):
+    def checkBuckets(self, y, buckets, left, right):
+        """Check that 'buckets' summarize y[left:right] (give or take whole buckets at the ends)."""
+        starts = list(buckets.x)
+
+        for ix, start in enumerate(starts):
+            end = min(start + buckets.factor, len(y))
+            self.assertEqual(buckets.first[ix], y[start])
+            self.assertEqual(buckets.last[ix], y[end - 1])
+            self.assertEqual(buckets.min[ix], y[start:end].min())
+            self.assertEqual(buckets.max[ix], y[start:end].max())
+            self.assertAlmostEqual(buckets.sum[ix], y[start:end].sum(), places=6)
+            self.assertEqual(buckets.pointCount[ix], end - start)
+
+        self.assertLessEqual(starts[0], left)
+        self.assertGreaterEqual(starts[-1] + buckets.factor, right)
+
+    def test_levels_halve(self):
+        series = PlotPyramid.seriesFor(numpy.random.rand(100001))
+
+        self.assertEqual(series.levels[0].shape, (3, 12501))
+        self.assertLessEqual(series.levels[-1].shape[1], PlotPyramid.TOP_LEVEL_BUCKETS)
+
+        for ix in range(1, len(series.levels)):
+            self.assertEqual(series.levels[ix].shape[1], (series.levels[ix - 1].shape[1] + 1) // 2)
+
+    def test_summaries_match_the_points(self):
+        y = numpy.random.randn(54321).cumsum()
+        series = PlotPyramid.seriesFor(y)
+
+        for left, right, maxBuckets in [(0, 54321, 500), (1000, 1900, 100), (7, 50007, 2000), (30000, 54321, 10)]:
+            buckets = PlotPyramid.summarize(series, left, right, maxBuckets)
+
+            self.assertLessEqual(len(buckets.x), maxBuckets + 1)
+            self.checkBuckets(y, buckets, left, right)
+
+    def test_small_ranges_are_exact(self):
+        series = PlotPyramid.seriesFor(numpy.arange(100000))
+        left, right = PlotPyramid.indexRange(series, (10.5, 20))
+
+        buckets = PlotPyramid.summarize(series, left, right, 100)
+
+        self.assertEqual(buckets.factor, 1)
+        self.assertEqual(list(buckets.last), list(range(11, 21)))
+
+    def test_non_series_pass_through(self):
+        self.assertEqual(PlotPyramid.seriesFor("hi"), "hi")
+        self.assertEqual(PlotPyramid.seriesFor([[1, 2], [3, 4]]), [[1, 2], [3, 4]])
+        self.assertEqual(len(PlotPyramid.seriesFor([1, 2, 3]).levels), 0)
+
+    def test_peak_preserving_lines_keep_spikes(self):
+        y = numpy.zeros(100000)
+        y[12345] = 100.0
+        y[77777] = -100.0
+
+        short = PlotPyramid.seriesFor(numpy.arange(10))
+        series = PlotPyramid.seriesFor(y)
+
+        lines = PlotPyramid.peakPreservingLines([
+            PlotPyramid.summarize(series, 0, len(y), 500),
+            PlotPyramid.summarize(short, 0, 10, 500)
+            ])
+
+        x, values = lines[0]
+        self.assertLessEqual(len(values), 1000)
+        self.assertEqual(values.max(), 100.0)
+        self.assertEqual(values.min(), -100.0)
+        self.assertTrue((numpy.diff(x) >= 0).all())
+
+        self.assertEqual(list(lines[1][1]), list(range(10)))
+
+    def test_explicit_x_gets_sorted_once(self):
+        x = numpy.random.permutation(50000).astype(float)
+        series = PlotPyramid.seriesFor((x, x * 2))
+
+        self.assertTrue((numpy.diff(series.x) > 0).all())
+        self.assertTrue((series.y == series.x * 2).all())
+
+        left, right = PlotPyramid.indexRange(series, (100.5, 200))
+        self.assertEqual((series.x[left], series.x[right - 1]), (101.0, 200.0))
+
+        buckets = PlotPyramid.summarize(series, 0, 50000, 100)
+        byIndex = PlotPyramid.summarize(PlotPyramid.seriesFor(series.y), 0, 50000, 100)
+
+        self.assertEqual(list(buckets.max), list(byIndex.max))
+        self.assertEqual(list(buckets.x), list(series.x[byIndex.x]))
+
+    def test_tables_become_named_series(self):
+        table = numpy.zeros(10, dtype=[('timestamp', 'datetime64[ns]'), ('bid', 'f8'), ('ask', 'f8'), ('venue', 'U3')])
+        table['timestamp'] = numpy.arange('2019-01-02T14:30', 10, dtype='datetime64[m]')
+
+        args, kwargs = PlotPyramid.plotArguments([table], {'count': numpy.arange(10)})
+
+        self.assertEqual(args, [])
+        self.assertEqual(sorted(kwargs), ['ask', 'bid', 'count'])
+        self.assertEqual(kwargs['bid'].x.dtype, numpy.dtype('datetime64[ns]'))
+        self.assertIsNone(kwargs['count'].x)
+
+        self.assertEqual(PlotPyramid.indexRange(kwargs['bid'], ('2019-01-02 09:32', '2019-01-02 09:34')), (2, 5))
+
+    def test_implicit_indices_need_no_x(self):
+        self.assertIsNone(PlotPyramid.seriesFor((numpy.arange(5), numpy.ones(5))).x)
+        self.assertEqual(list(PlotPyramid.seriesFor((1, 2)).y), [1, 2])
+
+    def test_memmaps_stream_through_scratch_files(self):
+        y = numpy.random.randn(100003).cumsum()
+        inMemory = PlotPyramid.seriesFor(y)
+
+        with tempfile.TemporaryDirectory() as tempDir:
+            path = os.path.join(tempDir, "ticks.f8")
+            y.tofile(path)
+
+            with unittest.mock.patch.multiple(PlotPyramid, CHUNK_POINTS=1024, SCRATCH_LEVEL_BYTES=0):
+                series = PlotPyramid.seriesFor(numpy.memmap(path, dtype='f8', mode='r'))
+
+            self.assertIsInstance(series.y, numpy.memmap)
+            self.assertEqual(len(series.levels), len(inMemory.levels))
+
+            for level, expected in zip(series.levels, inMemory.levels):
+                self.assertIsInstance(level, numpy.memmap)
+                self.assertTrue(numpy.allclose(level, expected))
+
+            del series
+
+    def test_chunked_arrays_are_copied_in_chunks(self):
+        class ChunkedArray:
+            """Like an h5py dataset: it has a shape and a dtype, and gives arrays when sliced."""
+            def __init__(self, array):
+                self.array = array
+                self.shape = array.shape
+                self.dtype = array.dtype
+                self.slices = []
+
+            def __getitem__(self, index):
+                self.slices.append(index)
+                return self.array[index].copy()
+
+        x = numpy.arange(10000, 0, -1) * 2
+        chunkedX = ChunkedArray(numpy.arange(5000) * 3)
+        chunkedY = ChunkedArray(numpy.random.rand(5000))
+
+        with unittest.mock.patch.object(PlotPyramid, 'CHUNK_POINTS', 1024):
+            series = PlotPyramid.seriesFor((chunkedX, chunkedY))
+            self.assertFalse(PlotPyramid._isSorted(x))
+            self.assertTrue(PlotPyramid._isSorted(x[::-1]))
+
+        self.assertIsInstance(series.y, numpy.memmap)
+        self.assertTrue((series.y == chunkedY.array).all())
+        self.assertTrue((series.x == chunkedX.array).all())
+        self.assertEqual(len(chunkedY.slices), 5)
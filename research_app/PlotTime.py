@@ -0,0 +1,111 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Timestamps on the x axis of plots.
+
+Plotted timestamps are kept as datetime64[ns] in UTC. Browsers get them as wall-clock
+strings in the display time zone, which Plotly puts on a date axis, and send viewports back
+in the same form. Converting between the two happens a whole array at a time: we look the
+UTC offset of every timestamp up in the time zone's table of transitions with a single
+binary search, rather than asking pytz about each one.
+"""
+
+import datetime
+import functools
+import numbers
+import numpy
+import pytz
+
+DISPLAY_TIMEZONE = pytz.timezone("America/New_York")
+
+
+def isTimestamps(values):
+    return isinstance(values, numpy.ndarray) and values.dtype.kind == 'M'
+
+
+def asTimestamps(values):
+    """Return 'values' as a datetime64[ns] array in UTC, or None if they aren't timestamps.
+
+    Accepts datetime64 arrays (taken to be in UTC) and sequences of datetimes, which are
+    taken to be in UTC if they're naive.
+    """
+    if not isinstance(values, numpy.ndarray):
+        values = numpy.asarray(values)
+
+    if values.dtype.kind == 'M':
+        # without copying, so memmaps stay mapped
+        return values.astype('datetime64[ns]', copy=False)
+
+    if values.dtype.kind != 'O' or not len(values) or not all(isinstance(v, datetime.datetime) for v in values):
+        return None
+
+    return numpy.array(
+        [v.astimezone(pytz.utc).replace(tzinfo=None) if v.tzinfo is not None else v for v in values],
+        dtype='datetime64[ns]'
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def _transitions(tz):
+    """Return arrays of the UTC times at which 'tz' changes offset, and of the offsets it changes to."""
+    transitionTimes = getattr(tz, '_utc_transition_times', None)
+
+    if not transitionTimes:
+        offset = tz.utcoffset(datetime.datetime(2000, 1, 1))
+        return (
+            numpy.array([numpy.datetime64('1677-09-22', 'ns')]),
+            numpy.array([int(offset.total_seconds())], dtype='timedelta64[s]').astype('timedelta64[ns]')
+            )
+
+    return (
+        numpy.array(transitionTimes, dtype='datetime64[ns]'),
+        numpy.array(
+            [int(utcoffset.total_seconds()) for utcoffset, _, _ in tz._transition_info],
+            dtype='timedelta64[s]'
+            ).astype('timedelta64[ns]')
+        )
+
+
+def utcOffsets(timestamps, tz=DISPLAY_TIMEZONE):
+    """Return the offset from UTC of 'tz' at each of the UTC 'timestamps'."""
+    transitionTimes, offsets = _transitions(tz)
+
+    return offsets[numpy.maximum(numpy.searchsorted(transitionTimes, timestamps, 'right') - 1, 0)]
+
+
+def wallTimeStrings(timestamps, tz=DISPLAY_TIMEZONE):
+    """Return the UTC 'timestamps' as strings of the wall-clock time in 'tz', to the millisecond."""
+    timestamps = numpy.asarray(timestamps, dtype='datetime64[ns]')
+
+    wallTimes = numpy.datetime_as_string((timestamps + utcOffsets(timestamps, tz)).astype('datetime64[ms]'))
+
+    return numpy.char.replace(wallTimes, 'T', ' ')
+
+
+def parseWallTime(value, tz=DISPLAY_TIMEZONE):
+    """Return a viewport bound, as sent back by a date axis, as a UTC datetime64[ns].
+
+    Plotly sends wall-clock strings, or sometimes milliseconds since the epoch.
+    """
+    if isinstance(value, numbers.Real):
+        wallTime = numpy.datetime64(int(value), 'ms').astype('datetime64[ns]')
+    else:
+        wallTime = numpy.datetime64(str(value).strip().replace(' ', 'T'), 'ns')
+
+    # the offset at the wall time read as UTC is only wrong within hours of a transition, and
+    # the offset at the time that gives us is right.
+    guess = wallTime - utcOffsets(numpy.array([wallTime]), tz)[0]
+
+    return wallTime - utcOffsets(numpy.array([guess]), tz)[0]
@@ -0,0 +1,49 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import datetime
+import numpy
+import pytz
+import unittest
+
+import research_app.PlotTime as PlotTime
+
+
+class PlotTimeTest(unittest.TestCase):
+    def test_wall_times_match_pytz_across_transitions(self):
+        timestamps = numpy.arange(
+            '2019-03-09T12:00', '2019-11-04T12:00', numpy.timedelta64(37, 'm'), dtype='datetime64[ns]'
+            )
+
+        expected = [
+            pytz.utc.localize(t).astimezone(PlotTime.DISPLAY_TIMEZONE).strftime('%Y-%m-%d %H:%M:%S.000')
+            for t in timestamps.astype('datetime64[us]').tolist()
+            ]
+
+        self.assertEqual(list(PlotTime.wallTimeStrings(timestamps)), expected)
+
+    def test_wall_times_parse_back(self):
+        timestamps = numpy.arange('2019-03-10T05:00', '2019-03-10T10:00', numpy.timedelta64(1, 'h'), dtype='datetime64[ns]')
+
+        for timestamp, wallTime in zip(timestamps, PlotTime.wallTimeStrings(timestamps)):
+            self.assertEqual(PlotTime.parseWallTime(wallTime), timestamp)
+
+    def test_aware_datetimes_become_utc(self):
+        aware = PlotTime.DISPLAY_TIMEZONE.localize(datetime.datetime(2019, 7, 1, 9, 30))
+
+        self.assertEqual(
+            PlotTime.asTimestamps([aware, datetime.datetime(2019, 7, 1, 14)]).tolist(),
+            numpy.array(['2019-07-01T13:30', '2019-07-01T14:00'], dtype='datetime64[ns]').tolist()
+            )
+        self.assertIsNone(PlotTime.asTimestamps([1, 2]))
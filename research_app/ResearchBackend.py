@@ -20,7 +20,21 @@ from research_app.ContentSchema import Project, Module
 from research_app.EvaluationSchema import EvaluationContext
 import research_app.ContentSchema as ContentSchema
 import research_app.EvaluationSchema as EvaluationSchema
-
+import research_app.ScriptCheckpoints as ScriptCheckpoints
+import research_app.InterpreterPool as InterpreterPool
+import research_app.ExecutionLimits as ExecutionLimits
+import research_app.CompiledBlocks as CompiledBlocks
+import research_app.CodeSegmentation as CodeSegmentation
+import research_app.BlockDependencies as BlockDependencies
+import research_app.ConcurrentBlocks as ConcurrentBlocks
+import research_app.ResultCache as ResultCache
+import research_app.ChunkStore as ChunkStore
+import research_app.PlotPyramid as PlotPyramid
+import research_app.HeatmapPyramid as HeatmapPyramid
+import research_app.Histograms as Histograms
+from research_app.CodeSegmentation import Error, CodeBlock
+
+import contextlib
 import itertools
 import scipy.io
 import research_app
@@ -35,8 +49,11 @@ import time
 import sys
 import io
 import pydoc
+import socket
+import threading
+import uuid
 import research_app.Displayable as Displayable
-from typed_python import python_ast, OneOf, Alternative, TupleOf,\
+from typed_python import OneOf, Alternative, TupleOf,\
                         NamedTuple, Tuple, Class, ConstDict, Member, ListOf
 import datetime
 import ast
@@ -46,48 +63,184 @@ schema = Schema("research_app.ResearchBackend")
 
 @schema.define
 class ServiceConfig:
-    pass
+    # how many bytes of namespace checkpoints each backend may hold. 0 means use the default.
+    checkpoint_budget_bytes = int
+
+    # how many warm interpreter processes each backend keeps. 0 means use the default.
+    interpreter_pool_size = int
+
+    # how many threads each interpreter runs the independent blocks of a script on. 0 means
+    # use the default, which is to run them one at a time.
+    block_threads = int
+
+    # how many bytes of displays the result cache shared by all backends holds. 0 means use
+    # the default.
+    result_cache_budget_bytes = int
+
+    # the directory where the large arrays of displays go. Frontends must be able to read it.
+    # Empty means use the default.
+    chunk_store_path = str
+
+    # limits on user code, in seconds of wall-clock or CPU time, for each block and each
+    # evaluation, and in bytes of memory for each evaluation. 0 means unlimited.
+    block_wall_seconds = float
+    block_cpu_seconds = float
+    evaluation_wall_seconds = float
+    evaluation_cpu_seconds = float
+    memory_limit_bytes = int
 
-Error = NamedTuple(error=str, line=int, trace = str)
+class EvaluationCancelled(Exception):
+    """Raised by evaluateResearchScript when its caller no longer wants the result."""
 
-CodeBlock = NamedTuple(code=str, line_range=Tuple(int,int))
+# how long doWork blocks waiting for new evaluations before checking whether it should stop,
+# or whether some other worker's lease has lapsed.
+WORK_WAIT_TIMEOUT = 1.0
+
+# how long a worker's claim on an evaluation lasts. Workers renew their leases well before
+# then, so this is how long a crashed worker's evaluation stalls before somebody retries it.
+LEASE_DURATION = 10.0
 
 class ResearchBackend(ServiceBase):
     def initialize(self, chunkStoreOverride=None):
+        """Set up the backend. 'chunkStoreOverride', if given, is the ChunkStore.ChunkStore to use."""
         self._logger = logging.getLogger(__file__)
 
         self.db.subscribeToSchema(schema)
         self.db.subscribeToSchema(ContentSchema.schema)
         self.db.subscribeToSchema(EvaluationSchema.schema)
 
+        # identifies this worker in the leases it holds on EvaluationContexts
+        self._workerId = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+        with self.db.view():
+            config = ServiceConfig.lookupAny()
+            budget = (config and config.checkpoint_budget_bytes) or ScriptCheckpoints.DEFAULT_CHECKPOINT_BUDGET_BYTES
+            poolSize = (config and config.interpreter_pool_size) or InterpreterPool.DEFAULT_POOL_SIZE
+            limits = ResearchBackend.executionLimits(config)
+            blockThreads = (config and config.block_threads) or ConcurrentBlocks.DEFAULT_THREAD_COUNT
+            resultCacheBudget = (
+                (config and config.result_cache_budget_bytes) or ResultCache.DEFAULT_RESULT_CACHE_BUDGET_BYTES
+                )
+            chunkStorePath = (config and config.chunk_store_path) or ChunkStore.defaultRoot()
+
+        self._resultCache = ResultCache.ResultCache(self.db, resultCacheBudget, self._workerId)
+        self._chunkStore = chunkStoreOverride or ChunkStore.ChunkStore(chunkStorePath)
+        self._lastChunkCollection = time.time()
+
+        # user code runs in the pool's worker processes, which split the checkpoint budget.
+        self._pool = InterpreterPool.InterpreterPool(
+            poolSize,
+            self.runtimeConfig.serviceTemporaryStorageRoot,
+            budget // poolSize,
+            limits=limits,
+            blockThreads=blockThreads,
+            chunkStoreRoot=self._chunkStore.root
+            )
+
+    @staticmethod
+    def executionLimits(config):
+        """The ExecutionLimits.ExecutionLimits described by ServiceConfig 'config' (which may be None)."""
+        if config is None:
+            return ExecutionLimits.ExecutionLimits()
+
+        return ExecutionLimits.ExecutionLimits(
+            blockWallSeconds=config.block_wall_seconds,
+            blockCpuSeconds=config.block_cpu_seconds,
+            evaluationWallSeconds=config.evaluation_wall_seconds,
+            evaluationCpuSeconds=config.evaluation_cpu_seconds,
+            memoryBytes=config.memory_limit_bytes
+            )
+
+    @staticmethod
+    def configureService(database, serviceObject, checkpointBudgetBytes=None, interpreterPoolSize=None,
+                         limits=None, blockThreads=None, resultCacheBudgetBytes=None, chunkStorePath=None):
+        database.subscribeToType(ServiceConfig)
+
+        with database.transaction():
+            config = ServiceConfig.lookupAny()
+
+            if not config:
+                config = ServiceConfig()
+
+            if checkpointBudgetBytes is not None:
+                config.checkpoint_budget_bytes = checkpointBudgetBytes
+
+            if interpreterPoolSize is not None:
+                config.interpreter_pool_size = interpreterPoolSize
+
+            if blockThreads is not None:
+                config.block_threads = blockThreads
+
+            if resultCacheBudgetBytes is not None:
+                config.result_cache_budget_bytes = resultCacheBudgetBytes
+
+            if chunkStorePath is not None:
+                config.chunk_store_path = chunkStorePath
+
+            if limits is not None:
+                config.block_wall_seconds = limits.blockWallSeconds
+                config.block_cpu_seconds = limits.blockCpuSeconds
+                config.evaluation_wall_seconds = limits.evaluationWallSeconds
+                config.evaluation_cpu_seconds = limits.evaluationCpuSeconds
+                config.memory_limit_bytes = limits.memoryBytes
+
     @staticmethod
-    def configureService(database, serviceObject):
-        pass
+    def _hasPendingWork():
+        if EvaluationSchema.EvaluationContext.lookupAny(state="Dirty") is not None:
+            return True
+
+        curTime = time.time()
+
+        return any(
+            evaluation.isClaimable(curTime)
+            for evaluation in EvaluationSchema.EvaluationContext.lookupAll(state="Calculating")
+            )
 
     def doWork(self, shouldStop):
+        try:
+            self._doWork(shouldStop)
+        finally:
+            self._pool.shutdown()
+
+    def _doWork(self, shouldStop):
         while not shouldStop.is_set():
-            time.sleep(0.25)
-            try:
-                ids_scripts_and_selections = []
-                with self.db.transaction():
-                    evaluation = EvaluationSchema.EvaluationContext.lookupOrCreate()
-                    if evaluation.state in ["Dirty", "Calculating"]:
-                        evaluation.state = "Calculating"
+            if time.time() - self._lastChunkCollection > ChunkStore.CHUNK_GC_INTERVAL:
+                self._lastChunkCollection = time.time()
+
+                try:
+                    self._collectChunks()
+                except Exception:
+                    self._logger.error("Failed to collect unreferenced chunks:\n%s", traceback.format_exc())
+
+            # block until the database tells us that an evaluation needs computing. We time out
+            # so that we notice 'shouldStop' and leases that lapsed without any new transactions.
+            if not self.db.waitForCondition(self._hasPendingWork, timeout=WORK_WAIT_TIMEOUT):
+                # we're idle, so publish the hits and misses our lookups counted
+                try:
+                    self._resultCache.flushCounters()
+                except Exception:
+                    self._logger.error("Failed to flush result cache counters:\n%s", traceback.format_exc())
+                continue
 
-                        curScript = evaluation.module.current_buffer
-                        snippet = evaluation.displaySnippet
+            try:
+                claimed = self._claimEvaluation()
 
-                        ids_scripts_and_selections.append(
-                            (evaluation, evaluation.module, curScript, snippet)
-                            )
+                if claimed is not None:
+                    evaluation, generation, module, curScript, snippet = claimed
 
-                for evaluation, module, curScript, snippet in ids_scripts_and_selections:
                     t0 = time.time()
-                    self.executeResearchScript(
-                        self.db,
-                        self.runtimeConfig,
-                        evaluation, module, curScript, snippet
-                        )
+                    with self._holdingLease(evaluation, generation) as cancellation:
+                        self.executeResearchScript(
+                            self.db,
+                            self.runtimeConfig,
+                            evaluation, module, curScript, snippet,
+                            leaseOwner=self._workerId,
+                            pool=self._pool,
+                            generation=generation,
+                            cancellation=cancellation,
+                            resultCache=self._resultCache,
+                            chunkStore=self._chunkStore
+                            )
 
                     self._logger.info(
                         "Took %s seconds to execute research display for",
@@ -98,64 +251,439 @@ class ResearchBackend(ServiceBase):
                     "Unexpected exception in ResearchBackend:\n%s",
                     traceback.format_exc()
                     )
+                # don't spin on a persistent failure
+                shouldStop.wait(WORK_WAIT_TIMEOUT)
+
+    def _collectChunks(self):
+        """Delete the chunks that no evaluation and no cached result refers to anymore."""
+        liveHashes = set()
+
+        with self.db.view():
+            for evaluation in EvaluationSchema.EvaluationContext.lookupAll():
+                for display in evaluation.displays:
+                    ChunkStore.referencedHashes(display, liveHashes)
+
+            for entry in ResultCache.CachedResult.lookupAll():
+                for display in entry.displays:
+                    ChunkStore.referencedHashes(display, liveHashes)
+
+        self._chunkStore.collectGarbage(liveHashes)
+
+    @revisionConflictRetry
+    def _claimEvaluation(self):
+        """Lease one claimable evaluation to this worker and return what we need to compute it.
+
+        Returns a tuple (evaluation, generation, module, script, snippet), or None if there's
+        nothing to do.
+        Other workers race us for the same evaluations: if one of them claims it first, our
+        transaction conflicts and we retry against the new state. Evaluations of modules that
+        have since been deleted are cleaned up along the way.
+        """
+        with self.db.transaction():
+            curTime = time.time()
+
+            pending = (
+                list(EvaluationSchema.EvaluationContext.lookupAll(state="Dirty")) +
+                list(EvaluationSchema.EvaluationContext.lookupAll(state="Calculating"))
+                )
+
+            for evaluation in pending:
+                if not evaluation.isClaimable(curTime):
+                    continue
+
+                if evaluation.module is None or not evaluation.module.exists():
+                    evaluation.delete()
+                    continue
+
+                evaluation.claim(self._workerId, LEASE_DURATION)
+
+                return (
+                    evaluation,
+                    evaluation.generation,
+                    evaluation.module,
+                    evaluation.module.current_buffer,
+                    evaluation.displaySnippet
+                    )
+
+        return None
+
+    @contextlib.contextmanager
+    def _holdingLease(self, evaluation, generation):
+        """Keep our lease on 'evaluation' while we compute request 'generation' of it.
+
+        Yields an InterpreterPool.Cancellation that gets cancelled as soon as the database
+        shows that the request has been superseded or our lease has been lost.
+        """
+        done = threading.Event()
+        cancellation = InterpreterPool.Cancellation()
+
+        def renewLoop():
+            while not done.wait(LEASE_DURATION / 3):
+                try:
+                    with self.db.transaction():
+                        if not evaluation.exists() or not evaluation.renewLease(self._workerId, LEASE_DURATION):
+                            return
+                except Exception:
+                    self._logger.error("Failed to renew lease:\n%s", traceback.format_exc())
+
+        def isSuperseded():
+            return not evaluation.exists() or evaluation.isSupersededFor(self._workerId, generation)
+
+        def watchLoop():
+            while not done.is_set():
+                if self.db.waitForCondition(lambda: done.is_set() or isSuperseded(), timeout=WORK_WAIT_TIMEOUT):
+                    if not done.is_set():
+                        self._logger.info("Cancelling evaluation superseded by a newer request.")
+                        cancellation.cancel()
+                    return
+
+        threads = [
+            threading.Thread(target=renewLoop, daemon=True),
+            threading.Thread(target=watchLoop, daemon=True)
+            ]
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            yield cancellation
+        finally:
+            done.set()
+            for thread in threads:
+                thread.join()
+            cancellation.close()
 
     @staticmethod
     def breakCodeIntoSegments(code):
         """Break a string containing python code into a list of module-level CodeBlock objects.
 
-        If the code doesn't parse, return a Error object.
+        If the code doesn't parse, return a Error object. Segmentations are cached, and a
+        buffer that differs from the last one by an edit only has the touched statements
+        re-parsed.
         """
-        try:
-            ast.parse(code)
-        except SyntaxError as e:
-            return Error(error=e.args[0], line=e.args[1][1], trace=traceback.format_exc() )
+        return CodeSegmentation.breakCodeIntoSegments(code)
+
+    @staticmethod
+    def executeResearchScript(db, runtimeConfig, evaluation, module, curScript, snippet,
+                              checkpoints=None, leaseOwner=None, pool=None, generation=None,
+                              cancellation=None, retainedRuns=None, resultCache=None, chunkStore=None):
+        """Evaluate 'curScript' (and then 'snippet', if given) and publish the results on 'evaluation'.
+
+        If 'pool' is an InterpreterPool, the script runs in one of its worker processes (which keep
+        their own checkpoints). Otherwise it runs in this process using 'checkpoints' and
+        'retainedRuns'.
+
+        Displays are appended to 'evaluation' as each block produces them, so the first plot
+        shows up without waiting for the rest of the script.
 
-        statements = python_ast.convertPyAstToAlgebraic(ast.parse(code), "<interactive>").body
+        Results are only published if 'evaluation' is still at request 'generation' and
+        'leaseOwner' still holds its lease (when those are given) at the time.
+        If 'cancellation' (an InterpreterPool.Cancellation) gets cancelled, we stop evaluating
+        and publish nothing more.
 
-        #find contiguous blocks of code that parse
-        lines = code.split("\n")
-        blocks = []
+        If 'resultCache' is a ResultCache.ResultCache, deterministic scripts that somebody
+        already evaluated don't run again, and the ones that run successfully get cached.
+
+        If 'chunkStore' is a ChunkStore.ChunkStore, the large arrays of plots go there rather
+        than into the database.
+        """
+        logger = logging.getLogger(__name__)
 
-        for i in range(len(statements)):
-            nextLine = statements[i+1].line_number if i + 1 < len(statements) else len(lines) + 1
+        def externalized(displays):
+            if chunkStore is None:
+                return displays
 
-            blocks.append(
-                CodeBlock(
-                    code="\n".join(lines[statements[i].line_number-1:nextLine-1]),
-                    line_range=(statements[i].line_number,nextLine)
+            return [chunkStore.externalize(d) for d in displays]
+
+        def publishDisplays(displays):
+            displays = externalized(displays)
+
+            try:
+                with db.transaction():
+                    if evaluation.exists() and not evaluation.isSupersededFor(leaseOwner, generation):
+                        evaluation.displays = tuple(evaluation.displays) + tuple(displays)
+            except Exception:
+                # the complete set of displays still gets published at the end
+                logger.error("Failed to publish displays:\n%s", traceback.format_exc())
+
+        isCacheable = resultCache is not None and ResultCache.isCacheable(curScript, snippet)
+        cachedDisplays = resultCache.lookup(curScript, snippet) if isCacheable else None
+
+        if cachedDisplays is not None:
+            logger.info("Using cached result.")
+            result = (None, cachedDisplays)
+        elif pool is not None:
+            result = pool.execute(
+                curScript, snippet, affinityKey=module._identity, cancellation=cancellation,
+                onDisplays=publishDisplays
+                )
+        else:
+            try:
+                result = ResearchBackend.evaluateResearchScript(
+                    runtimeConfig, curScript, snippet, checkpoints=checkpoints,
+                    shouldCancel=cancellation.isCancelled if cancellation is not None else None,
+                    onDisplays=publishDisplays, retainedRuns=retainedRuns, scriptKey=module._identity
                     )
+            except EvaluationCancelled:
+                result = None
+
+        if result is None:
+            logger.info("Evaluation was cancelled.")
+            return
+
+        error, displays = result
+        displays = externalized(displays)
+
+        if isCacheable and cachedDisplays is None and error is None:
+            try:
+                resultCache.store(curScript, snippet, displays)
+            except Exception:
+                logger.error("Failed to cache result:\n%s", traceback.format_exc())
+
+        with db.transaction():
+            if not evaluation.exists():
+                logger.info("Discarding results because the evaluation was deleted.")
+            elif evaluation.complete(leaseOwner, generation, error, displays):
+                logger.info("Marking display complete.")
+            else:
+                logger.info("Discarding results because they have been superseded.")
+
+    @staticmethod
+    def evaluateResearchScript(runtimeConfig, curScript, snippet, checkpoints=None, shouldCancel=None,
+                               limits=None, onDisplays=None, retainedRuns=None, scriptKey=None,
+                               threadCount=1, onBlockBoundary=None):
+        """Evaluate 'curScript' (and then 'snippet', if given) in this process.
+
+        If 'checkpoints' is a ScriptCheckpoints.CheckpointCache, we resume execution from the
+        latest checkpoint whose blocks are unchanged and don't read files, the clock or random
+        numbers, and checkpoint the namespace as we go.
+
+        If 'shouldCancel' is given, we call it between blocks and raise EvaluationCancelled
+        if it returns True.
+
+        If 'limits' is an ExecutionLimits.ExecutionLimits, we stop at the first block that
+        exceeds them, and return the displays produced until then along with the error. Limits
+        may only be used on the main thread of a process that doesn't mind its signal handlers
+        and memory rlimit being borrowed. 'onBlockBoundary' is passed on to ExecutionLimits.enforcing.
+
+        If 'onDisplays' is given, we call it with the list of new displays each time a block
+        of the script produces some, including the ones restored from a checkpoint. When
+        there's a snippet, only its displays are returned, so we don't stream the script's.
+
+        If 'retainedRuns' is a BlockDependencies.RetainedRunCache, we keep the namespace of
+        this run under 'scriptKey', and the next evaluation with the same key only re-runs
+        the blocks whose inputs changed. Snippets of a script that hasn't changed run against
+        that namespace without re-running anything. Evaluating an unchanged script on its own
+        re-runs the blocks that read files, the clock or random numbers, and whatever depends
+        on them. Scripts calling ResultCache.NOCACHE_FUNCTION always run in full.
+
+        If 'threadCount' is more than one, blocks that don't depend on each other run
+        concurrently on that many threads. Time limits can only interrupt the main thread,
+        so with those, blocks run one at a time.
+
+        Returns a pair (error, displays), where 'error' is a traceback string or None.
+        """
+        if limits is not None and limits.hasTimeLimits():
+            threadCount = 1
+
+        with (limits or ExecutionLimits.ExecutionLimits()).enforcing(onBlockBoundary) as limiter:
+            return ResearchBackend._evaluateResearchScript(
+                runtimeConfig, curScript, snippet, checkpoints, shouldCancel, limiter,
+                onDisplays if snippet is None or not snippet.strip() else None,
+                retainedRuns, scriptKey, threadCount
                 )
 
-        return blocks
+    @staticmethod
+    def _evaluateBlocksWithCheckpoints(runtimeConfig, blocks, varsInScope, builtins, filename, checkpoints,
+                                       shouldCancel, limiter, onDisplays, analyses, threadCount):
+        """Run all of 'blocks' in order, resuming from and taking checkpoints if we have a cache.
+
+        Checkpoints are keyed by the code of the blocks before them, so we only use them for
+        blocks that don't read anything from outside, and not at all for scripts that call
+        ResultCache.NOCACHE_FUNCTION.
+
+        Returns a pair of the (error, displays) result and a list of the displays of each block,
+        which is None if we resumed from a checkpoint that doesn't record them.
+        """
+        logger = logging.getLogger(__name__)
+
+        chainHashes = ScriptCheckpoints.blockChainHashes(blocks)
+        firstBlock = 0
+        keptDisplays = []
+
+        if checkpoints is not None:
+            scriptAnalyses = analyses if analyses is not None else BlockDependencies.analyzeBlocks(blocks)
+
+            if scriptAnalyses is not None and ResultCache.callsNocache(scriptAnalyses):
+                checkpoints = None
+
+        if checkpoints is not None:
+            chainHashes = chainHashes[:BlockDependencies.reproduciblePrefixLength(blocks)]
+            firstBlock, checkpoint = checkpoints.latestValidPrefix(chainHashes)
+
+            if checkpoint is not None:
+                logger.info("Resuming from checkpoint after block %s of %s.", firstBlock, len(blocks))
+                checkpoint.restoreInto(varsInScope)
+                keptDisplays = checkpoint.displaysPerBlock()
+
+        rerun = [ix >= firstBlock for ix in range(len(blocks))]
+
+        if keptDisplays is None:
+            keptDisplays = [()] * (firstBlock - 1) + [checkpoint.displays]
+            isRetainable = False
+        else:
+            isRetainable = True
+
+        lastCheckpointTime = [time.time()]
+
+        def afterBlock(blockIx, displaysPerBlock, outputDisplay):
+            if (checkpoints is not None and blockIx < len(chainHashes) and
+                    time.time() - lastCheckpointTime[0] > ScriptCheckpoints.CHECKPOINT_INTERVAL_SECONDS):
+                checkpoints.put(
+                    chainHashes[blockIx],
+                    varsInScope,
+                    outputDisplay,
+                    excluding=[name for name in builtins if varsInScope.get(name) is builtins[name]],
+                    displayCounts=[len(d) for d in displaysPerBlock[:blockIx + 1]]
+                    )
+                lastCheckpointTime[0] = time.time()
+
+        result, displaysPerBlock = ResearchBackend._evaluateBlocks(
+            runtimeConfig, blocks, varsInScope, filename, rerun,
+            keptDisplays + [None] * (len(blocks) - firstBlock),
+            shouldCancel, limiter, onDisplays, analyses, threadCount, afterBlock=afterBlock
+            )
+
+        return result, displaysPerBlock if isRetainable else None
 
     @staticmethod
-    def executeResearchScript(db, runtimeConfig, evaluation, module, curScript, snippet):
+    def _evaluateBlocks(runtimeConfig, blocks, varsInScope, filename, rerun, keptDisplays,
+                        shouldCancel, limiter, onDisplays, analyses, threadCount, afterBlock=None):
+        """Run the 'blocks' flagged in 'rerun', in order, in 'varsInScope'.
+
+        The others contribute 'keptDisplays', their displays from an earlier run. If we have
+        the blocks' 'analyses' and more than one thread, blocks that don't depend on each other
+        run concurrently. If given, 'afterBlock(blockIx, displaysPerBlock, outputDisplay)' is
+        called after each block runs, as long as no later block has started.
+
+        Returns a pair of the (error, displays) result and a list of the displays of each block.
+        """
         logger = logging.getLogger(__name__)
 
-        def _updateModule(error, displays):
-            with db.transaction():
-                evaluation.error = error
-                evaluation.displays = displays
-                evaluation.state = "Complete"
+        outputDisplay = ListOf(Displayable.Display)()
+        displaysPerBlock = []
+
+        # kept displays that we haven't streamed yet. We send them along just before we run
+        # the next block, so they show up as soon as possible.
+        unpublished = []
+
+        def publish(displays):
+            if onDisplays is not None and displays:
+                onDisplays(list(displays))
+
+        def checkCancelled():
+            if shouldCancel is not None and shouldCancel():
+                raise EvaluationCancelled()
+
+        def runBlock(blockIx):
+            with limiter.block(blocks[blockIx]):
+                return ResearchBackend.displayForBlock(runtimeConfig, blocks[blockIx], varsInScope, filename=filename)
+
+        concurrently = None
+        if threadCount > 1 and analyses is not None and sum(rerun) > 1:
+            concurrently = ConcurrentBlocks.ConcurrentBlocks(
+                threadCount,
+                BlockDependencies.blockDependencies(analyses, varsInScope, rerun),
+                rerun,
+                runBlock,
+                checkCancelled
+                )
+
+        logger.info("Evaluating code blocks.")
 
-                logger.info("Marking display complete.")
+        try:
+            for blockIx, block in enumerate(blocks):
+                if not rerun[blockIx]:
+                    displaysPerBlock.append(tuple(keptDisplays[blockIx]))
+                    outputDisplay.extend(keptDisplays[blockIx])
+                    unpublished.extend(keptDisplays[blockIx])
+                    continue
+
+                publish(unpublished)
+                unpublished = []
+
+                try:
+                    if concurrently is not None:
+                        res = concurrently.result(blockIx)
+                    else:
+                        checkCancelled()
+                        res = runBlock(blockIx)
+                except ExecutionLimits.LimitExceeded as e:
+                    return (ExecutionLimits.describeViolation(block, e), outputDisplay), None
+
+                if res.get('error'):
+                    # we encoded an error string
+                    return (res.get('error'), []), None
+
+                displaysPerBlock.append(tuple(res.get('displays', [])))
+                outputDisplay.extend(res.get('displays', []))
+                publish(res.get('displays'))
+
+                if afterBlock is not None and (
+                        concurrently is None or not concurrently.hasStartedAnythingAfter(blockIx)):
+                    afterBlock(blockIx, displaysPerBlock, outputDisplay)
+        finally:
+            if concurrently is not None:
+                concurrently.close()
+
+        publish(unpublished)
+
+        logger.info("Done evaluating code blocks.")
+
+        return (None, outputDisplay), displaysPerBlock
+
+    @staticmethod
+    def _evaluateResearchScript(runtimeConfig, curScript, snippet, checkpoints, shouldCancel, limiter,
+                                onDisplays, retainedRuns, scriptKey, threadCount):
+        logger = logging.getLogger(__name__)
 
         # parse the script
         codeBlocksOrErr = ResearchBackend.breakCodeIntoSegments(curScript)
         if isinstance(codeBlocksOrErr, Error):
-            return _updateModule(codeBlocksOrErr.trace, [])
-
-        outputDisplay = ListOf(Displayable.Display)()
+            return (codeBlocksOrErr.trace, [])
 
         def _plot(*args, title="", **kwargs):
+            # summarize each series now, so frontends can redraw any part of it cheaply
+            plotArgs, plotKwargs = PlotPyramid.plotArguments(args, kwargs)
+
             disp = Displayable.Display.Plot(
-                args=args,
-                kwargs=kwargs,
+                args=plotArgs,
+                kwargs=plotKwargs,
+                title=title
+                )
+
+            return Displayable.Display.Displays(displays=(disp,))
+
+        def _heatmap(matrix, title="", reduce="mean", zmin=None, zmax=None):
+            # summarize blocks of the matrix at every zoom level now, so frontends only send the tiles in view
+            disp = Displayable.Display.Heatmap(
+                heatmap=HeatmapPyramid.heatmapFor(matrix, reduce, zmin, zmax),
                 title=title
                 )
 
             return Displayable.Display.Displays(displays=(disp,))
 
+        def _hist(values, title=""):
+            # bin the values here, and keep them sorted so frontends can rebin them on zoom
+            disp = Displayable.Display.Histogram(histogram=Histograms.histogramFor(values), title=title)
+
+            return Displayable.Display.Displays(displays=(disp,))
+
+        def _density(x, y, title=""):
+            disp = Displayable.Display.Density(density=Histograms.densityFor(x, y), title=title)
+
+            return Displayable.Display.Displays(displays=(disp,))
+
         def _print(obj, title=""):
             return Displayable.Display.Print(
                 str=str(obj)[:10000],
@@ -171,122 +699,181 @@ class ResearchBackend(ServiceBase):
                 title=title
                 )
 
+        def _nocache():
+            # never cache results of the script. See ResultCache.
+            pass
+
         varsInScope = {
             '__builtins__': __builtins__,
             'numpy': numpy,
             'plot': _plot,
+            'heatmap': _heatmap,
+            'hist': _hist,
+            'density': _density,
             'print': _print,
-            'help': _help
+            'help': _help,
+            ResultCache.NOCACHE_FUNCTION: _nocache
             }
 
-        logger.info("Evaluating code blocks.")
+        builtins = dict(varsInScope)
 
-        for block in codeBlocksOrErr:
-            res = ResearchBackend.displayForBlock(runtimeConfig, block, varsInScope)
+        filename = CompiledBlocks.registerSource(curScript)
 
-            if res.get('error'):
-                # we encoded an error string
-                return _updateModule(res.get('error'), [])
+        # if we still have the namespace this script's last run left behind, only re-run the
+        # blocks whose inputs changed. The run is ours until we put it back.
+        isRetaining = retainedRuns is not None and scriptKey is not None
+        retained = retainedRuns.pop(scriptKey) if isRetaining else None
 
-            for d in res.get('displays', []):
-                outputDisplay.append(d)
+        hasSnippet = snippet is not None and snippet.strip()
 
-        logger.info("Done evaluating code blocks.")
+        if retained is not None and retained.source == curScript and hasSnippet:
+            # nothing changed, so a snippet can go straight to work
+            logger.info("Script is unchanged since its retained run.")
+
+            retainedRun = retained
+            varsInScope = retained.namespace
+            outputDisplay = retained.displays()
+
+            if onDisplays is not None and outputDisplay:
+                onDisplays(outputDisplay)
+        else:
+            analyses = None
+            plan = None
+
+            if isRetaining or threadCount > 1:
+                analyses = BlockDependencies.analyzeBlocks(codeBlocksOrErr)
+
+            if analyses is not None and retained is not None and not ResultCache.callsNocache(analyses):
+                # somebody asking for the same script again wants whatever it reads from outside
+                # to be read afresh
+                refreshed = ()
+                if retained.source == curScript:
+                    refreshed = (BlockDependencies.IO_STATE, BlockDependencies.RANDOM_STATE)
+
+                plan = BlockDependencies.planReexecution(retained, codeBlocksOrErr, analyses, refreshed)
+                varsInScope = retained.namespace
+
+            if plan is not None:
+                logger.info(
+                    "Re-running %s of %s blocks whose inputs changed.", plan.rerunCount(), len(codeBlocksOrErr)
+                    )
+                plan.applyResets(varsInScope)
+                result, displaysPerBlock = ResearchBackend._evaluateBlocks(
+                    runtimeConfig, codeBlocksOrErr, varsInScope, filename, plan.rerun, plan.keptDisplays,
+                    shouldCancel, limiter, onDisplays, analyses, threadCount
+                    )
+            else:
+                result, displaysPerBlock = ResearchBackend._evaluateBlocksWithCheckpoints(
+                    runtimeConfig, codeBlocksOrErr, varsInScope, builtins, filename, checkpoints,
+                    shouldCancel, limiter, onDisplays, analyses, threadCount
+                    )
 
-        if snippet is None or not snippet.strip():
-            return _updateModule(None,
-                                 outputDisplay)
+            if result[0] is not None:
+                return result
+
+            outputDisplay = result[1]
+
+            retainedRun = None
+            if isRetaining and analyses is not None and displaysPerBlock is not None:
+                retainedRun = BlockDependencies.RetainedRun(
+                    curScript, codeBlocksOrErr, analyses, varsInScope, displaysPerBlock, builtins
+                    )
+
+        if not hasSnippet:
+            if retainedRun is not None:
+                retainedRuns.put(scriptKey, retainedRun)
+
+            return (None, outputDisplay)
 
         logger.info("Starting snippet evaluation")
         selectedBlocksOrErr = ResearchBackend.breakCodeIntoSegments(snippet)
 
         if isinstance(selectedBlocksOrErr, Error):
-            return _updateModule(selectedBlocksOrErr.trace, [])
+            return (selectedBlocksOrErr.trace, [])
 
         logger.info("Snipped parsed successfully")
 
+        # the snippet runs against copies of our namespace, but it could still modify the
+        # objects in it, in which case we can't keep it for next time.
+        if retainedRun is not None:
+            snippetAnalyses = BlockDependencies.analyzeBlocks(selectedBlocksOrErr)
+
+            if snippetAnalyses is not None and BlockDependencies.isReadOnly(retainedRun, snippetAnalyses):
+                retainedRuns.put(scriptKey, retainedRun)
+
+        snippetFilename = CompiledBlocks.registerSource(snippet)
+
         outputDisplay = []
 
         lastBlock = None
+        lastVal = None
         for block in selectedBlocksOrErr:
-            res = ResearchBackend.displayForBlock(runtimeConfig, block, dict(varsInScope))
+            if shouldCancel is not None and shouldCancel():
+                raise EvaluationCancelled()
+
+            try:
+                with limiter.block(block):
+                    res = ResearchBackend.displayForBlock(
+                        runtimeConfig, block, dict(varsInScope), filename=snippetFilename
+                        )
+            except ExecutionLimits.LimitExceeded as e:
+                return (ExecutionLimits.describeViolation(block, e), outputDisplay)
+
             if res.get('error'):
                 # we encoded an error string
-                return _updateModule(res.get('error'), [])
+                return (res.get('error'), [])
 
             for d in res.get('displays', []):
                 outputDisplay.append(d)
 
             lastBlock = block
+            lastVal = res.get('value')
 
-        if lastBlock is not None:
-            blockCode = "\n" * (lastBlock.line_range[0]-1) + lastBlock.code
-            filename = os.path.join(
-                runtimeConfig.serviceTemporaryStorageRoot,
-                "interactive_" + sha_hash(blockCode).hexdigest
-                )
-            try:
-                lastVal = eval(compile(blockCode, filename, "eval"), dict(varsInScope))
-                if isinstance(lastVal, Displayable.Display):
-                    pass
-                elif lastVal is not None:
-                    if isinstance(lastVal, (type, types.ModuleType, types.FunctionType)):
-                        outputDisplay.append(
-                            _help(lastVal, title=lastBlock.code)
-                            )
-                    else:
-                        outputDisplay.append(
-                            _print(lastVal, title=lastBlock.code)
-                            )
-            except SyntaxError:
-                pass
+        # show the value of the snippet's last expression, unless it displayed itself
+        if lastVal is not None and not isinstance(lastVal, Displayable.Display):
+            if isinstance(lastVal, (type, types.ModuleType, types.FunctionType)):
+                outputDisplay.append(
+                    _help(lastVal, title=lastBlock.code)
+                    )
+            else:
+                outputDisplay.append(
+                    _print(lastVal, title=lastBlock.code)
+                    )
 
-        return _updateModule(None,
-                             outputDisplay)
+        return (None, outputDisplay)
 
 
     @staticmethod
-    def displayForBlock(runtimeConfig, block, curVarsInScope, displayAll=False):
-        # clear the buffer of datasets, so we can track anything we touch, even
-        # if its already there.
-        logger = logging.getLogger(__name__)
-
-        initVarsInScope = dict(curVarsInScope)
-
-        blockCode = "\n" * (block.line_range[0]-1) + block.code
+    def displayForBlock(runtimeConfig, block, curVarsInScope, displayAll=False, filename=None):
+        """Execute CodeBlock 'block' in 'curVarsInScope'.
 
-        filename = os.path.join(
-            runtimeConfig.serviceTemporaryStorageRoot,
-            "interactive_" + sha_hash(blockCode).hexdigest
-            )
+        'filename' is what CompiledBlocks.registerSource returned for the script containing
+        the block. Returns a dict with an 'error' traceback string, or a list of 'displays'
+        and, if the block is an expression, its 'value'.
+        """
+        logger = logging.getLogger(__name__)
 
-        with open(filename, "w") as codeFile:
-            codeFile.write(blockCode)
+        if filename is None:
+            filename = CompiledBlocks.registerSource("\n" * (block.line_range[0]-1) + block.code)
 
         try:
-            compiledEval = compile(blockCode + "\n", filename, "eval")
-        except Exception:
-            compiledEval = None
+            compiled = CompiledBlocks.compileBlock(block, filename)
 
-        if compiledEval:
-            try:
-                result = eval(compiledEval, curVarsInScope)
+            if compiled.isExpression:
+                result = eval(compiled.code, curVarsInScope)
 
                 if isinstance(result, Displayable.Display):
                     if result.title == "" and block.code.count("\n") < 10:
                         result = result.titled(block.code)
 
-                    return {'displays': [result]}
+                    return {'displays': [result], 'value': result}
 
-            except Exception as e:
-                logger.info(
-                    f"User code produced exception ({e}):\n%s",
-                    traceback.format_exc()
-                    )
-                return {'error': traceback.format_exc()}
+                return {'displays': [], 'value': result}
 
-        try:
-            exec(compile(blockCode, filename, "exec"), curVarsInScope)
+            exec(compiled.code, curVarsInScope)
+        except MemoryError:
+            # let our caller decide whether this was a memory limit we imposed
+            raise
         except Exception as e:
             logger.info(
                 f"User code produced exception ({e}):\n%s",
@@ -0,0 +1,139 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import contextlib
+import logging
+import threading
+import time
+import types
+import unittest
+import unittest.mock
+
+import research_app.EvaluationSchema as EvaluationSchema
+import research_app.EvaluationSchema_test as EvaluationSchema_test
+import research_app.ResearchBackend as ResearchBackendModule
+from research_app.EvaluationSchema import EvaluationContext
+from research_app.ResearchBackend import ResearchBackend
+
+
+class FakeDatabase:
+    """Just enough of a database connection for doWork: waiting conditions are re-checked on each commit."""
+    def __init__(self):
+        self._commits = threading.Condition()
+        self.waitCount = 0
+
+    def commit(self, change):
+        with self._commits:
+            change()
+            self._commits.notify_all()
+
+    def waitForCondition(self, condition, timeout):
+        deadline = time.time() + timeout
+
+        with self._commits:
+            self.waitCount += 1
+
+            while not condition():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._commits.wait(remaining)
+
+        return True
+
+    @contextlib.contextmanager
+    def transaction(self):
+        yield
+
+
+class ResearchBackendTest(unittest.TestCase):
+    def test_work_is_picked_up_when_committed_not_polled_for(self):
+        pending = []
+        claimTimes = []
+        stop = threading.Event()
+
+        backend = ResearchBackend.__new__(ResearchBackend)
+        backend.db = FakeDatabase()
+        backend._logger = logging.getLogger(__name__)
+        backend._lastChunkCollection = time.time()
+        backend._hasPendingWork = lambda: bool(pending)
+        backend._resultCache = types.SimpleNamespace(flushCounters=lambda: None)
+
+        def claimEvaluation():
+            claimTimes.append(time.time())
+            pending.clear()
+            stop.set()
+
+        backend._claimEvaluation = claimEvaluation
+
+        # a backend that polled, or woke on its timeout, would take far longer than we allow
+        with unittest.mock.patch.object(ResearchBackendModule, 'WORK_WAIT_TIMEOUT', 30.0):
+            worker = threading.Thread(target=backend._doWork, args=(stop,), daemon=True)
+            worker.start()
+
+            time.sleep(0.2)
+            self.assertEqual(claimTimes, [])
+
+            committed = time.time()
+            backend.db.commit(lambda: pending.append("evaluation"))
+
+            worker.join(timeout=5.0)
+
+        self.assertFalse(worker.is_alive())
+        self.assertLess(claimTimes[0] - committed, 0.5)
+
+        # one wait for the whole idle period
+        self.assertEqual(backend.db.waitCount, 1)
+
+    def test_another_worker_reclaims_when_the_owner_dies(self):
+        clock = EvaluationSchema_test.FakeClock()
+        module = types.SimpleNamespace(exists=lambda: True, current_buffer="x = 1")
+
+        evaluation = EvaluationSchema_test.Evaluation()
+        evaluation.module = module
+
+        def lookupAll(state=None):
+            return [evaluation] if evaluation.state == state else []
+
+        def worker(workerId):
+            backend = ResearchBackend.__new__(ResearchBackend)
+            backend.db = FakeDatabase()
+            backend._workerId = workerId
+            return backend
+
+        first, second = worker("first"), worker("second")
+
+        with unittest.mock.patch.object(EvaluationSchema, 'time', clock), \
+                unittest.mock.patch.object(ResearchBackendModule, 'time', clock), \
+                unittest.mock.patch.object(EvaluationContext, 'lookupAll', lookupAll, create=True), \
+                unittest.mock.patch.object(EvaluationContext, 'lookupAny', lambda state: None, create=True):
+            evaluation.request(None)
+
+            self.assertIs(first._claimEvaluation()[0], evaluation)
+            self.assertIsNone(second._claimEvaluation())
+
+            # 'first' stops renewing its lease
+            clock.now += ResearchBackendModule.LEASE_DURATION / 2
+            self.assertFalse(ResearchBackend._hasPendingWork())
+
+            clock.now += ResearchBackendModule.LEASE_DURATION
+            self.assertTrue(ResearchBackend._hasPendingWork())
+
+            claimed = second._claimEvaluation()
+            self.assertEqual(claimed[:2], (evaluation, evaluation.generation))
+            self.assertEqual(evaluation.leaseOwner, "second")
+
+            # whatever 'first' comes back with is dropped
+            self.assertFalse(evaluation.complete("first", claimed[1], None, ("stale",)))
+            self.assertTrue(evaluation.complete("second", claimed[1], None, ("fresh",)))
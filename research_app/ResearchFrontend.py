@@ -33,6 +33,7 @@ import logging
 import time
 import sys
 import io
+import uuid
 import pydoc
 from typed_python import python_ast, OneOf, Alternative, TupleOf,\
                         NamedTuple, Tuple, Class, ConstDict, Member
@@ -44,6 +45,12 @@ BUTTON_COLOR = "#999999"
 SELECTED_PROJECT_COLOR = "#EEEEFF"
 SELECTED_MODULE_COLOR = "lightblue"
 
+# how long an EvaluationContext (and its displays) outlives the last request of its session.
+EVALUATION_CONTEXT_TTL = 24 * 3600.0
+
+# how often doWork looks for EvaluationContexts that have expired
+CONTEXT_EXPIRY_INTERVAL = 600.0
+
 nyc = pytz.timezone("America/New_York")
 schema = Schema("research_app.ResearchFrontend")
 
@@ -112,8 +119,6 @@ class ResearchFrontend(ServiceBase):
                     created_timestamp=time.time(),
                     last_modified_timestamp=time.time()
                     )
-                # create the singleton EvaluationContext object
-                EvaluationSchema.EvaluationContext()
 
     @staticmethod
     def configureService(database, serviceObject, matlabFileExportPath):
@@ -166,6 +171,15 @@ class ResearchFrontend(ServiceBase):
         ss.setdefault('showEditor', True)
         ss.setdefault('showEvaluation', True)
 
+        queryArgs = queryArgs or {}
+
+        # every browser session evaluates modules independently of the others. The id is only
+        # ever made here: anyone who knew it could read and drive that session's evaluations.
+        ss.setdefault('evaluationSession', str(uuid.uuid4()))
+
+        if queryArgs.get('module') and ss.selected_module is None:
+            ss.selected_module = Module.fromIdentity(int(queryArgs['module']))
+
         return (
             cells.CollapsiblePanel(
                 ResearchFrontend.navDisplay().background_color("#FAFAFA").height("100%"),
@@ -309,7 +323,8 @@ class ResearchFrontend(ServiceBase):
                     cells.Octicon("file").nowrap() +
                     cells.Text(module.name).width(200).nowrap(),
                     selectModule
-                    ).nowrap().background_color(None if not isSelected() else SELECTED_MODULE_COLOR),
+                    ).nowrap().background_color(None if not isSelected() else SELECTED_MODULE_COLOR)
+                    .tagged(f"RFE_SelectModuleButton_{module._identity}"),
 
                 cells.Button(
                     cells.Octicon("pencil").color(BUTTON_COLOR),
@@ -334,14 +349,18 @@ class ResearchFrontend(ServiceBase):
             module.update(buffer)
             module.mark()
 
-            evaluation = EvaluationSchema.EvaluationContext.lookupOrCreate()
+            evaluation = EvaluationSchema.EvaluationContext.lookupOrCreate(
+                cells.sessionState().evaluationSession, module
+                )
 
-            evaluation.request(module, None)
+            evaluation.request(None)
 
         def onExecuteSelected(buffer, selection):
             module.update(buffer)
 
-            evaluation = EvaluationSchema.EvaluationContext.lookupOrCreate()
+            evaluation = EvaluationSchema.EvaluationContext.lookupOrCreate(
+                cells.sessionState().evaluationSession, module
+                )
 
             if isinstance(selection,dict):
                 selection = CodeSelection.fromAceEditorJson(selection)
@@ -349,7 +368,7 @@ class ResearchFrontend(ServiceBase):
             else:
                 selectedText = None
 
-            evaluation.request(module, selectedText)
+            evaluation.request(selectedText)
 
         def onTextChange(buffer, selection):
             module.update(buffer)
@@ -376,35 +395,51 @@ class ResearchFrontend(ServiceBase):
 
     @staticmethod
     def evaluationDisplay():
-        evaluation = EvaluationSchema.EvaluationContext.lookupOrCreate()
-
         # force us to redraw if anything changes in terms of the horizontal width
         # because right now the plotly charts aren't smart enough to do this.
         cells.sessionState().showNavTree
         cells.sessionState().showEditor
         cells.sessionState().showEvaluation
 
-        if not evaluation:
-            return None
-
-        return cells.Subscribed(
-                lambda:
-                    cells.Card("Waiting for backend...") if evaluation.state == "Dirty" else
-                    cells.Card("Backend computing...") if evaluation.state == "Calculating" else
-                    cells.Traceback(evaluation.error) if evaluation.error is not None else
-                    cells.Tabs(
-                        Displays=cells.Card(
-                            cells.Subscribed(
-                                lambda: ResearchFrontend.displaysDisplay(evaluation).tagged("RFE_Displays")
-                                )
-                            ),
-                        Variables=cells.Card(
-                            cells.Subscribed(
-                                lambda: DisplayForVariables.variablesDisplay(evaluation).tagged("RFE_Variables")
-                                )
-                            )
-                        ).tagged("DisplayTabCell")
-                ).overflow("auto").width("100%")
+        def evaluationContents():
+            module = cells.sessionState().selected_module
+
+            if module is None or not module.exists():
+                return None
+
+            # only subscribe to the evaluation belonging to this session and module
+            evaluation = EvaluationSchema.EvaluationContext.lookupAny(
+                sessionAndModule=(cells.sessionState().evaluationSession, module)
+                )
+
+            if evaluation is None:
+                return cells.Card("Press Enter to evaluate the module.")
+
+            def status():
+                if evaluation.state == "Dirty":
+                    return cells.Card("Waiting for backend...")
+                if evaluation.state == "Calculating":
+                    return cells.Card("Backend computing...")
+                if evaluation.error is not None:
+                    return cells.Traceback(evaluation.error)
+                return None
+
+            # displays stream in while the backend is still computing, so the tabs stay up
+            # underneath the status rather than being rebuilt whenever the state changes.
+            return cells.Subscribed(status) + cells.Tabs(
+                Displays=cells.Card(
+                    cells.Subscribed(
+                        lambda: ResearchFrontend.displaysDisplay(evaluation).tagged("RFE_Displays")
+                        )
+                    ),
+                Variables=cells.Card(
+                    cells.Subscribed(
+                        lambda: DisplayForVariables.variablesDisplay(evaluation).tagged("RFE_Variables")
+                        )
+                    )
+                ).tagged("DisplayTabCell")
+
+        return cells.Subscribed(evaluationContents).overflow("auto").width("100%")
 
     @staticmethod
     def createNewModule(project, base_name = None):
@@ -446,10 +481,40 @@ class ResearchFrontend(ServiceBase):
 
     @staticmethod
     def displaysDisplay(evaluation):
-        return cells.Sequence(
-            [cells.Cell.makeCell(display) + cells.Padding() for display in evaluation.displays]
+        """A cell showing the displays of 'evaluation', adding new ones as they arrive.
+
+        Items are keyed by (generation, index), so displays we already show are never redrawn
+        while more stream in, but a new request starts over from scratch.
+        """
+        return cells.SubscribedSequence(
+            lambda: [(evaluation.generation, ix) for ix in range(len(evaluation.displays))],
+            lambda key: cells.Cell.makeCell(evaluation.displays[key[1]]) + cells.Padding()
         )
 
+    @revisionConflictRetry
+    def deleteExpiredEvaluations(self, curTime):
+        """Delete the EvaluationContexts no session has used in EVALUATION_CONTEXT_TTL. Returns how many."""
+        deleted = 0
+
+        with self.db.transaction():
+            for evaluation in EvaluationSchema.EvaluationContext.lookupAll():
+                if not evaluation.lastRequestTimestamp:
+                    # contexts from before we kept track get a fresh start
+                    evaluation.lastRequestTimestamp = curTime
+                elif evaluation.isExpired(curTime, EVALUATION_CONTEXT_TTL):
+                    evaluation.delete()
+                    deleted += 1
+
+        return deleted
+
     def doWork(self, shouldStop):
-        while not shouldStop.is_set():
-            time.sleep(0.25)
+        # everything else happens in response to cells events. Every session that evaluates a
+        # module creates an EvaluationContext, so we have to clean up after the idle ones.
+        while not shouldStop.wait(CONTEXT_EXPIRY_INTERVAL):
+            try:
+                deleted = self.deleteExpiredEvaluations(time.time())
+
+                if deleted:
+                    self._logger.info("Deleted %s expired evaluation contexts.", deleted)
+            except Exception:
+                self._logger.error("Failed to delete expired evaluation contexts:\n%s", traceback.format_exc())
@@ -19,9 +19,11 @@ from research_app.ResearchFrontend import schema as research_schema
 import research_app.ContentSchema as ContentSchema
 import research_app.EvaluationSchema as EvaluationSchema
 import research_app.DisplayForPlot
+import research_app.DisplayForHeatmap
+import research_app.DisplayForHistogram
 
 from object_database import revisionConflictRetry
-from object_database.web.cells import Subscribed, Cells
+from object_database.web.cells import Subscribed, Cells, sessionState
 from typed_python.Codebase import Codebase as TypedPythonCodebase
 import research_app
 import time
@@ -30,9 +32,10 @@ import os
 
 
 class ResearchFrontendTestHelper:
-    def __init__(self, service_test_base ):
+    def __init__(self, service_test_base, session="ResearchFrontendTestHelper"):
         self._base = service_test_base
         self._db = None
+        self.session = session
         self.ser_ctx = TypedPythonCodebase.FromRootlevelModule(research_app).serializationContext
 
     @property
@@ -44,7 +47,7 @@ class ResearchFrontendTestHelper:
 
         return self._db
 
-    def createResearchFrontend(self, path=None, timeout=10.0):
+    def createResearchFrontend(self, path=None, timeout=10.0, backendCount=1):
         serviceManager = self._base.serviceManager
         db = self._base.db
 
@@ -52,7 +55,7 @@ class ResearchFrontendTestHelper:
             self.serviceObject = serviceManager.createOrUpdateService(
                 ResearchFrontend, "ResearchFrontend", 1)
             self.backendServiceObject = serviceManager.createOrUpdateService(
-                ResearchBackend, "ResearchBackend", 1)
+                ResearchBackend, "ResearchBackend", backendCount)
 
             if not path:
                 path = os.path.join(self._base.tempDir, "FrontendExports")
@@ -66,14 +69,14 @@ class ResearchFrontendTestHelper:
         serviceManager.waitRunning(db, "ResearchBackend", timeout=timeout)
 
     def makeCells(self, queryArgs=None):
-        queryArgs = queryArgs or {}
+        def display():
+            # pin the evaluation session so tests can find its evaluations. serviceDisplay
+            # only fills it in when it's missing.
+            sessionState().setdefault('evaluationSession', self.session)
 
-        rootCell = Subscribed(
-            lambda: ResearchFrontend.serviceDisplay(
-                self.serviceObject,
-                queryArgs=queryArgs
-                )
-            ).withSerializationContext(self.ser_ctx)
+            return ResearchFrontend.serviceDisplay(self.serviceObject, queryArgs=queryArgs)
+
+        rootCell = Subscribed(display).withSerializationContext(self.ser_ctx)
 
         cells = Cells(self.db).withRoot(rootCell)
         cells.renderMessages()
@@ -119,11 +122,11 @@ class ResearchFrontendTestHelper:
             else:
                 module.current_buffer = text
 
-            evaluation = EvaluationSchema.EvaluationContext.lookupOrCreate()
+            evaluation = EvaluationSchema.EvaluationContext.lookupOrCreate(self.session, module)
 
             existingCount = (len(evaluation.displays), 0)
 
-            evaluation.request(module, None)
+            evaluation.request(None)
 
         if not self.db.waitForCondition(
                 lambda: evaluation.state == "Complete",
@@ -169,9 +172,9 @@ class ResearchFrontendTestHelper:
 
             module.current_buffer = text
 
-            evaluation = EvaluationSchema.EvaluationContext.lookupOrCreate()
+            evaluation = EvaluationSchema.EvaluationContext.lookupOrCreate(self.session, module)
 
-            evaluation.request(module, selectedText)
+            evaluation.request(selectedText)
 
         if not self.db.waitForCondition(
                 lambda: evaluation.state == "Complete",
@@ -15,17 +15,20 @@
 
 import unittest
 import os
+import time
 import textwrap
 import research_app
 from typed_python.Codebase import Codebase as TypedPythonCodebase
-from object_database.web.cells import Cells, Plot, Tabs, SessionState
+from object_database.web.cells import Cells, Plot, Tabs, SessionState, Subscribed
 from research_app.ServiceTestHarness import ServiceTestHarness
 from research_app.ResearchFrontend import schema as research_schema
 from research_app.ResearchFrontend import ResearchFrontend, Module, Project
 from research_app.Displayable import Display
 from research_app.ResearchBackend import ResearchBackend, Error
+from research_app.ResearchFrontendTestHelper import ResearchFrontendTestHelper
 import research_app.ContentSchema as ContentSchema
 import research_app.EvaluationSchema as EvaluationSchema
+import research_app.ResultCache as ResultCache
 
 
 class ResearchFrontendServiceTest(unittest.TestCase):
@@ -333,6 +336,9 @@ class ResearchFrontendServiceTest(unittest.TestCase):
             """
         expected_displays = ['Plot', 'Plot']
 
+        # the evaluation panel shows the selected module's evaluation
+        self.check_ui_script(cells, [{'tag': f'RFE_SelectModuleButton_{module_id}', 'msg': {}}])
+
         displays, variables = self.helper.execute(code, module_id = module_id)
         cells.renderMessages()
         self.checkDisplays(displays, expected_displays)
@@ -372,6 +378,8 @@ class ResearchFrontendServiceTest(unittest.TestCase):
 
         self.assertEqual(new_module_name, 'new_name')
 
+        self.check_ui_script(cells, [{'tag': f'RFE_SelectModuleButton_{module_id}', 'msg': {}}])
+
         displays, variables = self.helper.execute(code, append = False, module_id = module_id)
         cells.renderMessages()
         self.checkDisplays(displays, expected_displays)
@@ -426,6 +434,140 @@ class ResearchFrontendServiceTest(unittest.TestCase):
         self.assertNoCellExceptions(cells)
 
 
+    def test_sessions_evaluate_independently(self):
+        otherHelper = ResearchFrontendTestHelper(self.harness, session="another session")
+
+        displays, _ = self.helper.execute("""print('mine')""", append=False)
+        self.checkDisplays(displays, ["Print"])
+
+        displays, _ = otherHelper.execute("""
+            plot(numpy.array([1,2,3]))
+            plot(numpy.array([1,2,3]))
+            """, append=False)
+        self.checkDisplays(displays, ["Plot", "Plot"])
+
+        with self.helper.db.view():
+            module = Module.lookupAny()
+
+            self.assertEqual(
+                len([e for e in EvaluationSchema.EvaluationContext.lookupAll() if e.module == module]),
+                2
+                )
+
+            mine = EvaluationSchema.EvaluationContext.lookupAny(
+                sessionAndModule=(self.helper.session, module)
+                )
+            self.checkDisplays(mine.displays, ["Print"])
+
+    def test_query_args_cant_join_another_session(self):
+        displays, _ = self.helper.execute("""print('mine')""", append=False)
+        self.checkDisplays(displays, ["Print"])
+
+        with self.helper.db.view():
+            module_id = Module.lookupAny()._identity
+
+        self.assertCellTagExists(self.helper.cellsForOnlyExistingModule(), "RFE_Displays")
+
+        rootCell = Subscribed(
+            lambda: ResearchFrontend.serviceDisplay(
+                self.helper.serviceObject,
+                queryArgs={"session": self.helper.session, "module": module_id}
+                )
+            ).withSerializationContext(self.helper.ser_ctx)
+
+        cells = Cells(self.helper.db).withRoot(rootCell)
+        cells.renderMessages()
+
+        # a new browser session gets its own evaluation, so it has nothing to display yet
+        self.assertIsNone(
+            self.helper.waitForCellsCondition(cells, lambda: cells.findChildrenByTag("RFE_Displays"), timeout=1.0)
+            )
+        self.assertNoCellExceptions(cells)
+
+
+    def test_newer_request_cancels_running_evaluation(self):
+        db = self.helper.db
+
+        with db.transaction():
+            module = Module.lookupAny()
+            module.current_buffer = "import time\ntime.sleep(60)\n"
+            evaluation = EvaluationSchema.EvaluationContext.lookupOrCreate(self.helper.session, module)
+            evaluation.request(None)
+
+        self.assertTrue(db.waitForCondition(lambda: evaluation.state == "Calculating", timeout=5.0))
+
+        t0 = time.time()
+
+        with db.transaction():
+            module.current_buffer = "print('newer')"
+            evaluation.request(None)
+
+        self.assertTrue(db.waitForCondition(lambda: evaluation.state == "Complete", timeout=5.0))
+        self.assertLess(time.time() - t0, 5.0)
+
+        with db.view():
+            self.checkDisplays(evaluation.displays, ["Print"])
+            self.assertEqual(evaluation.displays[0].str, "newer")
+
+    def test_displays_stream_while_calculating(self):
+        db = self.helper.db
+
+        with db.transaction():
+            module = Module.lookupAny()
+            module.current_buffer = "print('first')\nimport time\ntime.sleep(60)\n"
+            evaluation = EvaluationSchema.EvaluationContext.lookupOrCreate(self.helper.session, module)
+            evaluation.request(None)
+
+        self.assertTrue(db.waitForCondition(lambda: len(evaluation.displays) == 1, timeout=5.0))
+
+        with db.view():
+            self.assertEqual(evaluation.state, "Calculating")
+            self.assertEqual(evaluation.displays[0].str, "first")
+
+        # a newer request clears what the superseded one streamed
+        with db.transaction():
+            module.current_buffer = "print('newer')"
+            evaluation.request(None)
+
+        self.assertTrue(db.waitForCondition(lambda: evaluation.state == "Complete", timeout=5.0))
+
+        with db.view():
+            self.checkDisplays(evaluation.displays, ["Print"])
+            self.assertEqual(evaluation.displays[0].str, "newer")
+
+    def test_shared_modules_hit_the_result_cache(self):
+        db = self.helper.db
+        db.subscribeToSchema(ResultCache.schema)
+
+        def evaluateIn(session, script):
+            with db.transaction():
+                module = Module.lookupAny()
+                module.current_buffer = script
+                evaluation = EvaluationSchema.EvaluationContext.lookupOrCreate(session, module)
+                evaluation.request(None)
+
+            self.assertTrue(db.waitForCondition(lambda: evaluation.state == "Complete", timeout=5.0))
+
+            with db.view():
+                return [d.str for d in evaluation.displays]
+
+        def assertCountersReach(hits, misses):
+            # backends flush their counters once they're idle
+            self.assertTrue(db.waitForCondition(
+                lambda: ResultCache.CacheCounters.totals() == (hits, misses), timeout=5.0
+                ))
+
+        self.assertEqual(evaluateIn("first", "x = 41\nprint(x + 1)"), ['42'])
+        assertCountersReach(0, 1)
+        self.assertEqual(evaluateIn("second", "x = 41\nprint(x + 1)"), ['42'])
+        assertCountersReach(1, 1)
+
+        # scripts drawing random numbers always run
+        evaluateIn("first", "print(numpy.random.rand())")
+        evaluateIn("second", "print(numpy.random.rand())")
+        assertCountersReach(1, 1)
+
+
 class ResearchFrontendParsingTest(unittest.TestCase):
     def test_divide_into_blocks_basic_single_line(self):
         self.assertEqual(len(ResearchBackend.breakCodeIntoSegments("1+2")), 1)
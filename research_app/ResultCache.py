@@ -0,0 +1,273 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+A cache of evaluation results, shared by every backend through object_database.
+
+Results are keyed by a hash of the script and snippet, so everybody who opens the same
+module gets the displays its first evaluation produced, without running anything.
+
+We only cache results that don't depend on when they were computed. Scripts that draw
+random numbers, read the clock or files, or do any other I/O always run, as do scripts we
+can't analyze and scripts that call 'nocache()'.
+
+Once the cached displays add up to more than a byte budget, we evict the least recently
+used entries, until they're back under a fraction of it. Lookups are cheap to share: they
+only write when an entry's use is no longer recent, and keep their hit and miss counts in
+memory until the next flush.
+"""
+
+from object_database import Schema, Indexed, revisionConflictRetry
+from typed_python import TupleOf, sha_hash
+from research_app.Displayable import Display
+from research_app.CodeSegmentation import Error
+import research_app.BlockDependencies as BlockDependencies
+import research_app.CodeSegmentation as CodeSegmentation
+import research_app.ScriptCheckpoints as ScriptCheckpoints
+
+import logging
+import threading
+import time
+
+schema = Schema("research_app.ResultCache")
+
+# how many bytes of displays the cache holds, unless the service is configured otherwise.
+DEFAULT_RESULT_CACHE_BUDGET_BYTES = 256 * 1024 ** 2
+
+# part of every key. Bump it when the displays that evaluations produce change shape, so
+# that backends stop serving what older backends cached.
+RESULT_CACHE_VERSION = 5
+
+# how stale an entry's 'lastUsed' gets before a lookup updates it. Eviction only needs to
+# know roughly when an entry was last used.
+LAST_USED_RESOLUTION = 60.0
+
+# how often each worker adds its hits and misses to its CacheCounters
+COUNTER_FLUSH_INTERVAL = 10.0
+
+# when the cache is over budget, we evict down to this fraction of it, so that we don't
+# have to evict again on the next store
+EVICTION_TARGET_FRACTION = 0.9
+
+# scripts calling this never get cached, and always run in full
+NOCACHE_FUNCTION = "nocache"
+
+
+@schema.define
+class CachedResult:
+    """The displays a successful evaluation of a script and snippet produced."""
+    key = Indexed(str)
+    displays = TupleOf(Display)
+    byteCount = int
+    lastUsed = float
+
+
+@schema.define
+class CacheCounters:
+    """How many lookups one backend worker made in the cache, and how many of them hit."""
+    worker = Indexed(str)
+    hits = int
+    misses = int
+
+    @staticmethod
+    def totals():
+        """Return the (hits, misses) of every worker's lookups, as of their last flush."""
+        allCounters = CacheCounters.lookupAll()
+        return sum(c.hits for c in allCounters), sum(c.misses for c in allCounters)
+
+
+@schema.define
+class CacheSize:
+    """The bytes of displays every CachedResult holds. There's at most one of these."""
+    byteCount = int
+
+    @staticmethod
+    def current():
+        """Return the CacheSize, creating it from the entries we hold if there isn't one yet."""
+        size = CacheSize.lookupAny()
+
+        if size is None:
+            size = CacheSize(byteCount=sum(e.byteCount for e in CachedResult.lookupAll()))
+
+        return size
+
+
+def displayBytes(display):
+    """Estimate how many bytes Display 'display' holds."""
+    if display.matches.Displays:
+        return len(display.title) + sum(displayBytes(d) for d in display.displays)
+
+    if display.matches.Plot:
+        return len(display.title) + sum(
+            ScriptCheckpoints.estimateBytes(value)
+            for value in list(display.args) + list(display.kwargs.values())
+            )
+
+    if display.matches.Heatmap:
+        return len(display.title) + ScriptCheckpoints.estimateBytes(display.heatmap)
+
+    if display.matches.Histogram:
+        return len(display.title) + ScriptCheckpoints.estimateBytes(display.histogram)
+
+    if display.matches.Density:
+        return len(display.title) + ScriptCheckpoints.estimateBytes(display.density)
+
+    if display.matches.Print:
+        return len(display.title) + len(display.str)
+
+    return len(display.title) + ScriptCheckpoints.estimateBytes(display.object)
+
+
+def keyFor(script, snippet):
+    return sha_hash(f"{RESULT_CACHE_VERSION}:{len(script)}:{script}:{snippet or ''}").hexdigest
+
+
+def isCacheable(script, snippet):
+    """Is evaluating 'script' and 'snippet' deterministic, so that we can cache the result?"""
+    blocks = []
+
+    for code in (script, snippet or ""):
+        blocksOrErr = CodeSegmentation.breakCodeIntoSegments(code)
+
+        if isinstance(blocksOrErr, Error):
+            return False
+
+        blocks.extend(blocksOrErr)
+
+    analyses = BlockDependencies.analyzeBlocks(blocks)
+
+    if analyses is None or callsNocache(analyses):
+        return False
+
+    return BlockDependencies.isDeterministic(analyses)
+
+
+def callsNocache(analyses):
+    """Do blocks with BlockAnalyses 'analyses' call NOCACHE_FUNCTION?"""
+    for analysis in analyses:
+        if NOCACHE_FUNCTION in analysis.uses or any(
+                NOCACHE_FUNCTION in effects.reads for effects in analysis.functionEffects.values()):
+            return True
+
+    return False
+
+
+class ResultCache:
+    def __init__(self, db, budgetBytes, workerId):
+        """A view of the shared cache in 'db', holding up to 'budgetBytes', for worker 'workerId'."""
+        self.db = db
+        self.budgetBytes = budgetBytes
+        self.workerId = workerId
+        self._logger = logging.getLogger(__name__)
+
+        # hits and misses since our last flush
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._lastFlush = time.time()
+
+        self.db.subscribeToSchema(schema)
+
+    def lookup(self, script, snippet):
+        """Return the cached displays for 'script' and 'snippet', or None."""
+        key = keyFor(script, snippet)
+        isStale = False
+
+        with self.db.view():
+            entry = CachedResult.lookupAny(key=key)
+            displays = entry.displays if entry is not None else None
+
+            if entry is not None:
+                isStale = time.time() - entry.lastUsed > LAST_USED_RESOLUTION
+
+        if isStale:
+            self._markUsed(key)
+
+        with self._lock:
+            if displays is not None:
+                self._hits += 1
+            else:
+                self._misses += 1
+
+            isFlushDue = time.time() - self._lastFlush > COUNTER_FLUSH_INTERVAL
+
+        if isFlushDue:
+            self.flushCounters()
+
+        return displays
+
+    @revisionConflictRetry
+    def _markUsed(self, key):
+        with self.db.transaction():
+            entry = CachedResult.lookupAny(key=key)
+
+            if entry is not None and time.time() - entry.lastUsed > LAST_USED_RESOLUTION:
+                entry.lastUsed = time.time()
+
+    @revisionConflictRetry
+    def flushCounters(self):
+        """Add the hits and misses we counted since the last flush to our CacheCounters."""
+        with self._lock:
+            hits, misses = self._hits, self._misses
+            self._lastFlush = time.time()
+
+        if not hits and not misses:
+            return
+
+        with self.db.transaction():
+            counters = CacheCounters.lookupAny(worker=self.workerId)
+            if counters is None:
+                counters = CacheCounters(worker=self.workerId)
+
+            counters.hits = counters.hits + hits
+            counters.misses = counters.misses + misses
+
+        with self._lock:
+            self._hits -= hits
+            self._misses -= misses
+
+    @revisionConflictRetry
+    def store(self, script, snippet, displays):
+        """Cache 'displays' as the result of 'script' and 'snippet', evicting older entries as needed."""
+        byteCount = sum(displayBytes(d) for d in displays)
+
+        if byteCount > self.budgetBytes:
+            self._logger.info("Not caching a result of %s bytes, which exceeds the budget.", byteCount)
+            return
+
+        key = keyFor(script, snippet)
+
+        with self.db.transaction():
+            size = CacheSize.current()
+            entry = CachedResult.lookupAny(key=key)
+
+            if entry is None:
+                entry = CachedResult(key=key)
+
+            size.byteCount = size.byteCount - entry.byteCount + byteCount
+
+            entry.displays = displays
+            entry.byteCount = byteCount
+            entry.lastUsed = time.time()
+
+            if size.byteCount > self.budgetBytes:
+                targetBytes = self.budgetBytes * EVICTION_TARGET_FRACTION
+
+                for evicted in sorted(CachedResult.lookupAll(), key=lambda e: e.lastUsed):
+                    if size.byteCount <= targetBytes:
+                        break
+
+                    if evicted != entry:
+                        size.byteCount = size.byteCount - evicted.byteCount
+                        evicted.delete()
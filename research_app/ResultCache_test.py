@@ -0,0 +1,147 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import contextlib
+import unittest
+import unittest.mock
+
+import research_app.EvaluationSchema_test as EvaluationSchema_test
+import research_app.ResultCache as ResultCache
+from research_app.ResultCache import isCacheable, keyFor
+
+
+def fakeTable(**defaults):
+    """A stand-in for one of our schema's types, holding its instances in memory."""
+    class Table:
+        rows = []
+
+        def __init__(self, **fields):
+            self.__dict__.update(defaults)
+            self.__dict__.update(fields)
+            Table.rows.append(self)
+
+        def delete(self):
+            Table.rows.remove(self)
+
+        @classmethod
+        def lookupAll(cls, **fields):
+            return [row for row in cls.rows if all(getattr(row, k) == v for k, v in fields.items())]
+
+        @classmethod
+        def lookupAny(cls, **fields):
+            rows = cls.lookupAll(**fields)
+            return rows[0] if rows else None
+
+    return Table
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.transactionCount = 0
+
+    def subscribeToSchema(self, schema):
+        pass
+
+    @contextlib.contextmanager
+    def transaction(self):
+        self.transactionCount += 1
+        yield
+
+    @contextlib.contextmanager
+    def view(self):
+        yield
+
+
+class ResultCacheTest(unittest.TestCase):
+    def test_deterministic_scripts_are_cacheable(self):
+        self.assertTrue(isCacheable("xs = numpy.arange(10)\nprint(xs.mean())", None))
+        self.assertTrue(isCacheable("import math\nx = math.sqrt(2)", "x * 2"))
+
+    def test_nondeterministic_scripts_are_not(self):
+        self.assertFalse(isCacheable("x = numpy.random.rand(10)", None))
+        self.assertFalse(isCacheable("def f():\n    return random.random()\nf()", None))
+        self.assertFalse(isCacheable("x = 1", "numpy.save('x.npy', x)"))
+        self.assertFalse(isCacheable("xs = numpy.load('prices.npy')\nprint(xs.mean())", None))
+        self.assertFalse(isCacheable("import pandas\ndf = pandas.read_csv('prices.csv')", None))
+        self.assertFalse(isCacheable("with open('prices.txt') as f:\n    text = f.read()", None))
+        self.assertFalse(isCacheable("import datetime\nprint(datetime.datetime.now())", None))
+        self.assertFalse(isCacheable("def load():\n    return numpy.load('prices.npy')", "load()"))
+        self.assertFalse(isCacheable("nocache()\nx = 1", None))
+        self.assertFalse(isCacheable("x = eval('1')", None))
+        self.assertFalse(isCacheable("x = (", None))
+
+    def test_keys_separate_script_and_snippet(self):
+        self.assertNotEqual(keyFor("x = 1", "x"), keyFor("x = 1x", None))
+        self.assertEqual(keyFor("x = 1", None), keyFor("x = 1", ""))
+
+
+class ResultCacheStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = EvaluationSchema_test.FakeClock()
+        self.db = FakeDatabase()
+
+        CacheSize = fakeTable(byteCount=0)
+        CacheSize.current = staticmethod(ResultCache.CacheSize.current)
+
+        for patcher in [
+                unittest.mock.patch.object(ResultCache, 'time', self.clock),
+                unittest.mock.patch.object(ResultCache, 'CachedResult', fakeTable(byteCount=0, lastUsed=0.0)),
+                unittest.mock.patch.object(ResultCache, 'CacheCounters', fakeTable(hits=0, misses=0)),
+                unittest.mock.patch.object(ResultCache, 'CacheSize', CacheSize),
+                unittest.mock.patch.object(ResultCache, 'displayBytes', lambda display: display)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_lookups_only_write_to_mark_stale_entries_and_flush_counters(self):
+        cache = ResultCache.ResultCache(self.db, 1000, "worker")
+        cache.store("x = 1", None, (10,))
+        transactionCount = self.db.transactionCount
+
+        self.assertEqual(cache.lookup("x = 1", None), (10,))
+        self.assertIsNone(cache.lookup("x = 2", None))
+        self.clock.now += 5
+        self.assertEqual(cache.lookup("x = 1", None), (10,))
+        self.assertEqual(self.db.transactionCount, transactionCount)
+        self.assertIsNone(ResultCache.CacheCounters.lookupAny(worker="worker"))
+
+        # once its use is stale and the counters are due, a lookup writes both
+        self.clock.now += ResultCache.LAST_USED_RESOLUTION
+        self.assertEqual(cache.lookup("x = 1", None), (10,))
+        self.assertEqual(self.db.transactionCount, transactionCount + 2)
+        self.assertEqual(ResultCache.CachedResult.lookupAny(key=keyFor("x = 1", None)).lastUsed, self.clock.now)
+
+        counters = ResultCache.CacheCounters.lookupAny(worker="worker")
+        self.assertEqual((counters.hits, counters.misses), (3, 1))
+
+    def test_stores_keep_a_running_total_and_evict_the_oldest(self):
+        cache = ResultCache.ResultCache(self.db, 100, "worker")
+
+        cache.store("a", None, (40,))
+        self.clock.now += 1
+        cache.store("b", None, (40,))
+
+        # using 'a' makes 'b' the oldest
+        self.clock.now += ResultCache.LAST_USED_RESOLUTION + 1
+        cache.lookup("a", None)
+        cache.store("c", None, (40,))
+
+        self.assertEqual(
+            {entry.key for entry in ResultCache.CachedResult.lookupAll()},
+            {keyFor("a", None), keyFor("c", None)}
+            )
+        self.assertEqual(ResultCache.CacheSize.lookupAny().byteCount, 80)
+
+        # replacing an entry replaces its bytes
+        cache.store("a", None, (10,))
+        self.assertEqual(ResultCache.CacheSize.lookupAny().byteCount, 50)
@@ -0,0 +1,297 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Namespace checkpoints for incremental re-execution of research scripts.
+
+A checkpoint holds a private copy of the variables in scope, and the displays
+produced so far, right after a module-level block finished executing. Checkpoints
+are keyed by a hash chain over the block sources, so the checkpoint for block N
+can only be found again if blocks 0 through N are unchanged.
+"""
+
+from typed_python import sha_hash
+
+import collections
+import copy
+import functools
+import logging
+import numpy
+import sys
+import types
+
+# how much memory we let checkpoints hold, unless the service is configured otherwise.
+DEFAULT_CHECKPOINT_BUDGET_BYTES = 1024 ** 3
+
+# only take a new checkpoint once this much execution time has passed since the last one,
+# so that long runs of cheap blocks don't pay for a namespace copy after every block.
+CHECKPOINT_INTERVAL_SECONDS = 0.1
+
+
+def blockChainHashes(blocks):
+    """Return a list with one hash per CodeBlock, each covering that block and all prior blocks."""
+    res = []
+    prior = ""
+
+    for block in blocks:
+        prior = sha_hash(prior + ":" + str(block.line_range[0]) + ":" + block.code).hexdigest
+        res.append(prior)
+
+    return res
+
+
+def estimateBytes(value, _seen=None):
+    """Estimate the memory held by 'value', including the contents of containers and arrays."""
+    if _seen is None:
+        _seen = set()
+
+    if id(value) in _seen:
+        return 0
+    _seen.add(id(value))
+
+    if isinstance(value, numpy.ndarray):
+        return value.nbytes
+
+    if isinstance(value, (types.ModuleType, type, types.FunctionType)):
+        return 0
+
+    size = sys.getsizeof(value)
+
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += estimateBytes(k, _seen) + estimateBytes(v, _seen)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        for v in value:
+            size += estimateBytes(v, _seen)
+
+    return size
+
+
+class _GlobalFunction:
+    """Marks a function whose globals are the namespace being checkpointed.
+
+    Functions are immutable as far as 'deepcopy' is concerned, but their __globals__ would keep
+    pointing at the namespace of the run that defined them, so we rebind them on restore.
+    """
+    def __init__(self, func):
+        self.func = func
+
+    def bind(self, namespace):
+        func = self.func
+        res = types.FunctionType(
+            func.__code__, namespace, func.__name__, func.__defaults__, func.__closure__
+            )
+        res.__kwdefaults__ = func.__kwdefaults__
+        res.__qualname__ = func.__qualname__
+        res.__dict__.update(func.__dict__)
+        return res
+
+
+# values that can't lead to any functions
+_LEAF_TYPES = (type(None), bool, int, float, complex, str, bytes, numpy.ndarray, numpy.generic, types.ModuleType)
+
+
+def _holdsUnboundFunctions(namespace, excluding):
+    """Do the values of 'namespace' reach functions using it as their globals, other than its plain functions?
+
+    We rebind the functions of the namespace itself when we restore it, but not methods of
+    classes, functions inside containers or closures, partials and the like, which would go
+    on reading the globals of the run that defined them.
+    """
+    stack = []
+    seen = set()
+
+    for name, value in namespace.items():
+        if name in excluding:
+            continue
+
+        if isinstance(value, types.FunctionType) and value.__globals__ is namespace:
+            # these get rebound, but what they hold doesn't, and nor do other references to them
+            stack.extend(_functionContents(value))
+        else:
+            stack.append(value)
+
+    while stack:
+        value = stack.pop()
+
+        if isinstance(value, _LEAF_TYPES) or id(value) in seen:
+            continue
+        seen.add(id(value))
+
+        if isinstance(value, types.FunctionType):
+            if value.__globals__ is namespace:
+                return True
+            stack.extend(_functionContents(value))
+        elif isinstance(value, type):
+            stack.extend(vars(value).values())
+        elif isinstance(value, dict):
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            stack.extend(value)
+        elif isinstance(value, functools.partial):
+            stack.extend((value.func, value.args, value.keywords))
+        elif isinstance(value, (types.MethodType, staticmethod, classmethod)):
+            stack.extend((value.__func__, getattr(value, '__self__', None)))
+        elif isinstance(value, property):
+            stack.extend((value.fget, value.fset, value.fdel))
+        else:
+            stack.append(type(value))
+            stack.append(getattr(value, '__dict__', None))
+            stack.append(getattr(value, '__wrapped__', None))
+
+    return False
+
+
+def _functionContents(func):
+    res = [func.__defaults__, func.__kwdefaults__, func.__dict__]
+
+    for cell in func.__closure__ or ():
+        try:
+            res.append(cell.cell_contents)
+        except ValueError:
+            # the cell is empty
+            pass
+
+    return res
+
+
+def _copyNamespace(namespace, excluding, globalsToRebind):
+    """Deep-copy the values of 'namespace', skipping names in 'excluding'.
+
+    Modules are shared rather than copied. Raises if any value can't be copied.
+    """
+    memo = {}
+    res = {}
+
+    for name, value in namespace.items():
+        if name in excluding:
+            continue
+
+        if isinstance(value, types.ModuleType):
+            memo[id(value)] = value
+            res[name] = value
+        elif isinstance(value, types.FunctionType) and value.__globals__ is globalsToRebind:
+            res[name] = _GlobalFunction(value)
+        elif isinstance(value, _GlobalFunction):
+            res[name] = value
+        else:
+            res[name] = copy.deepcopy(value, memo)
+
+    return res
+
+
+class NamespaceCheckpoint:
+    def __init__(self, variables, displays, byteCount, displayCounts=None):
+        self.variables = variables
+        self.displays = displays
+        self.byteCount = byteCount
+
+        # how many of 'displays' each block produced, if known
+        self.displayCounts = displayCounts
+
+    def displaysPerBlock(self):
+        """Return a list with a tuple of the displays of each checkpointed block, or None if we don't know."""
+        if self.displayCounts is None:
+            return None
+
+        res = []
+        offset = 0
+        for count in self.displayCounts:
+            res.append(tuple(self.displays[offset:offset + count]))
+            offset += count
+
+        return res
+
+    def restoreInto(self, namespace):
+        """Copy the checkpointed variables into 'namespace', leaving the checkpoint itself untouched."""
+        for name, value in _copyNamespace(self.variables, (), None).items():
+            if isinstance(value, _GlobalFunction):
+                value = value.bind(namespace)
+            namespace[name] = value
+
+
+class CheckpointCache:
+    """An LRU cache of NamespaceCheckpoints that holds at most 'budgetBytes' worth of variables."""
+    def __init__(self, budgetBytes=DEFAULT_CHECKPOINT_BUDGET_BYTES):
+        self._logger = logging.getLogger(__name__)
+        self.budgetBytes = budgetBytes
+        self.bytesUsed = 0
+        self._checkpoints = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._checkpoints)
+
+    def __contains__(self, key):
+        return key in self._checkpoints
+
+    def get(self, key):
+        """Return the NamespaceCheckpoint for 'key', or None, marking it as recently used."""
+        checkpoint = self._checkpoints.get(key)
+
+        if checkpoint is not None:
+            self._checkpoints.move_to_end(key)
+
+        return checkpoint
+
+    def latestValidPrefix(self, chainHashes):
+        """Find the longest prefix of a script that we hold a checkpoint for.
+
+        Returns a pair (blockCount, checkpoint), or (0, None) if nothing matches.
+        """
+        for ix in reversed(range(len(chainHashes))):
+            if chainHashes[ix] in self._checkpoints:
+                return ix + 1, self.get(chainHashes[ix])
+
+        return 0, None
+
+    def put(self, key, namespace, displays, excluding=(), displayCounts=None):
+        """Checkpoint the variables in 'namespace' (except 'excluding') and the displays so far.
+
+        'displayCounts', if given, says how many of 'displays' each block produced.
+
+        Returns True if the checkpoint was stored. Namespaces holding values we can't copy,
+        or rebind to the namespace we restore them into, or that are too large for our budget,
+        are skipped.
+        """
+        if key in self._checkpoints:
+            self._checkpoints.move_to_end(key)
+            return True
+
+        if _holdsUnboundFunctions(namespace, excluding):
+            self._logger.info("Not checkpointing namespace because it holds classes or closures bound to it.")
+            return False
+
+        try:
+            variables = _copyNamespace(namespace, excluding, namespace)
+        except Exception as e:
+            self._logger.info("Not checkpointing namespace because it can't be copied: %s", e)
+            return False
+
+        byteCount = estimateBytes(variables)
+
+        if byteCount > self.budgetBytes:
+            return False
+
+        self._checkpoints[key] = NamespaceCheckpoint(
+            variables, tuple(displays), byteCount,
+            tuple(displayCounts) if displayCounts is not None else None
+            )
+        self.bytesUsed += byteCount
+
+        while self.bytesUsed > self.budgetBytes:
+            _, evicted = self._checkpoints.popitem(last=False)
+            self.bytesUsed -= evicted.byteCount
+
+        return True
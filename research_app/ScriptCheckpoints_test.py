@@ -0,0 +1,154 @@
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import numpy
+import tempfile
+import textwrap
+import types
+import unittest
+import unittest.mock
+
+from research_app.ResearchBackend import ResearchBackend
+import research_app.ScriptCheckpoints as ScriptCheckpoints
+from research_app.ScriptCheckpoints import CheckpointCache, blockChainHashes
+
+
+class ScriptCheckpointsTest(unittest.TestCase):
+    def test_chain_hashes_share_unchanged_prefix(self):
+        blocksA = ResearchBackend.breakCodeIntoSegments("x = 1\ny = 2\nz = 3\n")
+        blocksB = ResearchBackend.breakCodeIntoSegments("x = 1\ny = 2\nz = 4\n")
+        blocksC = ResearchBackend.breakCodeIntoSegments("x = 0\ny = 2\nz = 3\n")
+
+        hashesA = blockChainHashes(blocksA)
+
+        self.assertEqual(hashesA[:2], blockChainHashes(blocksB)[:2])
+        self.assertNotEqual(hashesA[2], blockChainHashes(blocksB)[2])
+
+        # a change in the first block invalidates everything after it
+        self.assertFalse(set(hashesA) & set(blockChainHashes(blocksC)))
+
+    def test_restore_is_isolated_from_later_mutation(self):
+        cache = CheckpointCache()
+
+        namespace = {'xs': numpy.arange(3), 'ys': [1, 2]}
+        cache.put("k", namespace, [])
+
+        namespace['xs'] += 10
+        namespace['ys'].append(3)
+
+        restored = {}
+        cache.get("k").restoreInto(restored)
+        self.assertEqual(list(restored['xs']), [0, 1, 2])
+        self.assertEqual(restored['ys'], [1, 2])
+
+        # mutating what we restored doesn't damage the checkpoint either
+        restored['ys'].append(4)
+        restoredAgain = {}
+        cache.get("k").restoreInto(restoredAgain)
+        self.assertEqual(restoredAgain['ys'], [1, 2])
+
+    def test_restored_functions_see_restored_globals(self):
+        namespace = {}
+        exec(textwrap.dedent("""
+            scale = 2
+            def f(x):
+                return x * scale
+            """), namespace)
+
+        cache = CheckpointCache()
+        cache.put("k", namespace, [], excluding=['__builtins__'])
+
+        restored = {'__builtins__': __builtins__}
+        cache.get("k").restoreInto(restored)
+        restored['scale'] = 3
+
+        self.assertEqual(restored['f'](1), 3)
+        self.assertEqual(namespace['f'](1), 2)
+
+    def test_classes_and_closures_bound_to_the_namespace_are_not_checkpointed(self):
+        for definition in [
+                "class A:\n    def f(self):\n        return scale",
+                "def g():\n    return scale\nfs = [g]",
+                "import functools\ndef g(x):\n    return x * scale\nh = functools.partial(g, 1)",
+                "def twice(func):\n    def wrapper():\n        return func() * 2\n    return wrapper\n"
+                "@twice\ndef g():\n    return scale",
+                ]:
+            namespace = {}
+            exec("scale = 2\n" + definition, namespace)
+
+            self.assertFalse(CheckpointCache().put("k", namespace, [], excluding=['__builtins__']), definition)
+
+    def test_class_methods_see_changes_below_a_checkpoint(self):
+        script = "class A:\n    def f(self):\n        return scale\n\nscale = 2\nprint(A().f())\n"
+
+        with tempfile.TemporaryDirectory() as tempDir, \
+                unittest.mock.patch.object(ScriptCheckpoints, 'CHECKPOINT_INTERVAL_SECONDS', -1):
+            runtimeConfig = types.SimpleNamespace(serviceTemporaryStorageRoot=tempDir)
+            cache = CheckpointCache()
+
+            for source, expected in [(script, '2'), (script.replace("scale = 2", "scale = 3"), '3')]:
+                error, displays = ResearchBackend.evaluateResearchScript(
+                    runtimeConfig, source, None, checkpoints=cache
+                    )
+
+                self.assertIsNone(error)
+                self.assertEqual([d.str for d in displays], [expected])
+
+    def test_files_are_read_again_below_a_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tempDir, \
+                unittest.mock.patch.object(ScriptCheckpoints, 'CHECKPOINT_INTERVAL_SECONDS', -1):
+            runtimeConfig = types.SimpleNamespace(serviceTemporaryStorageRoot=tempDir)
+            cache = CheckpointCache()
+            path = tempDir + "/data.npy"
+            script = f"xs = [1]\nvalues = numpy.load({path!r})\nprint(values.sum())\n"
+
+            for count, expected in [(3, '3'), (4, '6')]:
+                numpy.save(path, numpy.arange(count))
+
+                error, displays = ResearchBackend.evaluateResearchScript(
+                    runtimeConfig, script, None, checkpoints=cache
+                    )
+
+                self.assertIsNone(error)
+                self.assertEqual([d.str for d in displays], [expected])
+
+            # only the block before the file gets read is checkpointed
+            blocks = ResearchBackend.breakCodeIntoSegments(script)
+            self.assertEqual(cache.latestValidPrefix(blockChainHashes(blocks))[0], 1)
+
+            # and scripts calling nocache() don't use checkpoints at all
+            script = "ys = [2]\nnocache()\nprint(len(ys))\n"
+            ResearchBackend.evaluateResearchScript(runtimeConfig, script, None, checkpoints=cache)
+
+            blocks = ResearchBackend.breakCodeIntoSegments(script)
+            self.assertEqual(cache.latestValidPrefix(blockChainHashes(blocks)), (0, None))
+
+    def test_eviction_respects_budget(self):
+        cache = CheckpointCache(budgetBytes=3 * 8000)
+
+        for i in range(5):
+            cache.put(str(i), {'xs': numpy.zeros(1000)}, [])
+
+        self.assertLessEqual(cache.bytesUsed, cache.budgetBytes)
+        self.assertTrue("4" in cache)
+        self.assertFalse("0" in cache)
+
+    def test_latest_valid_prefix(self):
+        cache = CheckpointCache()
+        cache.put("a", {'x': 1}, ["d1"])
+        cache.put("c", {'x': 3}, ["d1", "d2", "d3"])
+
+        self.assertEqual(cache.latestValidPrefix(["a", "b", "d"])[0], 1)
+        self.assertEqual(cache.latestValidPrefix(["a", "b", "c"])[1].displays, ("d1", "d2", "d3"))
+        self.assertEqual(cache.latestValidPrefix(["x", "y"]), (0, None))
@@ -0,0 +1,804 @@
+#!/usr/bin/env python3
+
+#   Copyright 2019 APriori Investments
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+"""
+Benchmarks for the research_app evaluation pipeline.
+
+    research_app/evaluation_benchmark.py latency --count 200
+
+measures the time from EvaluationContext.request() until the backend marks the
+evaluation 'Calculating'.
+
+    research_app/evaluation_benchmark.py latency --count 200 --baseline
+
+compares the time from committing work until a backend claims it for ResearchBackend's
+loop, which waits on the database, against the loop it replaced, which looked for work every
+0.25s. Work arrives at random moments, and neither needs a real database.
+
+    research_app/evaluation_benchmark.py scaling --workers 1 2 4 8
+
+measures evaluation throughput with different numbers of ResearchBackend workers.
+
+    research_app/evaluation_benchmark.py blocks --count 2000
+
+measures the per-block overhead of evaluating a script of trivial blocks, without
+checkpoints, both the first time and once its blocks are compiled.
+
+    research_app/evaluation_benchmark.py blocks --count 2000 --baseline
+
+compares just the compiling and executing of those blocks the way displayForBlock used to
+do it (writing each block to a temp file, and compiling it as an expression and then as a
+statement) against CompiledBlocks. This doesn't need a database or the backend.
+
+    research_app/evaluation_benchmark.py branches --branches 8 --threads 1 8
+
+measures the wall time of a script with independent load-and-sort pipelines, evaluated with
+different numbers of block threads.
+
+    research_app/evaluation_benchmark.py snippets --blocks 2000
+
+measures how long snippets take to evaluate against a large module that already ran.
+
+    research_app/evaluation_benchmark.py zoom --points 100000000
+
+measures how long a frontend takes to summarize random viewports of a long plotted series,
+mapped from the chunk store.
+
+    research_app/evaluation_benchmark.py downsample --points 1000000 10000000 100000000
+
+compares the time to downsample a whole plotted series for display by keeping every Nth
+point the way displayForPlot used to, against keeping the min and max of each bucket, with
+and without the series' pyramid.
+
+    research_app/evaluation_benchmark.py transport --series 3
+
+compares the bytes and encoding time of a chart's traces sent as JSON lists of numbers, the
+way they used to be, against traces sent as binary typed arrays.
+
+    research_app/evaluation_benchmark.py candles --points 100000000
+
+measures how long a frontend takes to build the candles of random viewports of a long
+series of ticks and of a long series indexed by numbers, before and after the candles of
+each width are cached.
+
+    research_app/evaluation_benchmark.py outofcore --points 1000000000
+
+measures the time and the peak memory the heap (not counting mapped files) takes to turn a
+memmapped file of float64s into a plotted series with its pyramid, and to move it into the
+chunk store.
+
+    research_app/evaluation_benchmark.py heatmap --size 10000
+
+measures the time to build the pyramid of a correlation matrix of that many instruments,
+and the time and bytes of the trace a frontend sends for the whole matrix and for zoomed
+viewports.
+
+    research_app/evaluation_benchmark.py hist --points 10000000
+
+compares the bytes of a plotted series of that many random values, encoded the way plots
+send them, against the bytes of its histogram, and measures the time to bin the whole of it
+and random zoomed viewports of it.
+"""
+
+import argparse
+import contextlib
+import json
+import numpy
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+
+
+def percentiles(samples):
+    return "p50=%.2fms p99=%.2fms max=%.2fms (n=%s)" % (
+        numpy.percentile(samples, 50) * 1000,
+        numpy.percentile(samples, 99) * 1000,
+        numpy.max(samples) * 1000,
+        len(samples)
+        )
+
+
+def measurePickupLatency(harness, count):
+    """Return a list of seconds elapsed between request() and the backend picking up the work."""
+    import research_app.EvaluationSchema as EvaluationSchema
+    from research_app.ContentSchema import Module
+
+    helper = harness.researchFrontendHelper
+    db = helper.db
+
+    if not db.waitForCondition(Module.lookupAny, timeout=5.0):
+        raise Exception("Never produced a module.")
+
+    samples = []
+
+    for _ in range(count):
+        with db.transaction():
+            module = Module.lookupAny()
+            module.current_buffer = "x = 1"
+            evaluation = EvaluationSchema.EvaluationContext.lookupOrCreate(helper.session, module)
+            evaluation.request(None)
+
+        t0 = time.time()
+
+        if not db.waitForCondition(lambda: evaluation.state in ("Calculating", "Complete"), timeout=5.0):
+            raise Exception("Backend never picked up the evaluation.")
+
+        samples.append(time.time() - t0)
+
+        if not db.waitForCondition(lambda: evaluation.state == "Complete", timeout=5.0):
+            raise Exception("Research script timed out.")
+
+    return samples
+
+
+class CommitNotifyingDatabase:
+    """Just enough of a database connection for ResearchBackend's work loop: waiting conditions are
+    re-checked on each commit."""
+    def __init__(self):
+        self._commits = threading.Condition()
+
+    def commit(self, change):
+        with self._commits:
+            change()
+            self._commits.notify_all()
+
+    def waitForCondition(self, condition, timeout):
+        deadline = time.time() + timeout
+
+        with self._commits:
+            while not condition():
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._commits.wait(remaining)
+
+        return True
+
+    @contextlib.contextmanager
+    def transaction(self):
+        yield
+
+
+def pollForWork(backend, shouldStop):
+    """Look for work the way ResearchBackend.doWork did before it waited on the database."""
+    while not shouldStop.is_set():
+        time.sleep(0.25)
+
+        with backend.db.transaction():
+            if backend._hasPendingWork():
+                backend._claimEvaluation()
+
+
+def measurePickupLatencyAgainstPolling(count):
+    """Return {method: list of seconds between committing work and a backend claiming it}."""
+    from research_app.ResearchBackend import ResearchBackend
+    import logging
+
+    res = {}
+
+    methods = [("polling every 0.25s (before)", pollForWork), ("waiting on commits (after)", ResearchBackend._doWork)]
+
+    for name, loop in methods:
+        pending = []
+        claimed = threading.Event()
+        stop = threading.Event()
+
+        backend = ResearchBackend.__new__(ResearchBackend)
+        backend.db = CommitNotifyingDatabase()
+        backend._logger = logging.getLogger(__name__)
+        backend._lastChunkCollection = float('inf')
+        backend._hasPendingWork = lambda: bool(pending)
+        backend._resultCache = types.SimpleNamespace(flushCounters=lambda: None)
+
+        def claimEvaluation():
+            pending.clear()
+            claimed.set()
+
+        backend._claimEvaluation = claimEvaluation
+
+        worker = threading.Thread(target=loop, args=(backend, stop), daemon=True)
+        worker.start()
+
+        samples = []
+
+        try:
+            for _ in range(count):
+                # arrive at a random point in the polling interval
+                time.sleep(random.uniform(0, 0.25))
+
+                claimed.clear()
+                t0 = time.time()
+                backend.db.commit(lambda: pending.append("evaluation"))
+
+                if not claimed.wait(timeout=5.0):
+                    raise Exception("Backend never picked up the work.")
+
+                samples.append(time.time() - t0)
+        finally:
+            stop.set()
+            backend.db.commit(lambda: None)
+            worker.join()
+
+        res[name] = samples
+
+    return res
+
+
+# a script that keeps one core busy for a while without releasing the GIL
+CPU_BOUND_SCRIPT = """
+total = 0
+for i in range(3000000):
+    total += i
+print(total)
+"""
+
+
+def measureThroughput(harness, evaluationCount):
+    """Request 'evaluationCount' independent evaluations at once and return evaluations per second."""
+    import research_app.EvaluationSchema as EvaluationSchema
+    from research_app.ContentSchema import Module, Project
+
+    db = harness.researchFrontendHelper.db
+
+    with db.transaction():
+        project = Project(name="throughput", created_timestamp=time.time(), last_modified_timestamp=time.time())
+        modules = [
+            Module(
+                name=f"module_{i}",
+                project=project,
+                current_buffer=CPU_BOUND_SCRIPT,
+                created_timestamp=time.time(),
+                last_modified_timestamp=time.time()
+                )
+            for i in range(evaluationCount)
+            ]
+
+    t0 = time.time()
+
+    with db.transaction():
+        evaluations = []
+        for i, module in enumerate(modules):
+            evaluation = EvaluationSchema.EvaluationContext.lookupOrCreate(f"session_{i}", module)
+            evaluation.request(None)
+            evaluations.append(evaluation)
+
+    if not db.waitForCondition(lambda: all(e.state == "Complete" for e in evaluations), timeout=600.0):
+        raise Exception("Evaluations timed out.")
+
+    return evaluationCount / (time.time() - t0)
+
+
+def measureBlockOverhead(blockCount, passes):
+    """Return the seconds per block spent evaluating a 'blockCount'-block script, for each of 'passes' runs."""
+    from research_app.ResearchBackend import ResearchBackend
+
+    script = "\n".join(f"x_{i} = {i}" for i in range(blockCount)) + "\n"
+
+    samples = []
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        runtimeConfig = types.SimpleNamespace(serviceTemporaryStorageRoot=tempDir)
+
+        for _ in range(passes):
+            t0 = time.time()
+            error, _ = ResearchBackend.evaluateResearchScript(runtimeConfig, script, None)
+            samples.append((time.time() - t0) / blockCount)
+
+            if error is not None:
+                raise Exception(error)
+
+    return samples
+
+
+def measureIndependentBranches(branchCount, threadCounts, elementCount):
+    """Return the seconds taken to evaluate 'branchCount' independent pipelines with each of 'threadCounts'."""
+    from research_app.ResearchBackend import ResearchBackend
+
+    res = []
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        runtimeConfig = types.SimpleNamespace(serviceTemporaryStorageRoot=tempDir)
+
+        for i in range(branchCount):
+            numpy.save(f"{tempDir}/data_{i}.npy", numpy.random.rand(elementCount))
+
+        script = "\n".join(
+            f"data_{i} = numpy.load('{tempDir}/data_{i}.npy')\n"
+            f"sorted_{i} = numpy.sort(data_{i})\n"
+            f"print(sorted_{i}[len(sorted_{i}) // 2])"
+            for i in range(branchCount)
+            ) + "\n"
+
+        for threadCount in threadCounts:
+            t0 = time.time()
+            error, _ = ResearchBackend.evaluateResearchScript(runtimeConfig, script, None, threadCount=threadCount)
+            res.append(time.time() - t0)
+
+            if error is not None:
+                raise Exception(error)
+
+    return res
+
+
+def _legacyRunBlock(block, namespace, tempDir):
+    """Run 'block' the way displayForBlock did before CompiledBlocks."""
+    import hashlib
+    import os
+
+    initialNamespace = dict(namespace)
+
+    blockCode = "\n" * (block.line_range[0] - 1) + block.code
+    filename = os.path.join(tempDir, "interactive_" + hashlib.sha1(blockCode.encode()).hexdigest())
+
+    with open(filename, "w") as codeFile:
+        codeFile.write(blockCode)
+
+    try:
+        return eval(compile(blockCode + "\n", filename, "eval"), namespace)
+    except SyntaxError:
+        pass
+
+    exec(compile(blockCode, filename, "exec"), namespace)
+
+    return initialNamespace
+
+
+def measureBlockCompilation(blockCount, passes):
+    """Return {method: list of seconds per block of each pass} to compile and run a 'blockCount'-block script."""
+    import research_app.CompiledBlocks as CompiledBlocks
+
+    script = "\n".join(f"x_{i} = {i}" for i in range(blockCount)) + "\n"
+    blocks = [
+        types.SimpleNamespace(code=f"x_{i} = {i}\n", line_range=(i + 1, i + 2))
+        for i in range(blockCount)
+        ]
+
+    def compiled(namespace, tempDir):
+        filename = CompiledBlocks.registerSource(script)
+        for block in blocks:
+            exec(CompiledBlocks.compileBlock(block, filename).code, namespace)
+
+    def legacy(namespace, tempDir):
+        for block in blocks:
+            _legacyRunBlock(block, namespace, tempDir)
+
+    res = {}
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        methods = [("temp files, compiled twice (before)", legacy), ("compiled once, in memory (after)", compiled)]
+
+        for name, run in methods:
+            res[name] = []
+
+            for _ in range(passes):
+                t0 = time.time()
+                run({}, tempDir)
+                res[name].append((time.time() - t0) / blockCount)
+
+    return res
+
+
+def measureSnippetLatency(blockCount, count):
+    """Return a list of seconds taken to evaluate snippets against a 'blockCount'-block module that already ran."""
+    from research_app.ResearchBackend import ResearchBackend
+    import research_app.BlockDependencies as BlockDependencies
+
+    script = "\n".join(f"x_{i} = numpy.arange({i % 100 + 1})" for i in range(blockCount)) + "\n"
+    retainedRuns = BlockDependencies.RetainedRunCache(1)
+
+    samples = []
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        runtimeConfig = types.SimpleNamespace(serviceTemporaryStorageRoot=tempDir)
+
+        ResearchBackend.evaluateResearchScript(runtimeConfig, script, None, retainedRuns=retainedRuns, scriptKey=0)
+
+        for i in range(count):
+            t0 = time.time()
+            error, _ = ResearchBackend.evaluateResearchScript(
+                runtimeConfig, script, f"x_{i % blockCount}.mean()", retainedRuns=retainedRuns, scriptKey=0
+                )
+            samples.append(time.time() - t0)
+
+            if error is not None:
+                raise Exception(error)
+
+    return samples
+
+
+def measureZoomLatency(pointCount, count):
+    """Return a list of seconds taken to summarize random viewports of a 'pointCount'-point series."""
+    import research_app.ChunkStore as ChunkStore
+    import research_app.PlotPyramid as PlotPyramid
+    import research_app.DisplayForPlot as DisplayForPlot
+
+    samples = []
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        store = ChunkStore.ChunkStore(tempDir)
+
+        series = PlotPyramid.seriesFor(numpy.random.randn(pointCount).cumsum())
+        series = ChunkStore.resolve(ChunkStore.mapArrays(series, store.put))
+
+        for _ in range(count):
+            width = pointCount / 2 ** numpy.random.randint(0, 24)
+            minX = numpy.random.uniform(-width / 2, pointCount - width / 2)
+
+            t0 = time.time()
+            left, right = PlotPyramid.indexRange(series, (minX, minX + width))
+            PlotPyramid.summarize(series, left, right, DisplayForPlot.POINTS_PER_SERIES)
+            samples.append(time.time() - t0)
+
+    return samples
+
+
+def strideDownsample(y, pointsPerSeries):
+    """Keep every Nth point of 'y', the way displayForPlot did before plots had pyramids."""
+    x = numpy.arange(len(y))
+    downsampleRatio = int(numpy.ceil(len(y) / pointsPerSeries))
+    samplePoints = numpy.arange(len(x) // downsampleRatio) * downsampleRatio
+
+    return x[samplePoints[1:]-1], y[samplePoints[1:]-1]
+
+
+def measureDownsampling(pointCount, passes):
+    """Return the median seconds taken to downsample a 'pointCount'-point series, by method."""
+    import research_app.PlotPyramid as PlotPyramid
+    import research_app.DisplayForPlot as DisplayForPlot
+
+    y = numpy.random.randn(pointCount).cumsum()
+    budget = DisplayForPlot.POINTS_PER_SERIES
+
+    def minMax(series):
+        buckets = PlotPyramid.summarize(series, 0, pointCount, budget // 2)
+        return PlotPyramid.peakPreservingLines([buckets])
+
+    methods = [
+        ("stride (before pyramids)", lambda: strideDownsample(y, budget)),
+        ("minmax from pyramid", lambda series=PlotPyramid.seriesFor(y): minMax(series)),
+        ("minmax without pyramid", lambda series=PlotPyramid.asSeries(y): minMax(series))
+        ]
+
+    res = {}
+
+    for name, method in methods:
+        samples = []
+        for _ in range(passes):
+            t0 = time.time()
+            method()
+            samples.append(time.time() - t0)
+        res[name] = numpy.median(samples)
+
+    return res
+
+
+def measureTransport(seriesCount, passes):
+    """Return {method: (bytes, seconds)} for encoding a chart of 'seriesCount' downsampled series."""
+    import research_app.PlotPyramid as PlotPyramid
+    import research_app.PlotEncoding as PlotEncoding
+    import research_app.DisplayForPlot as DisplayForPlot
+
+    allBuckets = []
+    for _ in range(seriesCount):
+        series = PlotPyramid.seriesFor(numpy.random.randn(10000000).cumsum())
+        allBuckets.append(PlotPyramid.summarize(series, 0, len(series.y), DisplayForPlot.POINTS_PER_SERIES // 2))
+
+    traces = [{'x': x, 'y': y} for x, y in PlotPyramid.peakPreservingLines(allBuckets)]
+
+    def asLists():
+        return json.dumps([{k: v.tolist() for k, v in trace.items()} for trace in traces])
+
+    def asTypedArrays():
+        return json.dumps([PlotEncoding.encodeTrace(trace) for trace in traces])
+
+    res = {}
+
+    for name, method in [("json lists", asLists), ("typed arrays", asTypedArrays)]:
+        samples = []
+        for _ in range(passes):
+            t0 = time.time()
+            encoded = method()
+            samples.append(time.time() - t0)
+        res[name] = (len(encoded), numpy.median(samples))
+
+    return res
+
+
+def measureCandles(pointCount, count):
+    """Return {case: list of seconds} to build the candles of random viewports of 'pointCount'-point series."""
+    import research_app.PlotPyramid as PlotPyramid
+    import research_app.PlotCandles as PlotCandles
+    import research_app.DisplayForPlot as DisplayForPlot
+
+    y = numpy.random.randn(pointCount).cumsum()
+
+    # ticks a few milliseconds apart
+    x = numpy.datetime64('2019-01-02T14:30', 'ns') + numpy.cumsum(
+        numpy.random.randint(1, 10, pointCount).astype('timedelta64[ms]')
+        ).astype('timedelta64[ns]')
+
+    cases = [
+        ("ticks", PlotPyramid.seriesFor((x, y)), "benchmark-ticks"),
+        ("indexed", PlotPyramid.seriesFor(y), "benchmark-indexed")
+        ]
+
+    viewports = []
+    for _ in range(count):
+        width = pointCount // 2 ** numpy.random.randint(0, 12)
+        left = numpy.random.randint(0, pointCount - width + 1)
+        viewports.append((left, left + width))
+
+    res = {}
+
+    for name, series, seriesKey in cases:
+        # the first pass computes and caches the candles of the whole series at each width
+        for passName in ("first pass", "second pass"):
+            samples = []
+
+            for left, right in viewports:
+                t0 = time.time()
+                PlotCandles.candles(series, seriesKey, left, right, DisplayForPlot.CANDLES_PER_SERIES)
+                samples.append(time.time() - t0)
+
+            res["%s, %s" % (name, passName)] = samples
+
+    return res
+
+
+def measureOutOfCorePlotting(pointCount):
+    """Return (seconds, peak heap bytes) to plot and externalize a memmapped 'pointCount'-point series."""
+    import os
+    import research_app.ChunkStore as ChunkStore
+    import research_app.PlotPyramid as PlotPyramid
+
+    with tempfile.TemporaryDirectory() as tempDir:
+        path = os.path.join(tempDir, "ticks.f8")
+        ticks = numpy.memmap(path, dtype='f8', mode='w+', shape=(pointCount,))
+
+        for start in range(0, pointCount, PlotPyramid.CHUNK_POINTS):
+            chunk = ticks[start:start + PlotPyramid.CHUNK_POINTS]
+            chunk[:] = numpy.random.randn(len(chunk)).cumsum()
+        ticks.flush()
+        del ticks
+
+        store = ChunkStore.ChunkStore(os.path.join(tempDir, "chunks"))
+        PlotPyramid.SCRATCH_DIRECTORY = tempDir
+
+        tracemalloc.start()
+        t0 = time.time()
+
+        series = PlotPyramid.seriesFor(numpy.memmap(path, dtype='f8', mode='r'))
+        ChunkStore.mapArrays(series, store.put)
+
+        elapsed = time.time() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        del series
+
+    return elapsed, peak
+
+
+def measureHeatmap(size, count):
+    """Return (seconds to build the pyramid, {viewport: (bytes, list of seconds)}) of a 'size' square matrix."""
+    import research_app.HeatmapPyramid as HeatmapPyramid
+    import research_app.DisplayForHeatmap as DisplayForHeatmap
+    import research_app.PlotEncoding as PlotEncoding
+
+    z = numpy.random.rand(size, size) * 2 - 1
+
+    t0 = time.time()
+    heatmap = HeatmapPyramid.heatmapFor(z)
+    buildSeconds = time.time() - t0
+
+    res = {}
+
+    for name, zoom in [("whole matrix", 1), ("1/8 of the matrix", 8), ("1/64 of the matrix", 64)]:
+        samples = []
+
+        for passIx in range(count):
+            width = size / zoom
+            corner = numpy.random.uniform(0, size - width, 2)
+            xyRanges = None if zoom == 1 else ((corner[0], corner[0] + width), (corner[1], corner[1] + width))
+
+            t0 = time.time()
+            encoded = json.dumps(PlotEncoding.encodeTrace(DisplayForHeatmap.heatmapTrace(heatmap, "benchmark", xyRanges)))
+            samples.append(time.time() - t0)
+
+        res[name] = (len(encoded), samples)
+
+    return buildSeconds, res
+
+
+def measureHistogram(pointCount, count):
+    """Return (bytes of the series plotted, bytes of its histogram, seconds to bin it, {viewport: list of seconds})."""
+    import research_app.Histograms as Histograms
+    import research_app.DisplayForHistogram as DisplayForHistogram
+    import research_app.PlotEncoding as PlotEncoding
+
+    values = numpy.random.randn(pointCount)
+
+    seriesBytes = len(json.dumps(PlotEncoding.encodeTrace({'type': 'scattergl', 'y': values})))
+
+    t0 = time.time()
+    histogram = Histograms.histogramFor(values)
+    binSeconds = time.time() - t0
+
+    histogramBytes = len(json.dumps(PlotEncoding.encodeTrace(DisplayForHistogram.histogramTrace(histogram, None))))
+
+    res = {}
+
+    for name, width in [("zoomed to 1 sigma", 1.0), ("zoomed to 0.01 sigma", 0.01)]:
+        samples = []
+
+        for passIx in range(count):
+            lo = numpy.random.uniform(-2, 2 - width)
+
+            t0 = time.time()
+            DisplayForHistogram.histogramTrace(histogram, (lo, lo + width))
+            samples.append(time.time() - t0)
+
+        res[name] = samples
+
+    return seriesBytes, histogramBytes, binSeconds, res
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='benchmark the research_app evaluation pipeline')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    latency = subparsers.add_parser('latency', help="time from request() to 'Calculating'")
+    latency.add_argument('--count', type=int, default=100)
+    latency.add_argument('--baseline', action='store_true', help="compare against polling for work")
+
+    scaling = subparsers.add_parser('scaling', help="evaluation throughput by number of backend workers")
+    scaling.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    scaling.add_argument('--evaluations', type=int, default=32)
+
+    blocks = subparsers.add_parser('blocks', help="per-block overhead of evaluating a long script")
+    blocks.add_argument('--count', type=int, default=2000)
+    blocks.add_argument('--passes', type=int, default=3)
+    blocks.add_argument('--baseline', action='store_true', help="compare against the old way of running blocks")
+
+    branches = subparsers.add_parser('branches', help="wall time of independent pipelines by block threads")
+    branches.add_argument('--branches', type=int, default=8)
+    branches.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+    branches.add_argument('--elements', type=int, default=10000000)
+
+    snippets = subparsers.add_parser('snippets', help="snippet latency against a module that already ran")
+    snippets.add_argument('--blocks', type=int, default=2000)
+    snippets.add_argument('--count', type=int, default=100)
+
+    zoom = subparsers.add_parser('zoom', help="time to summarize a viewport of a long plotted series")
+    zoom.add_argument('--points', type=int, default=100000000)
+    zoom.add_argument('--count', type=int, default=200)
+
+    downsample = subparsers.add_parser('downsample', help="time to downsample a series, by method")
+    downsample.add_argument('--points', type=int, nargs='+', default=[1000000, 10000000, 100000000])
+    downsample.add_argument('--passes', type=int, default=5)
+
+    transport = subparsers.add_parser('transport', help="bytes and encoding time of a chart's traces")
+    transport.add_argument('--series', type=int, default=3)
+    transport.add_argument('--passes', type=int, default=20)
+
+    candles = subparsers.add_parser('candles', help="time to build the candles of a viewport of a long series")
+    candles.add_argument('--points', type=int, default=100000000)
+    candles.add_argument('--count', type=int, default=200)
+
+    outOfCore = subparsers.add_parser('outofcore', help="time and memory to plot a memmap bigger than memory")
+    outOfCore.add_argument('--points', type=int, default=1000000000)
+
+    heatmap = subparsers.add_parser('heatmap', help="time and bytes to show viewports of a big matrix")
+    heatmap.add_argument('--size', type=int, default=10000)
+    heatmap.add_argument('--count', type=int, default=20)
+
+    hist = subparsers.add_parser('hist', help="bytes and time to show the distribution of many values")
+    hist.add_argument('--points', type=int, default=10000000)
+    hist.add_argument('--count', type=int, default=200)
+
+    parsedArgs = parser.parse_args(argv[1:])
+
+    if parsedArgs.command == 'latency' and parsedArgs.baseline:
+        for name, samples in measurePickupLatencyAgainstPolling(parsedArgs.count).items():
+            print("%s: commit -> claimed:" % name, percentiles(samples))
+    elif parsedArgs.command == 'latency':
+        from research_app.ServiceTestHarness import ServiceTestHarness
+
+        harness = ServiceTestHarness()
+        try:
+            harness.researchFrontendHelper.createResearchFrontend()
+            print("request -> Calculating:", percentiles(measurePickupLatency(harness, parsedArgs.count)))
+        finally:
+            harness.shutdown()
+
+    if parsedArgs.command == 'scaling':
+        from research_app.ServiceTestHarness import ServiceTestHarness
+
+        for workerCount in parsedArgs.workers:
+            harness = ServiceTestHarness()
+            try:
+                harness.researchFrontendHelper.createResearchFrontend(backendCount=workerCount)
+                print(
+                    "%s workers: %.2f evaluations/second" %
+                    (workerCount, measureThroughput(harness, parsedArgs.evaluations))
+                    )
+            finally:
+                harness.shutdown()
+
+    if parsedArgs.command == 'blocks' and parsedArgs.baseline:
+        for name, samples in measureBlockCompilation(parsedArgs.count, parsedArgs.passes).items():
+            print("%s: %s us per block, by pass" % (name, ", ".join("%.1f" % (s * 1e6) for s in samples)))
+    elif parsedArgs.command == 'blocks':
+        for passIx, secondsPerBlock in enumerate(measureBlockOverhead(parsedArgs.count, parsedArgs.passes)):
+            print("pass %s: %.1fus per block (%s blocks)" % (passIx, secondsPerBlock * 1e6, parsedArgs.count))
+
+    if parsedArgs.command == 'branches':
+        elapsed = measureIndependentBranches(parsedArgs.branches, parsedArgs.threads, parsedArgs.elements)
+        for threadCount, seconds in zip(parsedArgs.threads, elapsed):
+            print("%s threads: %.2fs for %s branches" % (threadCount, seconds, parsedArgs.branches))
+
+    if parsedArgs.command == 'snippets':
+        print("snippet:", percentiles(measureSnippetLatency(parsedArgs.blocks, parsedArgs.count)))
+
+    if parsedArgs.command == 'zoom':
+        print("zoom:", percentiles(measureZoomLatency(parsedArgs.points, parsedArgs.count)))
+
+    if parsedArgs.command == 'downsample':
+        for pointCount in parsedArgs.points:
+            for name, seconds in measureDownsampling(pointCount, parsedArgs.passes).items():
+                print("%s points, %s: %.2fms" % (pointCount, name, seconds * 1000))
+
+    if parsedArgs.command == 'transport':
+        for name, (byteCount, seconds) in measureTransport(parsedArgs.series, parsedArgs.passes).items():
+            print("%s: %s bytes, %.2fms per chart" % (name, byteCount, seconds * 1000))
+
+    if parsedArgs.command == 'candles':
+        for name, samples in measureCandles(parsedArgs.points, parsedArgs.count).items():
+            print("%s:" % name, percentiles(samples))
+
+    if parsedArgs.command == 'outofcore':
+        seconds, peakBytes = measureOutOfCorePlotting(parsedArgs.points)
+        print(
+            "%s points (%.1fGB): %.1fs, peak heap %.0fMB" %
+            (parsedArgs.points, parsedArgs.points * 8 / 1e9, seconds, peakBytes / 1e6)
+            )
+
+    if parsedArgs.command == 'heatmap':
+        buildSeconds, viewports = measureHeatmap(parsedArgs.size, parsedArgs.count)
+        print("%s x %s matrix (%.0fMB): pyramid in %.2fs" % (
+            parsedArgs.size, parsedArgs.size, parsedArgs.size ** 2 * 8 / 1e6, buildSeconds
+            ))
+        for name, (byteCount, samples) in viewports.items():
+            print("%s: %s bytes," % (name, byteCount), percentiles(samples))
+
+    if parsedArgs.command == 'hist':
+        seriesBytes, histogramBytes, binSeconds, viewports = measureHistogram(parsedArgs.points, parsedArgs.count)
+        print("%s points: %s bytes plotted, %s bytes as a histogram binned in %.2fs" % (
+            parsedArgs.points, seriesBytes, histogramBytes, binSeconds
+            ))
+        for name, samples in viewports.items():
+            print("%s:" % name, percentiles(samples))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))